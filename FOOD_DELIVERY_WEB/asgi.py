@@ -3,6 +3,21 @@ ASGI config for FOOD_DELIVERY_WEB project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Обслужва само потока със събития /order-events/ (accounts.views.order_events),
+който държи връзката отворена. Останалата част от сайта се обслужва от WSGI
+(FOOD_DELIVERY_WEB.wsgi) с няколко worker-а: под ASGI синхронните изгледи
+се изпълняват последователно в една нишка на процеса, а поточните експорти
+(accounts.exports) се буферират изцяло в паметта. Reverse proxy-то насочва
+/order-events/ към ASGI сървъра, а всичко останало - към WSGI, напр.:
+
+    gunicorn FOOD_DELIVERY_WEB.wsgi:application --workers 4
+    uvicorn FOOD_DELIVERY_WEB.asgi:application --workers 2
+
+Понеже промените по поръчките се публикуват от други процеси (WSGI
+worker-ите, manage.py run_dispatch, run_workers), брокерът на известията
+трябва да е общ - accounts.events.RedisBroker (по подразбиране в prod).
+С LocalBroker съобщенията от тези процеси не достигат до абонатите.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
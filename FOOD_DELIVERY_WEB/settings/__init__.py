@@ -0,0 +1,18 @@
+"""
+Настройки на проекта, разделени по профили:
+
+    base.py - общи настройки
+    dev.py  - локална разработка (DEBUG, кеш в паметта)
+    prod.py - продукция (кеширани шаблони, споделен кеш, manifest static, GZip)
+
+Профилът се избира с DJANGO_ENV ('dev' по подразбиране или 'prod').
+Алтернативно DJANGO_SETTINGS_MODULE може да сочи директно към
+FOOD_DELIVERY_WEB.settings.prod.
+"""
+
+import os
+
+if os.environ.get('DJANGO_ENV', 'dev') == 'prod':
+    from .prod import *  # noqa: F401,F403
+else:
+    from .dev import *  # noqa: F401,F403
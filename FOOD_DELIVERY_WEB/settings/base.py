@@ -0,0 +1,275 @@
+"""
+Django settings for FOOD_DELIVERY_WEB project - общи настройки за всички профили.
+
+Профилите dev.py и prod.py надграждат този модул; кой профил се зарежда,
+се определя от променливата на средата DJANGO_ENV (вижте __init__.py).
+
+Generated by 'django-admin startproject' using Django 5.2.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.2/topics/settings/
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/5.2/ref/settings/
+"""
+
+import os
+from pathlib import Path
+
+from django.core.exceptions import ImproperlyConfigured
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+
+def env_bool(name, default=False):
+    """
+    Чете булева стойност от променлива на средата ('1', 'true', 'yes', 'on').
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_int(name, default):
+    """
+    Чете цяло число от променлива на средата.
+    """
+    value = os.environ.get(name)
+    return default if value in (None, '') else int(value)
+
+
+def env_list(name, default=()):
+    """
+    Чете списък, разделен със запетаи, от променлива на средата.
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return list(default)
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+# Хостове, при които DEBUG е допустим (локална разработка и тестове)
+DEBUG_LOCAL_HOSTS = ['localhost', '127.0.0.1', '[::1]', '.localhost', 'testserver']
+
+
+def require_local_hosts_for_debug(debug, allowed_hosts):
+    """
+    Спира зареждането на настройките, ако DEBUG е включен при нелокални хостове.
+
+    Проверката accounts.E001 прави същото при стартиране като втора защита
+    (например при override на настройките след зареждането им).
+
+    Raises:
+        ImproperlyConfigured: При DEBUG и публичен хост в allowed_hosts.
+    """
+    hosts = [host for host in allowed_hosts if host not in DEBUG_LOCAL_HOSTS]
+    if debug and hosts:
+        raise ImproperlyConfigured(
+            "DEBUG е включен при продукционни хостове: " + ', '.join(hosts)
+            + ". Задайте DJANGO_DEBUG=0 или използвайте само локални хостове в DJANGO_ALLOWED_HOSTS."
+        )
+
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = os.environ.get(
+    'DJANGO_SECRET_KEY',
+    'django-insecure-dj4l9&4uweem67c6(0yzrlvm6#a8h(z+8!-6n4#er5mgzgh0wb',
+)
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = env_bool('DJANGO_DEBUG', False)
+
+ALLOWED_HOSTS = env_list('DJANGO_ALLOWED_HOSTS')
+
+
+# Application definition
+
+INSTALLED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'accounts.apps.AccountsConfig',
+]
+
+MIDDLEWARE = [
+    # Първи, за да измерва цялата заявка (accounts.metrics)
+    'accounts.middleware.RequestMetricsMiddleware',
+    # Четене след запис от основната база (accounts.routers)
+    'accounts.middleware.ReplicaRouterMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+ROOT_URLCONF = 'FOOD_DELIVERY_WEB.urls'
+
+TEMPLATES = [
+    {
+        # DjangoTemplates с измерване на времето за рендериране
+        'BACKEND': 'accounts.metrics.InstrumentedDjangoTemplates',
+        'DIRS': [BASE_DIR / 'templates']
+        ,
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+                'accounts.context_processors.cart_badge',
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = 'FOOD_DELIVERY_WEB.wsgi.application'
+
+
+# Database
+# https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+
+# DATABASES = {
+#     'default': {
+#         'ENGINE': 'django.db.backends.sqlite3',
+#         'NAME': BASE_DIR / 'db.sqlite3',
+#     }
+# }
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DB_NAME', 'the_delivery_web'),  # Името на базата данни
+        'USER': os.environ.get('DB_USER', 'postgres'),           # Потребителско име за PostgreSQL
+        'PASSWORD': os.environ.get('DB_PASSWORD', 'root123'),  # Паролата за PostgreSQL
+        'HOST': os.environ.get('DB_HOST', 'localhost'),          # Хост, обикновено е localhost
+        'PORT': os.environ.get('DB_PORT', '5432'),               # Порт, по подразбиране е 5432
+        # Постоянни връзки: една връзка се преизползва от заявките на нишката
+        # до DB_CONN_MAX_AGE секунди (0 = нова връзка за всяка заявка)
+        'CONN_MAX_AGE': env_int('DB_CONN_MAX_AGE', 60),
+        # Проверка дали преизползваната връзка е жива преди първата заявка
+        'CONN_HEALTH_CHECKS': env_bool('DB_CONN_HEALTH_CHECKS', True),
+        'OPTIONS': {},
+    }
+}
+
+# Пул от връзки на psycopg 3 (изисква psycopg[pool]); несъвместим с CONN_MAX_AGE > 0
+if env_bool('DB_POOL'):
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': env_int('DB_POOL_MIN_SIZE', 2),
+        'max_size': env_int('DB_POOL_MAX_SIZE', 10),
+        'timeout': env_int('DB_POOL_TIMEOUT', 10),
+    }
+
+# Реплика само за четене за справките и таблата (accounts.routers); включва се
+# с DB_REPLICA_HOST. При тестове заявките към нея отиват към основната база.
+if os.environ.get('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ['DB_REPLICA_HOST'],
+        'PORT': os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'OPTIONS': {**DATABASES['default']['OPTIONS']},
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['accounts.routers.ReplicaRouter']
+
+# Секунди след запис, през които четенията на потребителя остават на основната база
+REPLICA_STICKY_SECONDS = env_int('DB_REPLICA_STICKY_SECONDS', 5)
+
+
+# Password validation
+# https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/5.2/topics/i18n/
+
+LANGUAGE_CODE = 'en-us'
+
+TIME_ZONE = 'UTC'
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/5.2/howto/static-files/
+
+STATIC_URL = 'static/'
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+AUTH_USER_MODEL = 'accounts.User'
+
+# Колко секунди (най-много) един процес може да използва кеширана бонус настройка
+BONUS_SETTINGS_CACHE_TTL = 60
+
+# Колко секунди се пази кешираното меню (обезсилва се и при всяка промяна)
+CATALOG_CACHE_TTL = 60 * 60
+
+# Хранилище на количката (accounts.cart): DatabaseCart (CartItem) или CacheCart
+# (споделеният кеш, записва се в CartItem при плащане или с manage.py flush_carts)
+CART_BACKEND = os.environ.get('DJANGO_CART_BACKEND', 'accounts.cart.DatabaseCart')
+CART_CACHE_TTL = 7 * 24 * 60 * 60  # Живот на кешираната количка (секунди)
+CART_IDLE_FLUSH_SECONDS = env_int('DJANGO_CART_IDLE_FLUSH_SECONDS', 15 * 60)
+CART_BADGE_CACHE_TTL = 60 * 60  # Живот на кешираната значка на количката (секунди)
+
+
+# Автоматично разпределяне на поръчки (accounts.dispatch)
+DISPATCH_INTERVAL = 5  # Секунди между две партиди
+DISPATCH_BATCH_SIZE = 1000  # Максимален брой поръчки в партида
+DISPATCH_DISTANCE_FUNCTION = 'accounts.dispatch.haversine_km'
+DISPATCH_GEOCODER = None  # Dotted path към функция address -> (lat, lon) | None
+
+
+# Фонови задачи (accounts.jobs), изпълнявани от manage.py run_workers
+JOBS_EAGER = env_bool('DJANGO_JOBS_EAGER', False)  # Изпълнение веднага при добавяне, без worker-и
+JOBS_WORKER_PROCESSES = env_int('DJANGO_JOBS_WORKER_PROCESSES', 2)  # Брой процеси на run_workers
+JOBS_POLL_INTERVAL = 1  # Секунди изчакване при празна опашка
+JOBS_RETRY_BACKOFF = 10  # Секунди до първия повторен опит (удвоява се при всеки следващ)
+JOBS_RETRY_BACKOFF_MAX = 60 * 60  # Най-голямото забавяне между опитите
+JOBS_LEASE_TIMEOUT = 5 * 60  # Секунди, за които се наема задача извън транзакция (имейли)
+JOBS_FAILED_RETENTION = env_int('DJANGO_JOBS_FAILED_RETENTION', 30)  # Дни до изтриване на неуспешните задачи
+JOBS_MAINTENANCE_INTERVAL = 60  # Секунди между поддръжките в run_workers (суми на доставчиците, стари задачи)
+
+
+# Известия в реално време (accounts.events), обслужвани от ASGI приложението
+ASGI_APPLICATION = 'FOOD_DELIVERY_WEB.asgi.application'
+# Dotted path към брокер с publish/subscribe (LocalBroker - само в рамките на един процес)
+EVENTS_BROKER = os.environ.get('DJANGO_EVENTS_BROKER', 'accounts.events.LocalBroker')
+EVENTS_REDIS_URL = os.environ.get('DJANGO_EVENTS_REDIS_URL', 'redis://127.0.0.1:6379/2')  # За RedisBroker
+
+
+# Метрики на заявките (accounts.metrics, accounts.middleware)
+METRICS_SERVER_TIMING = env_bool('METRICS_SERVER_TIMING', True)  # Заглавка Server-Timing
+METRICS_QUERY_LOG_THRESHOLD = env_int('METRICS_QUERY_LOG_THRESHOLD', 50)  # Логване на SQL над N заявки
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')  # Bearer токен за /metrics/ (иначе само за служители)
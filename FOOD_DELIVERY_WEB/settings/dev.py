@@ -0,0 +1,22 @@
+"""
+Профил за локална разработка.
+"""
+
+from .base import *  # noqa: F401,F403
+from .base import env_bool, env_list, require_local_hosts_for_debug
+
+DEBUG = env_bool('DJANGO_DEBUG', True)
+
+ALLOWED_HOSTS = env_list('DJANGO_ALLOWED_HOSTS', ['localhost', '127.0.0.1', '[::1]'])
+require_local_hosts_for_debug(DEBUG, ALLOWED_HOSTS)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Фоновите задачи се изпълняват веднага (без manage.py run_workers), а
+# имейлите се отпечатват в конзолата
+JOBS_EAGER = env_bool('DJANGO_JOBS_EAGER', True)
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
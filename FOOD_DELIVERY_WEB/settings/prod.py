@@ -0,0 +1,94 @@
+"""
+Профил за продукция.
+
+Всички стойности, които зависят от средата, се четат от променливи на
+средата. DJANGO_SECRET_KEY и DJANGO_ALLOWED_HOSTS са задължителни, а DEBUG
+е допустим само при локални хостове.
+"""
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .base import *  # noqa: F401,F403
+from .base import BASE_DIR, MIDDLEWARE, TEMPLATES, env_bool, env_int, env_list, require_local_hosts_for_debug
+
+DEBUG = env_bool('DJANGO_DEBUG', False)
+
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY')
+if not SECRET_KEY:
+    raise ImproperlyConfigured("DJANGO_SECRET_KEY е задължителна в продукционния профил.")
+
+ALLOWED_HOSTS = env_list('DJANGO_ALLOWED_HOSTS')
+if not ALLOWED_HOSTS:
+    raise ImproperlyConfigured("DJANGO_ALLOWED_HOSTS е задължителна в продукционния профил.")
+require_local_hosts_for_debug(DEBUG, ALLOWED_HOSTS)
+
+CSRF_TRUSTED_ORIGINS = env_list('DJANGO_CSRF_TRUSTED_ORIGINS')
+
+# Компресиране на отговорите - веднага след SecurityMiddleware, преди
+# всички middleware, които четат или променят съдържанието
+_gzip_position = MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1
+MIDDLEWARE = [
+    *MIDDLEWARE[:_gzip_position],
+    'django.middleware.gzip.GZipMiddleware',
+    *MIDDLEWARE[_gzip_position:],
+]
+
+# Шаблоните се компилират веднъж на процес (loaders изисква APP_DIRS=False)
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        'APP_DIRS': False,
+        'OPTIONS': {
+            **TEMPLATES[0]['OPTIONS'],
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
+        },
+    },
+]
+
+# Споделен кеш за всички worker-и (бонус настройки, меню, версии на ключовете)
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.redis.RedisCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+        'TIMEOUT': env_int('DJANGO_CACHE_TIMEOUT', 300),
+    }
+}
+
+# Количките са в споделения кеш, а не в базата (accounts.cart.CacheCart)
+CART_BACKEND = os.environ.get('DJANGO_CART_BACKEND', 'accounts.cart.CacheCart')
+
+# Статичните файлове се събират с collectstatic и получават хеш в името
+STATIC_ROOT = os.environ.get('DJANGO_STATIC_ROOT', str(BASE_DIR / 'staticfiles'))
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage',
+    },
+}
+
+# Сайтът (WSGI), /order-events/ (ASGI), run_dispatch и run_workers са отделни
+# процеси - известията минават през Redis pub/sub (вижте FOOD_DELIVERY_WEB/asgi.py)
+EVENTS_BROKER = os.environ.get('DJANGO_EVENTS_BROKER', 'accounts.events.RedisBroker')
+
+# Имейл известията (accounts.jobs) се изпращат през SMTP сървър
+EMAIL_BACKEND = os.environ.get('DJANGO_EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.environ.get('DJANGO_EMAIL_HOST', 'localhost')
+EMAIL_PORT = env_int('DJANGO_EMAIL_PORT', 587)
+EMAIL_HOST_USER = os.environ.get('DJANGO_EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('DJANGO_EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = env_bool('DJANGO_EMAIL_USE_TLS', True)
+EMAIL_TIMEOUT = env_int('DJANGO_EMAIL_TIMEOUT', 10)
+DEFAULT_FROM_EMAIL = os.environ.get('DJANGO_DEFAULT_FROM_EMAIL', 'webmaster@localhost')
+
+SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+SESSION_COOKIE_SECURE = env_bool('DJANGO_SECURE_COOKIES', True)
+CSRF_COOKIE_SECURE = env_bool('DJANGO_SECURE_COOKIES', True)
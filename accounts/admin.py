@@ -25,7 +25,8 @@ from django.db.models import Sum
 from datetime import datetime
 from .models import Order
 from django.contrib import admin
-from django.db.models import Sum
+from django.db.models import Min, Sum
+from django.utils import timezone
 from django import forms
 from django.contrib import messages
 from .models import Order
@@ -34,8 +35,13 @@ from django.http import HttpResponse
 import csv
 from .models import (
     User, Client, Employee, DeliveryPerson,
-    Category, Restaurant, Product, Order, OrderItem, Delivery
+    Category, Restaurant, Product, Order, OrderItem, Delivery, DailyTurnover, BonusPayout,
+    CourierLedgerEntry, Job,
 )
+from .exports import export_response
+from .ledger import courier_totals, with_courier_totals
+from .rollups import turnover_totals
+from .routers import replica_reads
 
 # Регистрация на всички модели в admin панела
 
@@ -50,6 +56,21 @@ class DateRangeForm(forms.Form):
     )
 
 
+class ExportForm(DateRangeForm):
+    dataset = forms.ChoiceField(
+        label="Данни",
+        choices=[
+            ('orders', 'Поръчки'),
+            ('order_items', 'Артикули от поръчки'),
+            ('courier_earnings', 'Приходи по доставчици'),
+        ]
+    )
+    export_format = forms.ChoiceField(
+        label="Формат",
+        choices=[('csv', 'CSV'), ('jsonl', 'JSON Lines')]
+    )
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'client', 'total_price', 'status', 'created_at')
@@ -62,9 +83,11 @@ class OrderAdmin(admin.ModelAdmin):
         urls = super().get_urls()
         custom_urls = [
             path('revenue-report/', self.admin_site.admin_view(self.revenue_report), name='revenue_report'),
+            path('export/', self.admin_site.admin_view(self.export_view), name='order_export'),
         ]
         return custom_urls + urls
 
+    @replica_reads
     def revenue_report(self, request):
         form = DateRangeForm(request.POST or None)
 
@@ -72,10 +95,7 @@ class OrderAdmin(admin.ModelAdmin):
             start_date = form.cleaned_data['start_date']
             end_date = form.cleaned_data['end_date']
 
-            total = Order.objects.filter(
-                created_at__date__range=[start_date, end_date],
-                status='delivered'
-            ).aggregate(total=Sum('total_price'))['total'] or 0
+            total = turnover_totals(start_date, end_date)['total']
 
             messages.success(
                 request,
@@ -90,6 +110,27 @@ class OrderAdmin(admin.ModelAdmin):
         }
         return render(request, 'admin/revenue_report.html', context)
 
+    def export_view(self, request):
+        """
+        Поточен експорт на поръчки, артикули или приходи по доставчици за период.
+        """
+        form = ExportForm(request.GET or None)
+
+        if form.is_valid():
+            return export_response(
+                form.cleaned_data['dataset'],
+                form.cleaned_data['export_format'],
+                form.cleaned_data['start_date'],
+                form.cleaned_data['end_date'],
+            )
+
+        context = {
+            'form': form,
+            'title': 'Експорт на данни',
+            'opts': self.model._meta,
+        }
+        return render(request, 'admin/export_form.html', context)
+
 
 def supplier_income_report(self, request):
     form = DateRangeForm(request.POST or None)
@@ -127,26 +168,45 @@ def supplier_income_report(self, request):
 
 
 def export_to_csv(modeladmin, request, queryset):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="delivery_earnings.csv"'
-
-    writer = csv.writer(response)
-    writer.writerow(['Доставчик', 'Период', 'Приходи', 'Брой поръчки'])
-
-    for item in queryset:
-        writer.writerow([
-            item.delivery_person,
-            f"{item.start_date} до {item.end_date}",
-            item.total_earnings,
-            item.order_count
-        ])
-    return response
+    """
+    Поточен CSV експорт на приходите на избраните доставчици за цялата история.
+    """
+    # Дните в DailyTurnover са по местното време (TIME_ZONE), не по UTC
+    today = timezone.localdate()
+    first_day = DailyTurnover.objects.aggregate(first=Min('day'))['first'] or today
+    return export_response(
+        'courier_earnings',
+        'csv',
+        first_day,
+        today,
+        delivery_person_ids=list(queryset.values_list('pk', flat=True)),
+    )
+
+
+export_to_csv.short_description = "Експорт на приходите (CSV)"
 
 
 @admin.register(DeliveryPerson)
 class DeliveryPersonAdmin(admin.ModelAdmin):
-    list_display = ('user', 'vehicle_type', 'earnings_report_link', 'total_bonuses', 'total_turnover')
-    readonly_fields = ('total_bonuses',)
+    list_display = ('user', 'vehicle_type', 'earnings_report_link', 'current_bonuses', 'current_turnover')
+    readonly_fields = ('total_bonuses', 'current_bonuses', 'current_turnover')
+    actions = [export_to_csv]
+
+    def get_queryset(self, request):
+        # Точните суми (кеш + неотчетени записи от журнала) с една заявка
+        return with_courier_totals(super().get_queryset(request))
+
+    def current_bonuses(self, obj):
+        return obj.current_bonuses
+
+    current_bonuses.short_description = "Бонуси"
+    current_bonuses.admin_order_field = 'current_bonuses'
+
+    def current_turnover(self, obj):
+        return obj.current_turnover
+
+    current_turnover.short_description = "Оборот"
+    current_turnover.admin_order_field = 'current_turnover'
 
     def get_urls(self):
         urls = super().get_urls()
@@ -165,6 +225,7 @@ class DeliveryPersonAdmin(admin.ModelAdmin):
 
     earnings_report_link.short_description = "Действия"
 
+    @replica_reads
     def earnings_report(self, request, object_id):
         delivery_person = get_object_or_404(DeliveryPerson, pk=object_id)
 
@@ -172,16 +233,12 @@ class DeliveryPersonAdmin(admin.ModelAdmin):
             start_date = request.POST.get('start_date')
             end_date = request.POST.get('end_date')
 
-            # Изчисляване на оборота за периода
-            period_orders = Order.objects.filter(
-                delivery_person=delivery_person,
-                created_at__date__range=[start_date, end_date],
-                status='delivered'
-            )
-            period_turnover = period_orders.aggregate(total=Sum('total_price'))['total'] or 0
+            # Изчисляване на оборота за периода от дневните обобщения
+            period_totals = turnover_totals(start_date, end_date, delivery_person=delivery_person)
+            period_turnover = period_totals['total']
 
-            # Общ оборот (от total_turnover полето в DeliveryPerson)
-            total_turnover = delivery_person.total_turnover
+            # Общ оборот (кешираната сума плюс неотчетените записи от журнала)
+            total_turnover = courier_totals(delivery_person.pk)['turnover']
 
             context = {
                 'delivery_person': delivery_person,
@@ -189,7 +246,7 @@ class DeliveryPersonAdmin(admin.ModelAdmin):
                 'end_date': end_date,
                 'period_turnover': period_turnover,  # Оборот за периода
                 'total_turnover': total_turnover,  # Общ оборот (цялата история)
-                'order_count': period_orders.count()
+                'order_count': period_totals['order_count']
             }
             return render(request, 'admin/delivery_earnings_report.html', context)
 
@@ -216,3 +273,62 @@ admin.site.register(Product)
 admin.site.register(OrderItem)
 admin.site.register(Delivery)
 
+
+@admin.register(DailyTurnover)
+class DailyTurnoverAdmin(admin.ModelAdmin):
+    list_display = ('day', 'delivery_person', 'restaurant', 'status', 'order_count', 'total_price')
+    list_filter = ('status',)
+    date_hierarchy = 'day'
+
+
+
+@admin.register(BonusPayout)
+class BonusPayoutAdmin(admin.ModelAdmin):
+    list_display = ('delivery_person', 'period_start', 'period_end', 'turnover', 'amount', 'created_at')
+    list_filter = ('period_start',)
+
+
+@admin.register(CourierLedgerEntry)
+class CourierLedgerEntryAdmin(admin.ModelAdmin):
+    """
+    Журналът е само за добавяне: записите не се редактират и не се трият,
+    защото отчетените (applied) вече са в кешираните суми на доставчика.
+    Корекциите се правят с нов (компенсиращ) запис или с действието за сторно.
+    """
+    list_display = ('delivery_person', 'kind', 'amount', 'order', 'created_at', 'applied')
+    list_filter = ('kind', 'applied')
+    raw_id_fields = ('delivery_person', 'order')
+    fields = ('delivery_person', 'kind', 'amount', 'order')
+    actions = ['reverse_entries']
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description="Сторнирай избраните записи", permissions=['add'])
+    def reverse_entries(self, request, queryset):
+        entries = CourierLedgerEntry.objects.bulk_create([
+            CourierLedgerEntry(
+                delivery_person_id=entry.delivery_person_id,
+                kind=entry.kind,
+                amount=-entry.amount,
+                order_id=entry.order_id,
+            )
+            for entry in queryset
+        ])
+        messages.success(request, f"Добавени са {len(entries)} компенсиращи записа.")
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'max_attempts', 'run_at', 'created_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('last_error',)
+    actions = ['retry_jobs']
+
+    @admin.action(description="Изпълни отново избраните задачи")
+    def retry_jobs(self, request, queryset):
+        updated = queryset.update(status='queued', attempts=0, run_at=timezone.now())
+        messages.success(request, f"{updated} задачи са върнати в опашката.")
@@ -0,0 +1,414 @@
+"""
+JSON API за мобилното приложение и партньорски интеграции.
+
+Изгледите връщат само данни (без HTML шаблони) и поддържат:
+    - избор на полета: ?fields=id,name,price
+    - условни заявки: ETag в отговора и 304 Not Modified при съвпадащ If-None-Match
+    - курсорна (keyset) пагинация: ?cursor=...&limit=... и "next_cursor" в отговора
+
+Удостоверяването е чрез сесията (както при HTML изгледите); заявките,
+които променят данни, изискват CSRF токен. Грешките се връщат като
+{"error": "..."} със съответния HTTP статус.
+"""
+
+import hashlib
+import json
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+from .cache import get_catalog_page, get_catalog_version
+from .cart import CartBusyError, get_cart
+from .dispatch import claim_next_order, claim_order
+from .forms import CheckoutForm
+from .models import Client, Order, OrderItem, Product
+from .pagination import InvalidCursor, keyset_paginate
+from .search import search_products
+from .services import EmptyCartError
+
+
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
+PRODUCT_FIELDS = (
+    'id', 'name', 'description', 'price', 'category', 'category_display', 'restaurant_id', 'restaurant_name',
+)
+PRODUCT_DEFAULT_FIELDS = ('id', 'name', 'price', 'category', 'restaurant_name')
+
+ORDER_FIELDS = {
+    'id': lambda order: order.id,
+    'status': lambda order: order.status,
+    'total_price': lambda order: order.total_price,
+    'created_at': lambda order: order.created_at,
+    'address': lambda order: order.address,
+    'phone_number': lambda order: order.phone_number,
+    'delivery_person_id': lambda order: order.delivery_person_id,
+    'items': lambda order: [
+        {
+            'product_id': item.product_id,
+            'name': item.product.name,
+            'quantity': item.quantity,
+            'price': item.price,
+        }
+        for item in order.items.all()
+    ],
+}
+ORDER_DEFAULT_FIELDS = ('id', 'status', 'total_price', 'created_at')
+
+
+class ApiError(Exception):
+    """
+    Грешка, която се връща на клиента като JSON със зададения HTTP статус.
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _dumps(payload):
+    return json.dumps(payload, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def _error(status, message):
+    return HttpResponse(_dumps({'error': message}), status=status, content_type='application/json')
+
+
+def _if_none_match(request, etag):
+    """
+    Проверява ETag срещу If-None-Match и връща 304 отговор при съвпадение (иначе None).
+    """
+    if etag not in parse_etags(request.headers.get('If-None-Match', '')):
+        return None
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def json_response(request, payload, status=200, etag=None):
+    """
+    Сериализира payload и добавя ETag; при съвпадение с If-None-Match връща 304.
+
+    Без зададен etag той се изчислява от тялото на отговора.
+    """
+    body = _dumps(payload).encode()
+    if request.method != 'GET' or status != 200:
+        return HttpResponse(body, status=status, content_type='application/json')
+
+    etag = etag or f'"{hashlib.md5(body).hexdigest()}"'
+    response = _if_none_match(request, etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def api_view(methods, role=None):
+    """
+    Декоратор за API изгледи: проверява метода, удостоверяването и ролята.
+
+    Args:
+        methods (tuple): Позволените HTTP методи.
+        role (str | None): 'client' или 'delivery_person' - изисквана роля на потребителя.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                response = _error(405, "Методът не е позволен.")
+                response['Allow'] = ', '.join(methods)
+                return response
+            if not request.user.is_authenticated:
+                return _error(401, "Необходимо е удостоверяване.")
+            if role and not getattr(request.user, f'is_{role}', False):
+                return _error(403, "Нямате достъп до този ресурс.")
+            try:
+                return view(request, *args, **kwargs)
+            except ApiError as exc:
+                return _error(exc.status, exc.message)
+            except CartBusyError as exc:
+                response = _error(503, str(exc))
+                response['Retry-After'] = '1'
+                return response
+        return wrapper
+    return decorator
+
+
+def _json_body(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        raise ApiError(400, "Невалиден JSON.")
+    if not isinstance(data, dict):
+        raise ApiError(400, "Очаква се JSON обект.")
+    return data
+
+
+def _selected_fields(request, available, default):
+    """
+    Връща полетата от ?fields=..., ограничени до позволените.
+    """
+    raw = request.GET.get('fields')
+    if not raw:
+        return list(default)
+    fields = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise ApiError(400, f"Непознати полета: {', '.join(unknown)}")
+    return fields
+
+
+def _page_size(request):
+    try:
+        size = int(request.GET.get('limit', API_PAGE_SIZE))
+    except ValueError:
+        raise ApiError(400, "Невалиден limit.")
+    return max(1, min(size, API_MAX_PAGE_SIZE))
+
+
+def _positive_int(value, name):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"Невалидна стойност за {name}.")
+    if value < 1:
+        raise ApiError(400, f"{name} трябва да е положително число.")
+    return value
+
+
+def _paginate(request, queryset, ordering):
+    try:
+        return keyset_paginate(
+            queryset, cursor=request.GET.get('cursor'), page_size=_page_size(request), ordering=ordering,
+        )
+    except InvalidCursor:
+        raise ApiError(400, "Невалиден курсор.")
+
+
+def _serialize_orders(orders, fields):
+    return [{field: ORDER_FIELDS[field](order) for field in fields} for order in orders]
+
+
+def _orders_queryset(fields):
+    orders = Order.objects.all()
+    if 'items' in fields:
+        orders = orders.prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+        )
+    return orders
+
+
+# --- Каталог ---
+
+@api_view(('GET',))
+def products(request):
+    """
+    Страница от менюто (или резултати от търсене при ?q=).
+
+    Страниците се четат с keyset заявка и се кешират под версията на менюто;
+    ETag-ът зависи само от версията и параметрите, така че 304 не изисква
+    четене на данни. Параметри: category, q, fields, cursor, limit.
+    """
+    fields = _selected_fields(request, PRODUCT_FIELDS, PRODUCT_DEFAULT_FIELDS)
+    category = request.GET.get('category')
+    query = request.GET.get('q', '').strip()
+    limit = _page_size(request)
+
+    etag = None
+    next_cursor = None
+    if query:
+        # Резултатите от търсенето са подредени по релевантност - една страница
+        rows = search_products(query, category=category, limit=limit)
+    else:
+        cursor = request.GET.get('cursor') or ''
+        # ETag от версията на менюто и параметрите: 304 без четене на страницата
+        key = '|'.join([category or '', cursor, str(limit), ','.join(fields)])
+        etag = f'"catalog-{get_catalog_version()}-{hashlib.md5(key.encode()).hexdigest()}"'
+        not_modified = _if_none_match(request, etag)
+        if not_modified is not None:
+            return not_modified
+        try:
+            page = get_catalog_page(category, cursor=cursor, page_size=limit)
+        except InvalidCursor:
+            raise ApiError(400, "Невалиден курсор.")
+        rows, next_cursor = page.object_list, page.next_cursor
+
+    return json_response(request, {
+        'results': [{field: row[field] for field in fields} for row in rows],
+        'next_cursor': next_cursor,
+    }, etag=etag)
+
+
+# --- Количка ---
+
+def _cart_payload(user):
+    summary = get_cart(user).summary()
+    results = [
+        {
+            'product_id': line.product_id,
+            'name': line.name,
+            'price': line.price,
+            'quantity': line.quantity,
+            'line_total': line.line_total,
+        }
+        for line in summary.lines
+    ]
+    return {'items': results, 'total_price': summary.total, 'item_count': summary.item_count}
+
+
+@api_view(('GET', 'POST'), role='client')
+def cart(request):
+    """
+    GET: съдържанието на количката. POST {"product_id", "quantity"}: добавя продукт.
+    """
+    if request.method == 'POST':
+        data = _json_body(request)
+        product_id = _positive_int(data.get('product_id'), 'product_id')
+        quantity = _positive_int(data.get('quantity', 1), 'quantity')
+        try:
+            _, created = get_cart(request.user).add(product_id, quantity)
+        except Product.DoesNotExist:
+            raise ApiError(404, "Продуктът не е намерен.")
+        return json_response(request, _cart_payload(request.user), status=201 if created else 200)
+
+    return json_response(request, _cart_payload(request.user))
+
+
+@api_view(('PATCH', 'DELETE'), role='client')
+def cart_item(request, pk):
+    """
+    PATCH {"quantity"}: променя количеството на продукт pk. DELETE: премахва го от количката.
+    """
+    cart = get_cart(request.user)
+    if request.method == 'DELETE':
+        found = cart.remove(pk)
+    else:
+        found = cart.set_quantity(pk, _positive_int(_json_body(request).get('quantity'), 'quantity'))
+    if not found:
+        raise ApiError(404, "Продуктът не е в количката.")
+    return json_response(request, _cart_payload(request.user))
+
+
+@api_view(('POST',), role='client')
+def checkout(request):
+    """
+    POST {"address", "phone_number"}: създава поръчка от количката.
+    """
+    form = CheckoutForm(_json_body(request))
+    if not form.is_valid():
+        return json_response(request, {'errors': form.errors.get_json_data()}, status=400)
+    try:
+        client = Client.objects.get(user=request.user)
+    except Client.DoesNotExist:
+        raise ApiError(404, "Клиентският профил не е намерен.")
+    try:
+        order = get_cart(request.user).checkout(
+            client=client,
+            address=form.cleaned_data['address'],
+            phone_number=form.cleaned_data['phone_number'],
+        )
+    except EmptyCartError:
+        raise ApiError(409, "Количката е празна.")
+    return json_response(request, _serialize_orders([order], ORDER_DEFAULT_FIELDS)[0], status=201)
+
+
+# --- Поръчки на клиента ---
+
+@api_view(('GET',), role='client')
+def orders(request):
+    """
+    Поръчките на клиента, най-новите първи. Параметри: fields, cursor, limit.
+    """
+    fields = _selected_fields(request, ORDER_FIELDS, ORDER_DEFAULT_FIELDS)
+    page = _paginate(request, _orders_queryset(fields).filter(client_id=request.user.pk), ('-created_at', '-id'))
+    return json_response(request, {
+        'results': _serialize_orders(page, fields),
+        'next_cursor': page.next_cursor,
+    })
+
+
+@api_view(('GET',), role='client')
+def order_detail(request, pk):
+    """
+    Статусът и данните на една поръчка на клиента. Параметри: fields.
+    """
+    fields = _selected_fields(request, ORDER_FIELDS, ORDER_DEFAULT_FIELDS)
+    order = _orders_queryset(fields).filter(pk=pk, client_id=request.user.pk).first()
+    if order is None:
+        raise ApiError(404, "Поръчката не е намерена.")
+    return json_response(request, _serialize_orders([order], fields)[0])
+
+
+# --- Доставки ---
+
+@api_view(('GET',), role='delivery_person')
+def available_deliveries(request):
+    """
+    Свободните чакащи поръчки, най-старите първи. Параметри: fields, cursor, limit.
+    """
+    fields = _selected_fields(request, ORDER_FIELDS, ORDER_DEFAULT_FIELDS)
+    queryset = _orders_queryset(fields).filter(status='pending', delivery_person__isnull=True)
+    page = _paginate(request, queryset, ('created_at', 'id'))
+    return json_response(request, {
+        'results': _serialize_orders(page, fields),
+        'next_cursor': page.next_cursor,
+    })
+
+
+@api_view(('GET',), role='delivery_person')
+def my_deliveries(request):
+    """
+    Активните (изпратени) поръчки на доставчика. Параметри: fields, cursor, limit.
+    """
+    fields = _selected_fields(request, ORDER_FIELDS, ORDER_DEFAULT_FIELDS)
+    queryset = _orders_queryset(fields).filter(delivery_person_id=request.user.pk, status='shipped')
+    page = _paginate(request, queryset, ('created_at', 'id'))
+    return json_response(request, {
+        'results': _serialize_orders(page, fields),
+        'next_cursor': page.next_cursor,
+    })
+
+
+@api_view(('POST',), role='delivery_person')
+def accept_delivery(request, pk):
+    """
+    Заявява конкретна поръчка за доставчика (409, ако вече е взета).
+    """
+    if not claim_order(pk, request.user.deliveryperson):
+        if not Order.objects.filter(pk=pk).exists():
+            raise ApiError(404, "Поръчката не е намерена.")
+        raise ApiError(409, "Тази поръчка вече е взета.")
+    order = Order.objects.get(pk=pk)
+    return json_response(request, _serialize_orders([order], ORDER_DEFAULT_FIELDS)[0])
+
+
+@api_view(('POST',), role='delivery_person')
+def claim_next_delivery(request):
+    """
+    Дава на доставчика най-старата свободна поръчка (204, ако няма).
+    """
+    order = claim_next_order(request.user.deliveryperson)
+    if order is None:
+        return HttpResponse(status=204)
+    return json_response(request, _serialize_orders([order], ORDER_DEFAULT_FIELDS)[0])
+
+
+@api_view(('POST',), role='delivery_person')
+def mark_delivered(request, pk):
+    """
+    Маркира поръчка на доставчика като доставена.
+    """
+    order = Order.objects.filter(pk=pk, delivery_person_id=request.user.pk).first()
+    if order is None:
+        raise ApiError(404, "Поръчката не е намерена.")
+    if order.status == 'delivered':
+        raise ApiError(409, "Тази поръчка вече е доставена.")
+    order.status = 'delivered'
+    order.save()
+    return json_response(request, _serialize_orders([order], ORDER_DEFAULT_FIELDS)[0])
@@ -17,4 +17,5 @@ class AccountsConfig(AppConfig):
     name = 'accounts'
 
     def ready(self):
+        import accounts.checks
         import accounts.signals
@@ -0,0 +1,376 @@
+"""
+Бенчмаркове на основните потоци през тестовия клиент на Django.
+
+Всеки бенчмарк (регистриран с @benchmark) подготвя данните за един кръг
+(setup, не се измерва) и изпраща една заявка (target, измерва се заедно с
+броя SQL заявки). Бенчмарковете използват потребителите, създадени от
+accounts.loadtest (manage.py seed_load_data), и променят данните им -
+пускайте ги само срещу база с генерирани данни.
+
+Резултатите се записват като JSON във формата на pytest-benchmark
+(времената са в секунди), а compare_results() ги сравнява с предишен
+запис и връща регресиите над зададен праг.
+"""
+
+import json
+import platform
+import statistics
+import time
+from collections import namedtuple
+from contextlib import ExitStack
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, connections
+from django.test import Client as TestClient, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .cart import get_cart
+from .jobs import run_pending_jobs
+from .loadtest import LOAD_ADMIN_USERNAME, LOAD_RESTAURANT_TAG, LOAD_USERNAME_PREFIX
+from .metrics import RequestMetrics
+from .models import Client, DeliveryPerson, Order, Product, User
+
+
+# Период на справките в бенчмарковете (дни назад от днес)
+REPORT_PERIOD_DAYS = 365
+
+Benchmark = namedtuple('Benchmark', ['setup', 'target', 'expected_status'])
+
+BENCHMARKS = {}
+
+
+class BenchmarkError(Exception):
+    """
+    Бенчмаркът не може да бъде изпълнен (липсват данни или заявката е неуспешна).
+    """
+
+
+def benchmark(name):
+    """
+    Регистрира функция, която по BenchmarkContext връща Benchmark.
+    """
+    def decorator(function):
+        BENCHMARKS[name] = function
+        return function
+    return decorator
+
+
+def _no_setup():
+    return ()
+
+
+class BenchmarkContext:
+    """
+    Потребителите и клиентите на тестовия клиент, общи за всички бенчмаркове.
+    """
+
+    def __init__(self):
+        try:
+            self.client_user = User.objects.get(username=f'{LOAD_USERNAME_PREFIX}client_0')
+            self.courier_user = User.objects.get(username=f'{LOAD_USERNAME_PREFIX}courier_0')
+            self.admin_user = User.objects.get(username=LOAD_ADMIN_USERNAME)
+        except User.DoesNotExist:
+            raise BenchmarkError("Няма генерирани данни - изпълнете първо manage.py seed_load_data")
+        self.client_profile = Client.objects.get(user=self.client_user)
+        self.courier = DeliveryPerson.objects.get(user=self.courier_user)
+        # Поръчките от бенчмарковете за разпределяне и доставка отиват при друг
+        # доставчик, за да не растат таблото и справките на courier_0 между пусканията
+        self.working_courier = (
+            DeliveryPerson.objects.filter(user__username=f'{LOAD_USERNAME_PREFIX}courier_1').first()
+            or self.courier
+        )
+        self.product_ids = list(
+            Product.objects.filter(restaurant__name__endswith=LOAD_RESTAURANT_TAG)
+            .order_by('id')
+            .values_list('id', flat=True)[:3]
+        )
+        self.restaurant_id = (
+            Product.objects.filter(pk__in=self.product_ids[:1]).values_list('restaurant_id', flat=True).first()
+        )
+        self.end_date = timezone.localdate()
+        self.start_date = self.end_date - timedelta(days=REPORT_PERIOD_DAYS)
+        self.browsers = {}
+
+    def browser(self, user):
+        """
+        Тестов клиент, влязъл като дадения потребител (един на потребител).
+        """
+        if user.pk not in self.browsers:
+            browser = TestClient()
+            browser.force_login(user)
+            self.browsers[user.pk] = browser
+        return self.browsers[user.pk]
+
+    def period(self):
+        return {'start_date': self.start_date.isoformat(), 'end_date': self.end_date.isoformat()}
+
+    def create_order(self, **fields):
+        return Order.objects.create(
+            client=self.client_profile,
+            total_price=10,
+            address=self.client_profile.address,
+            phone_number='0888123456',
+            **fields,
+        )
+
+
+@benchmark('menu_browsing')
+def menu_browsing(ctx):
+    browser = ctx.browser(ctx.client_user)
+    url = reverse('view_products')
+    return Benchmark(_no_setup, lambda: browser.get(url), 200)
+
+
+@benchmark('menu_search')
+def menu_search(ctx):
+    browser = ctx.browser(ctx.client_user)
+    url = reverse('product_search')
+    return Benchmark(_no_setup, lambda: browser.get(url, {'q': 'пица маргарита'}), 200)
+
+
+@benchmark('create_order_page')
+def create_order_page(ctx):
+    browser = ctx.browser(ctx.client_user)
+    url = reverse('create_order')
+    return Benchmark(_no_setup, lambda: browser.get(url, {'restaurant': ctx.restaurant_id}), 200)
+
+
+@benchmark('add_to_cart')
+def add_to_cart(ctx):
+    browser = ctx.browser(ctx.client_user)
+    url = reverse('add_to_cart', args=[ctx.product_ids[0]])
+    return Benchmark(_no_setup, lambda: browser.get(url), 302)
+
+
+@benchmark('view_cart')
+def view_cart(ctx):
+    browser = ctx.browser(ctx.client_user)
+    url = reverse('view_cart')
+    return Benchmark(_no_setup, lambda: browser.get(url), 200)
+
+
+@benchmark('checkout')
+def checkout(ctx):
+    browser = ctx.browser(ctx.client_user)
+    url = reverse('checkout')
+
+    def setup():
+        cart = get_cart(ctx.client_user)
+        cart.clear()
+        for product_id in ctx.product_ids:
+            cart.add(product_id, 2)
+        return ()
+
+    data = {'address': ctx.client_profile.address, 'phone_number': '0888123456'}
+    return Benchmark(setup, lambda: browser.post(url, data), 302)
+
+
+@benchmark('track_orders')
+def track_orders(ctx):
+    browser = ctx.browser(ctx.client_user)
+    url = reverse('track_orders')
+    return Benchmark(_no_setup, lambda: browser.get(url), 200)
+
+
+@benchmark('delivery_dashboard')
+def delivery_dashboard(ctx):
+    browser = ctx.browser(ctx.courier_user)
+    url = reverse('delivery_dashboard')
+    return Benchmark(_no_setup, lambda: browser.get(url), 200)
+
+
+@benchmark('dispatch_claim_next')
+def dispatch_claim_next(ctx):
+    browser = ctx.browser(ctx.working_courier.user)
+    url = reverse('claim_next_delivery')
+
+    def setup():
+        # Винаги има поне една свободна поръчка
+        ctx.create_order()
+        return ()
+
+    return Benchmark(setup, lambda: browser.post(url), 302)
+
+
+@benchmark('mark_delivered')
+def mark_delivered(ctx):
+    browser = ctx.browser(ctx.working_courier.user)
+
+    def setup():
+        # Задачите от предишния кръг (обобщения, журнал) се изпълняват извън измерването
+        run_pending_jobs()
+        order = ctx.create_order(status='shipped', delivery_person=ctx.working_courier)
+        return (reverse('mark_as_delivered', args=[order.pk]),)
+
+    return Benchmark(setup, lambda url: browser.get(url), 302)
+
+
+@benchmark('report_turnover')
+def report_turnover(ctx):
+    browser = ctx.browser(ctx.admin_user)
+    url = reverse('turnover_report')
+    return Benchmark(_no_setup, lambda: browser.get(url, ctx.period()), 200)
+
+
+@benchmark('report_generate_turnover')
+def report_generate_turnover(ctx):
+    browser = ctx.browser(ctx.admin_user)
+    url = reverse('generate_turnover_report')
+    return Benchmark(_no_setup, lambda: browser.get(url, ctx.period()), 200)
+
+
+@benchmark('report_earnings')
+def report_earnings(ctx):
+    browser = ctx.browser(ctx.admin_user)
+    url = reverse('earnings_report', args=[ctx.courier.pk])
+    return Benchmark(_no_setup, lambda: browser.get(url), 200)
+
+
+@benchmark('report_admin_revenue')
+def report_admin_revenue(ctx):
+    browser = ctx.browser(ctx.admin_user)
+    url = reverse('admin:revenue_report')
+    return Benchmark(_no_setup, lambda: browser.post(url, ctx.period()), 302)
+
+
+@benchmark('report_admin_courier_earnings')
+def report_admin_courier_earnings(ctx):
+    browser = ctx.browser(ctx.admin_user)
+    url = reverse('admin:deliveryperson_earnings_report', args=[ctx.courier.pk])
+    return Benchmark(_no_setup, lambda: browser.post(url, ctx.period()), 200)
+
+
+@benchmark('report_admin_export')
+def report_admin_export(ctx):
+    browser = ctx.browser(ctx.admin_user)
+    url = reverse('admin:order_export')
+    params = dict(ctx.period(), dataset='orders', export_format='csv')
+    return Benchmark(_no_setup, lambda: browser.get(url, params), 200)
+
+
+def _stats(timings, queries):
+    mean = statistics.fmean(timings)
+    return {
+        'min': min(timings),
+        'max': max(timings),
+        'mean': mean,
+        'stddev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'median': statistics.median(timings),
+        'rounds': len(timings),
+        'total': sum(timings),
+        'ops': 1 / mean if mean else 0.0,
+        'queries': int(statistics.median(queries)),
+    }
+
+
+def run_benchmark(ctx, name, rounds, warmup=1):
+    """
+    Изпълнява бенчмарка и връща статистиката му.
+
+    Първите `warmup` кръга не се измерват (затопляне на кешове и връзки).
+    Времето включва и прочитането на поточните отговори.
+    """
+    setup, target, expected_status = BENCHMARKS[name](ctx)
+    timings, queries = [], []
+    for round_number in range(warmup + rounds):
+        args = setup()
+        metrics = RequestMetrics(max_logged_queries=0)
+        with ExitStack() as stack:
+            for db_connection in connections.all():
+                stack.enter_context(db_connection.execute_wrapper(metrics))
+            started = time.perf_counter()
+            response = target(*args)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        if response.status_code != expected_status:
+            raise BenchmarkError(
+                f"{name}: очакван статус {expected_status}, получен {response.status_code}"
+            )
+        if round_number >= warmup:
+            timings.append(elapsed)
+            queries.append(metrics.query_count)
+    return _stats(timings, queries)
+
+
+def run_benchmarks(names=None, rounds=20, warmup=1, log=lambda name, stats: None):
+    """
+    Изпълнява бенчмарковете и връща резултата във формата на pytest-benchmark.
+
+    Args:
+        names (list | None): Имена от BENCHMARKS (по подразбиране всички).
+        rounds (int): Брой измервани кръгове на бенчмарк.
+        warmup (int): Брой неизмервани кръгове преди това.
+        log (callable): Извиква се с (име, статистика) след всеки бенчмарк.
+    """
+    names = list(names or BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise BenchmarkError(f"Непознати бенчмаркове: {', '.join(sorted(unknown))}")
+
+    # Тестовият клиент изпраща Host: testserver; писмата не се изпращат наистина,
+    # а SQL заявките не се логват от middleware-а (броят им е в резултата).
+    # Фоновите задачи не се изпълняват в заявката, както в продукция.
+    with override_settings(
+        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+        METRICS_QUERY_LOG_THRESHOLD=0,
+        JOBS_EAGER=False,
+    ):
+        ctx = BenchmarkContext()
+        results = []
+        for name in names:
+            stats = run_benchmark(ctx, name, rounds, warmup)
+            log(name, stats)
+            results.append({'name': name, 'stats': stats})
+
+    return {
+        'machine_info': {
+            'node': platform.node(),
+            'python_version': platform.python_version(),
+            'database': connection.vendor,
+        },
+        'datetime': timezone.now().isoformat(),
+        'benchmarks': results,
+    }
+
+
+def compare_results(current, baseline, threshold):
+    """
+    Сравнява медианите (и броя SQL заявки) с предишен резултат.
+
+    Args:
+        current (dict): Текущият резултат от run_benchmarks().
+        baseline (dict): Предишен резултат (същият формат).
+        threshold (float): Допустимо забавяне на медианата в проценти.
+
+    Returns:
+        list: Описания на регресиите (празен списък, ако няма).
+    """
+    previous = {entry['name']: entry['stats'] for entry in baseline.get('benchmarks', [])}
+    regressions = []
+    for entry in current['benchmarks']:
+        old = previous.get(entry['name'])
+        if old is None:
+            continue
+        new = entry['stats']
+        change = (new['median'] - old['median']) / old['median'] * 100 if old['median'] else 0.0
+        if change > threshold:
+            regressions.append(
+                f"{entry['name']}: медиана {old['median'] * 1000:.2f} ms -> {new['median'] * 1000:.2f} ms (+{change:.0f}%)"
+            )
+        if 'queries' in old and new['queries'] > old['queries']:
+            regressions.append(f"{entry['name']}: SQL заявки {old['queries']} -> {new['queries']}")
+    return regressions
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_results(results, path):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
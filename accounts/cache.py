@@ -0,0 +1,253 @@
+"""
+Кеширане на рядко променящи се данни на приложението 'accounts'.
+
+Модулът комбинира два слоя:
+- локален за процеса речник (без мрежови заявки при всяко четене);
+- споделен Django кеш (CACHES['default']), общ за всички gunicorn worker-и.
+
+Ключовете в споделения кеш са версионирани. При промяна на данните
+версията се увеличава, което прави старите записи недостижими за всички
+процеси. Всеки запис помни кога е прочетен от базата и не се използва
+по-дълго от зададения TTL, дори ако споделеният кеш не е общ за процесите.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import BonusSettings, Product
+from .pagination import KeysetPage, decode_cursor, keyset_paginate
+
+
+BONUS_SETTINGS_KEY = 'accounts:bonus_settings'
+CATALOG_KEY = 'accounts:catalog'
+
+# Маркер за "няма активна настройка" - None не може да се различи от липсващ ключ
+_NO_SETTINGS = '__none__'
+
+_local_cache = {}
+
+
+def _bonus_settings_ttl():
+    return getattr(settings, 'BONUS_SETTINGS_CACHE_TTL', 60)
+
+
+def _get_version(key):
+    """
+    Връща текущата версия на ключа от споделения кеш (по подразбиране 1).
+    """
+    version = cache.get(f'{key}:version')
+    if version is None:
+        cache.add(f'{key}:version', 1, timeout=None)
+        version = cache.get(f'{key}:version', 1)
+    return version
+
+
+def _bump_version(key):
+    """
+    Увеличава версията на ключа, с което обезсилва всички стари записи.
+    """
+    try:
+        cache.incr(f'{key}:version')
+    except ValueError:
+        cache.add(f'{key}:version', 2, timeout=None)
+    _local_cache.pop(key, None)
+
+
+def get_active_bonus_settings():
+    """
+    Връща активната бонус настройка, като използва кеширане на два нива.
+
+    Ред на търсене:
+        1. Локален кеш на процеса, ако записът е по-млад от TTL.
+        2. Споделен кеш под текущата версия на ключа.
+        3. Базата данни (резултатът се записва в двата кеша).
+
+    TTL се задава чрез settings.BONUS_SETTINGS_CACHE_TTL (секунди, по подразбиране 60).
+
+    Returns:
+        BonusSettings | None: Активната настройка или None, ако няма такава.
+    """
+    ttl = _bonus_settings_ttl()
+    now = time.time()
+
+    entry = _local_cache.get(BONUS_SETTINGS_KEY)
+    if entry is not None and entry[1] + ttl > now:
+        value = entry[0]
+        return None if value == _NO_SETTINGS else value
+
+    version = _get_version(BONUS_SETTINGS_KEY)
+    data_key = f'{BONUS_SETTINGS_KEY}:v{version}'
+    entry = cache.get(data_key)
+    if entry is None or entry[1] + ttl <= now:
+        bonus_settings = BonusSettings.objects.filter(is_active=True).first()
+        entry = (bonus_settings or _NO_SETTINGS, now)
+        cache.set(data_key, entry, timeout=ttl)
+
+    _local_cache[BONUS_SETTINGS_KEY] = entry
+    value = entry[0]
+    return None if value == _NO_SETTINGS else value
+
+
+def invalidate_bonus_settings():
+    """
+    Обезсилва кешираната бонус настройка във всички процеси.
+
+    Версията се увеличава веднага и повторно след commit на текущата
+    транзакция, за да не остане в кеша стойност, прочетена преди commit.
+    """
+    _bump_version(BONUS_SETTINGS_KEY)
+    transaction.on_commit(lambda: _bump_version(BONUS_SETTINGS_KEY))
+
+
+
+def _catalog_ttl():
+    return getattr(settings, 'CATALOG_CACHE_TTL', 60 * 60)
+
+
+def _catalog_values(category):
+    """
+    Продуктите (с името на ресторанта) като values() заявка, подредени по id.
+    """
+    products = Product.objects.order_by('id')
+    if category:
+        products = products.filter(category=category)
+    return products.values('id', 'name', 'description', 'price', 'category', 'restaurant_id', 'restaurant__name')
+
+
+def _catalog_row(row, categories):
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'description': row['description'],
+        'price': row['price'],
+        'category': row['category'],
+        'category_display': categories.get(row['category'], row['category']),
+        'restaurant_id': row['restaurant_id'],
+        'restaurant_name': row['restaurant__name'],
+    }
+
+
+def _catalog_rows(category):
+    """
+    Чете продуктите заедно с името на ресторанта с една заявка.
+    """
+    categories = dict(Product.CATEGORY_CHOICES)
+    return [_catalog_row(row, categories) for row in _catalog_values(category)]
+
+
+def get_catalog_version():
+    """
+    Връща текущата версия на менюто.
+
+    Версията се променя при всяко обезсилване (invalidate_catalog), така че
+    може да се използва в ETag-ове и локални индекси, построени от менюто.
+    """
+    return _get_version(CATALOG_KEY)
+
+
+def get_catalog(category=None):
+    """
+    Връща менюто (всички продукти или само от дадена категория) от кеша.
+
+    Продуктите се пазят като готови речници (id, name, description, price,
+    category, category_display, restaurant_id, restaurant_name) под
+    версиониран ключ за всяка категория, така че при четене от кеша не се
+    изпълняват заявки към базата. Непознатите категории не се кешират.
+
+    Args:
+        category (str | None): Ключ от Product.CATEGORY_CHOICES; None или '' за всички продукти.
+
+    Returns:
+        list: Речници с данните на продуктите, подредени по id.
+    """
+    if category and category not in dict(Product.CATEGORY_CHOICES):
+        return []
+
+    version = get_catalog_version()
+    data_key = f'{CATALOG_KEY}:v{version}:{category or "all"}'
+    rows = cache.get(data_key)
+    if rows is None:
+        rows = _catalog_rows(category)
+        cache.set(data_key, rows, timeout=_catalog_ttl())
+    return rows
+
+
+def get_catalog_page(category=None, cursor=None, page_size=20):
+    """
+    Връща една страница от менюто (keyset по id), без да зарежда цялото меню.
+
+    Страницата се чете с една заявка с LIMIT и се кешира под текущата
+    версия на менюто, така че цената ѝ зависи само от размера на страницата.
+
+    Args:
+        category (str | None): Ключ от Product.CATEGORY_CHOICES; None или '' за всички продукти.
+        cursor (str | None): Курсор от предишна страница.
+        page_size (int): Брой продукти на страница.
+
+    Returns:
+        KeysetPage: Речници като тези от get_catalog() и курсор за следващата страница.
+
+    Raises:
+        InvalidCursor: Ако курсорът е невалиден.
+    """
+    if category and category not in dict(Product.CATEGORY_CHOICES):
+        return KeysetPage([], None)
+
+    # Ключът съдържа декодирания курсор, а не низа от заявката
+    after = decode_cursor(cursor, Product, ('id',))[0] if cursor else 0
+    version = get_catalog_version()
+    data_key = f'{CATALOG_KEY}:v{version}:{category or "all"}:after{after}:{page_size}'
+    page = cache.get(data_key)
+    if page is None:
+        page = keyset_paginate(_catalog_values(category), cursor=cursor, page_size=page_size, ordering=('id',))
+        categories = dict(Product.CATEGORY_CHOICES)
+        page = KeysetPage([_catalog_row(row, categories) for row in page], page.next_cursor)
+        cache.set(data_key, page, timeout=_catalog_ttl())
+    return page
+
+
+def get_catalog_products(product_ids):
+    """
+    Връща речник id -> данни на продукта (както в get_catalog) само за дадените продукти.
+
+    Всеки продукт се пази под отделен версиониран ключ и се чете с един
+    cache.get_many; липсващите в кеша се зареждат с една заявка (id__in).
+    Цената не зависи от размера на менюто, а само от броя поискани продукти.
+
+    Args:
+        product_ids (Iterable[int]): Id-тата на продуктите.
+
+    Returns:
+        dict: Данните на намерените продукти; изтритите липсват.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+
+    version = get_catalog_version()
+    keys = {f'{CATALOG_KEY}:v{version}:product:{product_id}': product_id for product_id in product_ids}
+    products = {keys[key]: row for key, row in cache.get_many(keys).items()}
+
+    missing = product_ids - products.keys()
+    if missing:
+        categories = dict(Product.CATEGORY_CHOICES)
+        rows = {row['id']: _catalog_row(row, categories) for row in _catalog_values(None).filter(id__in=missing)}
+        cache.set_many(
+            {f'{CATALOG_KEY}:v{version}:product:{product_id}': row for product_id, row in rows.items()},
+            timeout=_catalog_ttl(),
+        )
+        products.update(rows)
+    return products
+
+
+def invalidate_catalog():
+    """
+    Обезсилва кешираното меню за всички категории и процеси.
+
+    Както при бонус настройките, версията се увеличава веднага и след commit.
+    """
+    _bump_version(CATALOG_KEY)
+    transaction.on_commit(lambda: _bump_version(CATALOG_KEY))
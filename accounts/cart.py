@@ -0,0 +1,464 @@
+"""
+Количка за пазаруване със сменяемо хранилище (settings.CART_BACKEND).
+
+Изгледите и API-то работят само чрез get_cart(user) и методите на
+количката (lines, summary, add, set_quantity, remove, clear, checkout),
+независимо къде се пазят данните:
+
+- DatabaseCart чете и пише директно в CartItem;
+- CacheCart държи активната количка в споделения кеш и я записва в
+  CartItem (write-behind) само при финализиране на поръчката или след
+  неактивност (manage.py flush_carts). Разглеждането на менюто и
+  добавянето в количката не изпълняват заявки към базата.
+
+При липса в кеша CacheCart зарежда последното записано състояние от
+CartItem. Кешираните колички с незаписани промени се вписват в дневник
+(последователни ключове с атомарен брояч), който flush_carts обхожда.
+
+Значката на количката (брой и сума, get_cart_badge) се кешира отделно за
+всеки потребител, за да може всяка страница да я показва без заявки към
+базата; всяка промяна на количката я обезсилва.
+"""
+
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Window
+from django.utils.module_loading import import_string
+
+from .cache import CATALOG_KEY, get_catalog_products
+from .models import CartItem, Product, User
+from .services import add_product_to_cart, place_order_from_cart
+
+
+CartLine = namedtuple('CartLine', ['product_id', 'name', 'price', 'quantity', 'line_total', 'restaurant_name'])
+
+# Редовете, общата сума и броят артикули (сумата от количествата)
+CartSummary = namedtuple('CartSummary', ['lines', 'total', 'item_count'])
+
+CART_KEY = 'accounts:cart'
+CART_LOG_KEY = 'accounts:cart:log'
+CART_BADGE_KEY = 'accounts:cart_badge'
+
+# Опити за заключване на количката (по 10 ms) и живот на ключалката в секунди
+CART_LOCK_ATTEMPTS = 50
+CART_LOCK_TIMEOUT = 5
+
+# Брой записи от дневника, прочитани с един get_many
+FLUSH_CHUNK_SIZE = 500
+
+
+class CartBusyError(Exception):
+    """
+    Изключение, когато количката е заключена от друга заявка по-дълго от очакваното.
+
+    Промяната не е извършена; клиентът може да опита отново.
+    """
+
+
+def get_cart(user):
+    """
+    Количката на потребителя от хранилището в settings.CART_BACKEND.
+    """
+    backend = getattr(settings, 'CART_BACKEND', None) or 'accounts.cart.DatabaseCart'
+    return import_string(backend)(user)
+
+
+def _badge_ttl():
+    return getattr(settings, 'CART_BADGE_CACHE_TTL', 60 * 60)
+
+
+def get_cart_badge(user):
+    """
+    Броят артикули и общата сума в количката за значката в страниците.
+
+    Значката се пази в споделения кеш заедно с версията на менюто, с която е
+    изчислена, и се чете с един get_many, без заявки към базата. При липса,
+    промяна на менюто (цени) или изтекъл TTL се изчислява с cart.summary().
+
+    Returns:
+        dict: {'count': int, 'total': Decimal}.
+    """
+    key = f'{CART_BADGE_KEY}:{user.pk}'
+    version_key = f'{CATALOG_KEY}:version'
+    entries = cache.get_many([key, version_key])
+    badge = entries.get(key)
+    if badge is not None and badge['version'] == entries.get(version_key, 1):
+        return {'count': badge['count'], 'total': badge['total']}
+
+    summary = get_cart(user).summary()
+    badge = {'count': summary.item_count, 'total': summary.total}
+    cache.set(key, {**badge, 'version': entries.get(version_key, 1)}, timeout=_badge_ttl())
+    return badge
+
+
+def invalidate_cart_badge(user_id):
+    """
+    Обезсилва кешираната значка на количката.
+
+    Както при менюто, ключът се изтрива веднага и повторно след commit, за да
+    не остане значка, изчислена преди края на текущата транзакция.
+    """
+    key = f'{CART_BADGE_KEY}:{user_id}'
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def _line(product_id, name, price, quantity, restaurant_name):
+    return CartLine(product_id, name, price, quantity, price * quantity, restaurant_name)
+
+
+class BaseCart:
+    """
+    Общият интерфейс на количките.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def lines(self):
+        """
+        Редовете на количката (CartLine) в реда на добавяне.
+        """
+        raise NotImplementedError
+
+    def total(self, lines=None):
+        lines = self.lines() if lines is None else lines
+        return sum((line.line_total for line in lines), Decimal('0'))
+
+    def summary(self):
+        """
+        Редовете, общата сума и броят артикули в количката (CartSummary).
+        """
+        lines = self.lines()
+        return CartSummary(lines, self.total(lines), sum(line.quantity for line in lines))
+
+    def changed(self):
+        """
+        Извиква се след всяка промяна на количката.
+        """
+        invalidate_cart_badge(self.user.pk)
+
+    def add(self, product_id, quantity=1):
+        """
+        Добавя продукт или увеличава количеството му.
+
+        Returns:
+            tuple: (новото количество, True ако продуктът е нов в количката).
+
+        Raises:
+            Product.DoesNotExist: Ако продуктът не съществува.
+            ValueError: Ако количеството е по-малко от 1.
+        """
+        raise NotImplementedError
+
+    def set_quantity(self, product_id, quantity):
+        """
+        Задава количеството на продукт в количката; False, ако продуктът не е в нея.
+        """
+        raise NotImplementedError
+
+    def remove(self, product_id):
+        """
+        Премахва продукт от количката; False, ако продуктът не е в нея.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def checkout(self, client, address, phone_number):
+        """
+        Създава поръчка от количката и я изпразва (вижте place_order_from_cart).
+
+        Raises:
+            EmptyCartError: Ако количката е празна.
+        """
+        raise NotImplementedError
+
+
+class DatabaseCart(BaseCart):
+    """
+    Количка директно в таблицата CartItem.
+    """
+
+    def items(self):
+        return CartItem.objects.filter(user=self.user)
+
+    def lines(self):
+        return self.summary().lines
+
+    def summary(self):
+        """
+        Редовете, общата сума и броят артикули с една заявка.
+
+        Сумата на всеки ред се изчислява в базата, а общата сума и броят се
+        добавят към всеки ред като прозоречни функции (SUM(...) OVER ()).
+        """
+        line_total = ExpressionWrapper(
+            F('product__price') * F('quantity'),
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        )
+        rows = list(
+            self.items()
+            .annotate(
+                line_total=line_total,
+                cart_total=Window(Sum(line_total)),
+                item_count=Window(Sum('quantity')),
+            )
+            .order_by('id')
+            .values_list(
+                'product_id', 'product__name', 'product__price', 'quantity', 'line_total',
+                'product__restaurant__name', 'cart_total', 'item_count',
+            )
+        )
+        if not rows:
+            return CartSummary([], Decimal('0'), 0)
+        lines = [CartLine(*row[:6]) for row in rows]
+        return CartSummary(lines, rows[0][6], rows[0][7])
+
+    def add(self, product_id, quantity=1):
+        result = add_product_to_cart(self.user, product_id, quantity)
+        self.changed()
+        return result
+
+    def set_quantity(self, product_id, quantity):
+        if quantity < 1:
+            raise ValueError("Количеството трябва да е поне 1.")
+        found = self.items().filter(product_id=product_id).update(quantity=quantity) > 0
+        self.changed()
+        return found
+
+    def remove(self, product_id):
+        found = self.items().filter(product_id=product_id).delete()[0] > 0
+        self.changed()
+        return found
+
+    def clear(self):
+        self.items().delete()
+        self.changed()
+
+    def checkout(self, client, address, phone_number):
+        order = place_order_from_cart(self.user, client, address, phone_number)
+        self.changed()
+        return order
+
+
+class CacheCart(BaseCart):
+    """
+    Количка в споделения кеш със запис в CartItem при финализиране или неактивност.
+
+    Състоянието в кеша е речник {'items': {product_id: quantity}, 'dirty': bool,
+    'touched': timestamp}; 'dirty' означава, че има промени, които още не са в
+    CartItem. Промените на една количка се сериализират с ключалка в кеша
+    (cache.add), за да не се губят при паралелни заявки. Ако ключалката не
+    се освободи навреме, промяната не се извършва и се хвърля CartBusyError.
+
+    Настройки:
+        CART_CACHE_TTL: Живот на количката в кеша (секунди).
+        CART_IDLE_FLUSH_SECONDS: След колко секунди неактивност flush_carts записва количката.
+    """
+
+    def __init__(self, user):
+        super().__init__(user)
+        self.key = f'{CART_KEY}:{user.pk}'
+
+    @staticmethod
+    def ttl():
+        return getattr(settings, 'CART_CACHE_TTL', 7 * 24 * 60 * 60)
+
+    @contextmanager
+    def lock(self):
+        """
+        Заключва количката за времето на блока.
+
+        Raises:
+            CartBusyError: Ако ключалката не е взета след CART_LOCK_ATTEMPTS опита.
+        """
+        key = f'{self.key}:lock'
+        for _ in range(CART_LOCK_ATTEMPTS):
+            if cache.add(key, 1, timeout=CART_LOCK_TIMEOUT):
+                break
+            time.sleep(0.01)
+        else:
+            raise CartBusyError("Количката се обновява от друга заявка. Опитайте отново.")
+        try:
+            yield
+        finally:
+            cache.delete(key)
+
+    def state(self):
+        """
+        Състоянието от кеша или, при липса, последното записано в CartItem.
+        """
+        state = cache.get(self.key)
+        if state is None:
+            items = dict(
+                CartItem.objects.filter(user_id=self.user.pk).order_by('id').values_list('product_id', 'quantity')
+            )
+            state = {'items': items, 'dirty': False, 'touched': time.time()}
+            cache.add(self.key, state, timeout=self.ttl())
+        return state
+
+    def store(self, state):
+        """
+        Записва променено състояние в кеша (като незаписано в CartItem).
+        """
+        if not state['dirty']:
+            self.log_dirty()
+        state['dirty'] = True
+        state['touched'] = time.time()
+        cache.set(self.key, state, timeout=self.ttl())
+        self.changed()
+
+    def log_dirty(self):
+        """
+        Вписва количката в дневника на незаписаните колички.
+        """
+        cache.add(f'{CART_LOG_KEY}:seq', 0, timeout=None)
+        position = cache.incr(f'{CART_LOG_KEY}:seq')
+        cache.set(f'{CART_LOG_KEY}:{position}', self.user.pk, timeout=self.ttl())
+
+    def lines(self):
+        items = self.state()['items']
+        catalog = get_catalog_products(items)
+        lines = []
+        for product_id, quantity in items.items():
+            product = catalog.get(product_id)
+            # Изтритите от менюто продукти не се показват и не се поръчват
+            if product is not None:
+                lines.append(_line(product_id, product['name'], product['price'], quantity, product['restaurant_name']))
+        return lines
+
+    def add(self, product_id, quantity=1):
+        if quantity < 1:
+            raise ValueError("Количеството трябва да е поне 1.")
+        if product_id not in get_catalog_products([product_id]):
+            raise Product.DoesNotExist(f"Продукт {product_id} не съществува.")
+        with self.lock():
+            state = self.state()
+            created = product_id not in state['items']
+            state['items'][product_id] = state['items'].get(product_id, 0) + quantity
+            self.store(state)
+        return state['items'][product_id], created
+
+    def set_quantity(self, product_id, quantity):
+        if quantity < 1:
+            raise ValueError("Количеството трябва да е поне 1.")
+        with self.lock():
+            state = self.state()
+            if product_id not in state['items']:
+                return False
+            state['items'][product_id] = quantity
+            self.store(state)
+        return True
+
+    def remove(self, product_id):
+        with self.lock():
+            state = self.state()
+            if state['items'].pop(product_id, None) is None:
+                return False
+            self.store(state)
+        return True
+
+    def clear(self):
+        with self.lock():
+            state = self.state()
+            state['items'] = {}
+            self.store(state)
+
+    def persist(self, items):
+        """
+        Записва съдържанието на количката в CartItem (изтрива липсващите редове).
+        """
+        with transaction.atomic():
+            existing = set(Product.objects.filter(pk__in=list(items)).values_list('id', flat=True))
+            CartItem.objects.filter(user_id=self.user.pk).exclude(product_id__in=existing).delete()
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(user_id=self.user.pk, product_id=product_id, quantity=quantity)
+                    for product_id, quantity in items.items()
+                    if product_id in existing
+                ],
+                update_conflicts=True,
+                unique_fields=['user', 'product'],
+                update_fields=['quantity'],
+            )
+
+    def flush(self):
+        """
+        Записва незаписаните промени в CartItem.
+
+        Returns:
+            bool: True, ако е имало промени за запис.
+        """
+        with self.lock():
+            state = cache.get(self.key)
+            if state is None or not state['dirty']:
+                return False
+            self.persist(state['items'])
+            state['dirty'] = False
+            cache.set(self.key, state, timeout=self.ttl())
+        return True
+
+    def checkout(self, client, address, phone_number):
+        with self.lock():
+            state = self.state()
+            if state['dirty']:
+                self.persist(state['items'])
+            # CartItem вече е актуален: след поръчката (или грешка) количката
+            # се зарежда наново оттам
+            cache.delete(self.key)
+            order = place_order_from_cart(self.user, client, address, phone_number)
+            self.changed()
+            return order
+
+    @classmethod
+    def flush_idle(cls, idle_seconds=None):
+        """
+        Записва в CartItem количките, неактивни поне idle_seconds секунди.
+
+        Обхожда дневника от последната позиция; все още активните колички
+        се вписват отново в края му, за да бъдат проверени при следващото
+        изпълнение. Предвидено е за един процес (напр. cron).
+
+        Returns:
+            int: Брой записани колички.
+        """
+        if idle_seconds is None:
+            idle_seconds = getattr(settings, 'CART_IDLE_FLUSH_SECONDS', 15 * 60)
+        end = cache.get(f'{CART_LOG_KEY}:seq', 0)
+        start = cache.get(f'{CART_LOG_KEY}:cursor', 0)
+        now = time.time()
+        flushed = 0
+
+        for chunk_start in range(start + 1, end + 1, FLUSH_CHUNK_SIZE):
+            chunk_end = min(chunk_start + FLUSH_CHUNK_SIZE, end + 1)
+            keys = [f'{CART_LOG_KEY}:{position}' for position in range(chunk_start, chunk_end)]
+            entries = cache.get_many(keys)
+            for key in keys:
+                user_id = entries.get(key)
+                if user_id is None:
+                    continue
+                cart = cls(User(pk=user_id))
+                state = cache.get(cart.key)
+                if state is None or not state['dirty']:
+                    continue
+                if now - state['touched'] < idle_seconds:
+                    cart.log_dirty()
+                    continue
+                try:
+                    if cart.flush():
+                        flushed += 1
+                except CartBusyError:
+                    # Количката се променя в момента - проверява се при следващото изпълнение
+                    cart.log_dirty()
+            cache.delete_many(keys)
+            cache.set(f'{CART_LOG_KEY}:cursor', chunk_end - 1, timeout=None)
+
+        return flushed
@@ -0,0 +1,29 @@
+"""
+Проверки при стартиране (Django system checks) за настройките на проекта.
+"""
+
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+
+@register(Tags.security)
+def check_debug_with_production_hosts(app_configs, **kwargs):
+    """
+    Не позволява DEBUG=True, ако ALLOWED_HOSTS съдържа нелокални хостове.
+
+    При DEBUG всяка SQL заявка се пази в connection.queries, а грешките
+    показват настройките на проекта - недопустимо за публичен хост.
+    Профилите на настройките спират още при зареждането си (вижте
+    require_local_hosts_for_debug в settings/base.py); тази проверка е втора защита.
+    """
+    if not settings.DEBUG:
+        return []
+    # Локалните хостове се задават на едно място - DEBUG_LOCAL_HOSTS в settings/base.py
+    public_hosts = [host for host in settings.ALLOWED_HOSTS if host not in settings.DEBUG_LOCAL_HOSTS]
+    if not public_hosts:
+        return []
+    return [Error(
+        "DEBUG е включен при продукционни хостове: " + ', '.join(public_hosts),
+        hint="Задайте DJANGO_DEBUG=0 или използвайте само локални хостове в DJANGO_ALLOWED_HOSTS.",
+        id='accounts.E001',
+    )]
@@ -0,0 +1,19 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart_badge
+
+
+def cart_badge(request):
+    """
+    Добавя 'cart_badge' ({'count', 'total'} или None) в контекста на шаблоните.
+
+    Значката се изчислява чак когато шаблонът я покаже, така че страниците
+    без нея не четат нито кеша, нито потребителя от сесията.
+    """
+    def badge():
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated or not user.is_client:
+            return None
+        return get_cart_badge(user)
+
+    return {'cart_badge': SimpleLazyObject(badge)}
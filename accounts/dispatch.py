@@ -0,0 +1,381 @@
+"""
+Разпределяне на поръчки към доставчици без състезания (race conditions).
+
+Поръчката се "заявява" с един условен UPDATE (само ако все още е чакаща и
+без доставчик), така че двама доставчици, натиснали едновременно една и съща
+поръчка, не могат да я вземат и двамата. Оборотът на доставчика се записва
+в журнала (accounts.ledger) едва при доставката, а не при заявяването.
+
+Модулът съдържа и DispatchEngine - разпределител в паметта, който държи
+чакащите поръчки и свободните доставчици в географска решетка и на партиди
+свързва всяка поръчка с близък доставчик, като минимизира общото разстояние
+до мястото на вземане (ресторанта).
+"""
+
+import heapq
+import itertools
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .events import publish_order_status
+from .jobs import enqueue
+from .models import DeliveryPerson, Order, OrderItem
+
+
+# Колко пъти claim_next_order опитва отново, ако избраната поръчка е взета междувременно
+CLAIM_NEXT_ATTEMPTS = 5
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def _unclaimed_orders():
+    # Съвпада с частичния индекс order_unassigned_pending_idx
+    return Order.objects.filter(status='pending', delivery_person__isnull=True)
+
+
+def claim_order(order_id, courier):
+    """
+    Заявява конкретна поръчка за доставчика с един условен UPDATE.
+
+    Args:
+        order_id (int): ID на поръчката.
+        courier (DeliveryPerson): Доставчикът, който приема поръчката.
+
+    Returns:
+        bool: True, ако поръчката е заявена от този доставчик; False, ако вече е
+        взета, не е чакаща или не съществува.
+    """
+    claimed = _unclaimed_orders().filter(pk=order_id).update(
+        delivery_person=courier,
+        status='shipped',
+    ) == 1
+    if claimed:
+        transaction.on_commit(lambda: _publish_claim(order_id, courier.pk))
+        enqueue('orders.notify_status', order_id=order_id, status='shipped')
+    return claimed
+
+
+def _publish_claim(order_id, courier_id):
+    # UPDATE заобикаля Order.save(), затова известието се изпраща оттук
+    client_id = Order.objects.filter(pk=order_id).values_list('client_id', flat=True).first()
+    publish_order_status(order_id, client_id, 'shipped', 'pending', (courier_id,))
+
+
+def claim_next_order(courier):
+    """
+    Дава на доставчика най-старата незаявена чакаща поръчка.
+
+    Кандидатът се заключва с SELECT ... FOR UPDATE SKIP LOCKED, така че
+    паралелните извиквания получават различни поръчки, без да се чакат
+    взаимно. В бази без SKIP LOCKED условният UPDATE в claim_order
+    гарантира, че поръчката няма да бъде дадена два пъти.
+
+    Args:
+        courier (DeliveryPerson): Доставчикът, който иска поръчка.
+
+    Returns:
+        Order | None: Заявената поръчка или None, ако няма свободни поръчки.
+    """
+    for _ in range(CLAIM_NEXT_ATTEMPTS):
+        with transaction.atomic():
+            order = (
+                _unclaimed_orders()
+                .select_for_update(skip_locked=True)
+                .order_by('created_at', 'id')
+                .first()
+            )
+            if order is None:
+                return None
+            if claim_order(order.pk, courier):
+                order.delivery_person = courier
+                order.status = 'shipped'
+                order._reset_tracking()
+                return order
+    return None
+
+
+def haversine_km(a, b):
+    """
+    Разстояние по големия кръг между две точки (lat, lon) в километри.
+    """
+    lat1, lon1 = map(math.radians, a)
+    lat2, lon2 = map(math.radians, b)
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+class GeoGrid:
+    """
+    Равномерна решетка върху (lat, lon) за бързо търсене на близки точки.
+
+    Всяка точка попада в клетка с размер cell_size градуса (подобно на
+    geohash с фиксирана точност). Търсенето обхожда клетките на "пръстени"
+    около клетката на заявката, така че цената зависи от гъстотата на
+    точките наблизо, а не от общия им брой.
+
+    Attributes:
+        cell_size (float): Размер на клетката в градуси.
+        points (dict): Ключ -> (lat, lon) за всички точки в решетката.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.points = {}
+        self._cells = {}
+
+    def cell(self, point):
+        return (math.floor(point[0] / self.cell_size), math.floor(point[1] / self.cell_size))
+
+    def add(self, key, point):
+        self.remove(key)
+        self.points[key] = point
+        self._cells.setdefault(self.cell(point), set()).add(key)
+
+    def remove(self, key):
+        point = self.points.pop(key, None)
+        if point is not None:
+            cell = self._cells[self.cell(point)]
+            cell.discard(key)
+            if not cell:
+                del self._cells[self.cell(point)]
+
+    def ring(self, point, radius):
+        """
+        Връща ключовете в клетките на разстояние точно radius клетки (по Чебишев).
+        """
+        row, col = self.cell(point)
+        if radius == 0:
+            yield from self._cells.get((row, col), ())
+            return
+        for d_row in range(-radius, radius + 1):
+            step = 1 if abs(d_row) == radius else 2 * radius
+            for d_col in range(-radius, radius + 1, step):
+                yield from self._cells.get((row + d_row, col + d_col), ())
+
+    def __len__(self):
+        return len(self.points)
+
+
+class DispatchEngine:
+    """
+    Партидно разпределяне на поръчки към най-близките свободни доставчици.
+
+    Поръчките и доставчиците се пазят в две решетки (add_order/add_courier).
+    assign() намира няколко най-близки кандидати за всеки елемент от
+    по-малката страна и обработва всички двойки (поръчка, доставчик) по
+    нарастващо разстояние, като всяка поръчка и всеки доставчик участват
+    най-много в една двойка.
+    Това е алчно приближение на минималното общо разстояние, което работи
+    за милисекунди/секунди при хиляди поръчки, за разлика от точните
+    алгоритми за назначение (O(n^3)).
+
+    Args:
+        distance (callable): Функция (point_a, point_b) -> разстояние. По подразбиране haversine_km.
+        cell_size (float): Размер на клетката на решетката в градуси (~1.1 км за 0.01).
+        candidates (int): Колко най-близки кандидати се разглеждат наведнъж.
+        max_rings (int): Максимален радиус на търсене в клетки; по-далечни двойки не се разглеждат.
+    """
+
+    def __init__(self, distance=haversine_km, cell_size=0.01, candidates=3, max_rings=30):
+        self.distance = distance
+        self.candidates = candidates
+        self.max_rings = max_rings
+        self.orders = GeoGrid(cell_size)
+        self.couriers = GeoGrid(cell_size)
+
+    def add_order(self, order_id, point):
+        self.orders.add(order_id, point)
+
+    def remove_order(self, order_id):
+        self.orders.remove(order_id)
+
+    def add_courier(self, courier_id, point):
+        self.couriers.add(courier_id, point)
+
+    def remove_courier(self, courier_id):
+        self.couriers.remove(courier_id)
+
+    def nearest(self, grid, point, limit, exclude=()):
+        """
+        Връща до limit най-близки точки от grid като двойки (разстояние, ключ).
+
+        Търсенето спира един пръстен след като са намерени limit кандидати,
+        за да се хванат и по-близки точки в съседни клетки.
+        """
+        found = []
+        stop_at = None
+        for radius in range(self.max_rings + 1):
+            for key in grid.ring(point, radius):
+                if key not in exclude:
+                    found.append((self.distance(point, grid.points[key]), key))
+            if stop_at is None and len(found) >= limit:
+                stop_at = radius + 1
+            if stop_at is not None and radius >= stop_at:
+                break
+        found.sort()
+        return found[:limit]
+
+    def assign(self):
+        """
+        Разпределя чакащите поръчки към свободните доставчици.
+
+        Кандидатите се търсят от по-малката страна към по-голямата (напр. при
+        10 000 поръчки и 2 000 доставчици - най-близките поръчки за всеки
+        доставчик), така че работата зависи от по-малкия брой.
+
+        Разпределените поръчки и доставчици се премахват от двигателя;
+        останалите (без двойка в обхват) чакат следващата партида.
+
+        Returns:
+            list: Тройки (order_id, courier_id, разстояние), подредени по реда на разпределяне.
+        """
+        orders_first = len(self.orders) <= len(self.couriers)
+        searchers, targets = (self.orders, self.couriers) if orders_first else (self.couriers, self.orders)
+
+        sequence = itertools.count()
+        heap = []
+        # Брой кандидати в heap-а за всеки търсещ
+        pending = {}
+        for key, point in searchers.points.items():
+            candidates = self.nearest(targets, point, self.candidates)
+            pending[key] = len(candidates)
+            for distance, target in candidates:
+                heap.append((distance, next(sequence), key, target))
+        heapq.heapify(heap)
+
+        matched = set()
+        taken = set()
+        pairs = []
+        while heap and len(taken) < len(targets) and len(matched) < len(searchers):
+            distance, _, key, target = heapq.heappop(heap)
+            if key in matched:
+                continue
+            pending[key] -= 1
+            if target in taken:
+                if pending[key] == 0:
+                    # Всички кандидати са заети - търсим нови
+                    candidates = self.nearest(targets, searchers.points[key], self.candidates, taken)
+                    pending[key] = len(candidates)
+                    for candidate_distance, candidate in candidates:
+                        heapq.heappush(heap, (candidate_distance, next(sequence), key, candidate))
+                continue
+            matched.add(key)
+            taken.add(target)
+            pairs.append((key, target, distance))
+
+        assignments = [
+            (key, target, distance) if orders_first else (target, key, distance)
+            for key, target, distance in pairs
+        ]
+        for order_id, courier_id, _ in assignments:
+            self.orders.remove(order_id)
+            self.couriers.remove(courier_id)
+        return assignments
+
+
+def get_distance_function():
+    """
+    Функцията за разстояние от settings.DISPATCH_DISTANCE_FUNCTION (dotted path) или haversine_km.
+    """
+    path = getattr(settings, 'DISPATCH_DISTANCE_FUNCTION', None)
+    return import_string(path) if path else haversine_km
+
+
+def get_geocoder():
+    """
+    Геокодерът от settings.DISPATCH_GEOCODER (dotted path към функция address -> (lat, lon) | None).
+
+    По подразбиране няма геокодер и поръчките без координати не се разпределят автоматично.
+    """
+    path = getattr(settings, 'DISPATCH_GEOCODER', None)
+    return import_string(path) if path else None
+
+
+def _pickup_points(orders):
+    """
+    Точка на вземане за всяка поръчка: ресторантът на първия артикул с координати,
+    иначе геокодираният адрес на поръчката.
+    """
+    points = {}
+    for order_id, latitude, longitude in (
+        OrderItem.objects.filter(
+            order__in=orders,
+            product__restaurant__latitude__isnull=False,
+            product__restaurant__longitude__isnull=False,
+        )
+        .order_by('order_id', 'id')
+        .values_list('order_id', 'product__restaurant__latitude', 'product__restaurant__longitude')
+    ):
+        points.setdefault(order_id, (latitude, longitude))
+
+    missing = []
+    for order in orders.exclude(pk__in=list(points)).only('pk', 'address', 'latitude', 'longitude'):
+        if order.latitude is not None and order.longitude is not None:
+            points[order.pk] = (order.latitude, order.longitude)
+        else:
+            missing.append(order)
+
+    geocoder = get_geocoder()
+    if geocoder is not None:
+        geocoded = []
+        for order in missing:
+            point = geocoder(order.address) if order.address else None
+            if point is not None:
+                order.latitude, order.longitude = point
+                points[order.pk] = point
+                geocoded.append(order)
+        Order.objects.bulk_update(geocoded, ['latitude', 'longitude'])
+    return points
+
+
+def dispatch_pending_orders(batch_size=None, engine=None):
+    """
+    Една партида на автоматичното разпределяне.
+
+    Зарежда най-старите незаявени поръчки и свободните доставчици (на линия,
+    с координати и без активна доставка), разпределя ги с DispatchEngine и
+    записва резултата чрез claim_order, така че ръчно взетите междувременно
+    поръчки се пропускат безопасно.
+
+    Args:
+        batch_size (int | None): Максимален брой поръчки в партидата
+            (по подразбиране settings.DISPATCH_BATCH_SIZE или 1000).
+        engine (DispatchEngine | None): Двигател за разпределяне; по подразбиране нов
+            с функцията за разстояние от настройките.
+
+    Returns:
+        list: Тройки (order_id, courier_id, разстояние) за успешно заявените поръчки.
+    """
+    batch_size = batch_size or getattr(settings, 'DISPATCH_BATCH_SIZE', 1000)
+    engine = engine or DispatchEngine(distance=get_distance_function())
+
+    order_ids = list(
+        _unclaimed_orders().order_by('created_at', 'id').values_list('pk', flat=True)[:batch_size]
+    )
+    if not order_ids:
+        return []
+    for order_id, point in _pickup_points(Order.objects.filter(pk__in=order_ids)).items():
+        engine.add_order(order_id, point)
+
+    couriers = {
+        courier.pk: courier
+        for courier in DeliveryPerson.objects.filter(
+            is_available=True,
+            latitude__isnull=False,
+            longitude__isnull=False,
+        ).exclude(orders__status='shipped').only('pk', 'latitude', 'longitude')
+    }
+    for courier in couriers.values():
+        engine.add_courier(courier.pk, (courier.latitude, courier.longitude))
+
+    return [
+        (order_id, courier_id, distance)
+        for order_id, courier_id, distance in engine.assign()
+        if claim_order(order_id, couriers[courier_id])
+    ]
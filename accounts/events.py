@@ -0,0 +1,207 @@
+"""
+Известия в реално време за промени в статуса на поръчки.
+
+Order.save() и claim_order() публикуват съобщение след commit на
+транзакцията към каналите на клиента и на доставчика ("user:<id>").
+Изгледът order_events (Server-Sent Events, обслужван от ASGI приложението)
+се абонира за канала на текущия потребител и препраща съобщенията към
+браузъра, така че страниците не трябва да се презареждат.
+
+Брокерът е сменяем чрез settings.EVENTS_BROKER (dotted path към клас с
+методи publish(channel, message) и subscribe(channel)):
+
+- LocalBroker държи абонатите в паметта на процеса. Съобщенията стигат
+  само до абонати в същия процес, затова е подходящ само когато целият
+  сайт се обслужва от един процес (разработка). Съобщенията от други
+  процеси - gunicorn worker-и, manage.py run_dispatch (claim_order) или
+  run_workers - никога не достигат до абонатите му.
+- RedisBroker публикува през Redis pub/sub, така че съобщенията от всички
+  процеси стигат до ASGI процеса, който обслужва /order-events/ (вижте
+  FOOD_DELIVERY_WEB/asgi.py). Използва се по подразбиране в prod.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger('accounts.events')
+
+# Максимален брой непрочетени съобщения на абонат (най-старите се изхвърлят)
+SUBSCRIPTION_QUEUE_SIZE = 100
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class Subscription:
+    """
+    Абонамент за канал; съобщенията се четат с `await subscription.get()`.
+
+    Създава се в event loop-а на абоната, а съобщенията могат да се
+    доставят от всяка нишка (напр. от синхронен Order.save()).
+    """
+
+    def __init__(self, broker, channel, maxsize=SUBSCRIPTION_QUEUE_SIZE):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+
+    def _put(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    def deliver(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # Event loop-ът на абоната е затворен
+            self.close()
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """
+    Pub/sub в паметта на процеса.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.deliver(message)
+        return len(subscriptions)
+
+
+class RedisBroker(LocalBroker):
+    """
+    Pub/sub през Redis, общ за всички процеси.
+
+    publish() изпраща съобщението в Redis (като JSON). Абонатите в текущия
+    процес се обслужват от LocalBroker, който се захранва от една фонова
+    нишка, абонирана за всички потребителски канали ("user:*"). Нишката
+    се стартира при първия абонамент, т.е. само в ASGI процеса.
+
+    Настройки:
+        EVENTS_REDIS_URL: Адрес на Redis сървъра. Изисква пакета redis.
+    """
+
+    def __init__(self, client=None):
+        super().__init__()
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(getattr(settings, 'EVENTS_REDIS_URL', 'redis://127.0.0.1:6379/2'))
+        self._redis = client
+        self._listener = None
+
+    def publish(self, channel, message):
+        return self._redis.publish(channel, json.dumps(message, cls=DjangoJSONEncoder))
+
+    def subscribe(self, channel):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='events-redis', daemon=True)
+                self._listener.start()
+        return super().subscribe(channel)
+
+    def _dispatch(self, channel, data):
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        return super().publish(channel, json.loads(data))
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(user_channel('*'))
+                for item in pubsub.listen():
+                    if item['type'] == 'pmessage':
+                        self._dispatch(item['channel'], item['data'])
+            except Exception:
+                # Прекъсната връзка - нов опит след малко
+                logger.exception("Грешка във връзката с Redis за известията")
+                time.sleep(1)
+
+
+_brokers = {}
+
+
+def get_broker():
+    """
+    Брокерът от settings.EVENTS_BROKER (по подразбиране LocalBroker), един на процес.
+    """
+    path = getattr(settings, 'EVENTS_BROKER', None) or 'accounts.events.LocalBroker'
+    if path not in _brokers:
+        _brokers[path] = import_string(path)()
+    return _brokers[path]
+
+
+def publish_order_status(order_id, client_id, status, previous_status, delivery_person_ids):
+    """
+    Изпраща съобщение за нов статус на поръчка до клиента и доставчиците.
+
+    Args:
+        order_id (int): ID на поръчката.
+        client_id (int): ID на клиента (съвпада с ID на потребителя).
+        status (str): Новият статус.
+        previous_status (str | None): Предишният статус.
+        delivery_person_ids (iterable): Текущият и (при смяна) предишният доставчик.
+    """
+    message = {
+        'type': 'order.status',
+        'order_id': order_id,
+        'status': status,
+        'previous_status': previous_status,
+    }
+    broker = get_broker()
+    for user_id in {client_id, *delivery_person_ids} - {None}:
+        broker.publish(user_channel(user_id), message)
+
+
+def publish_order_status_on_commit(order, previous_status, previous_delivery_person_id=None):
+    """
+    Публикува промяната на статуса след commit (при rollback не се изпраща нищо).
+    """
+    values = (
+        order.pk,
+        order.client_id,
+        order.status,
+        previous_status,
+        (order.delivery_person_id, previous_delivery_person_id),
+    )
+    transaction.on_commit(lambda: publish_order_status(*values))
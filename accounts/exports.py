@@ -0,0 +1,168 @@
+"""
+Поточен (streaming) експорт на поръчки и приходи на доставчици.
+
+Редовете се четат със server-side курсор (`QuerySet.iterator(chunk_size=...)`)
+и се изпращат към клиента веднага чрез StreamingHttpResponse, така че
+паметта на процеса не зависи от броя редове в експорта.
+
+Поддържани формати:
+    - csv: заглавен ред с описания на колоните, след това по един ред на запис;
+    - jsonl: по един JSON обект на ред, с ключовете на колоните.
+"""
+
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+
+from .models import DailyTurnover, Order, OrderItem
+from .rollups import day_bounds
+
+
+# Брой редове, които се взимат от базата наведнъж
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# Колони: (ключ, поле за values_list, заглавие в CSV)
+ORDER_COLUMNS = [
+    ('id', 'id', 'Поръчка'),
+    ('created_at', 'created_at', 'Създадена'),
+    ('client', 'client__user__username', 'Клиент'),
+    ('delivery_person', 'delivery_person__user__username', 'Доставчик'),
+    ('status', 'status', 'Статус'),
+    ('total_price', 'total_price', 'Обща цена'),
+    ('address', 'address', 'Адрес'),
+    ('phone_number', 'phone_number', 'Телефон'),
+]
+
+ORDER_ITEM_COLUMNS = [
+    ('id', 'id', 'Ред'),
+    ('order_id', 'order_id', 'Поръчка'),
+    ('created_at', 'order__created_at', 'Създадена'),
+    ('restaurant', 'product__restaurant__name', 'Ресторант'),
+    ('product', 'product__name', 'Продукт'),
+    ('quantity', 'quantity', 'Количество'),
+    ('price', 'price', 'Цена'),
+]
+
+COURIER_EARNINGS_COLUMNS = [
+    ('delivery_person_id', 'delivery_person_id', 'ID'),
+    ('delivery_person', 'delivery_person__user__username', 'Доставчик'),
+    ('order_count', 'order_count', 'Брой поръчки'),
+    ('total_earnings', 'total_earnings', 'Приходи'),
+]
+
+
+class _Echo:
+    """
+    Псевдо-файл за csv.writer, който връща записания ред вместо да го буферира.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _period_filter(lookup, start_date, end_date):
+    start, _ = day_bounds(start_date)
+    _, end = day_bounds(end_date)
+    return {f'{lookup}__gte': start, f'{lookup}__lt': end}
+
+
+def order_rows(start_date, end_date):
+    """
+    Поръчките, създадени в периода, подредени по id.
+    """
+    return (
+        Order.objects.filter(**_period_filter('created_at', start_date, end_date))
+        .order_by('id')
+        .values_list(*[field for _, field, _ in ORDER_COLUMNS])
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+def order_item_rows(start_date, end_date):
+    """
+    Артикулите на поръчките, създадени в периода, подредени по id.
+    """
+    return (
+        OrderItem.objects.filter(**_period_filter('order__created_at', start_date, end_date))
+        .order_by('id')
+        .values_list(*[field for _, field, _ in ORDER_ITEM_COLUMNS])
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+def courier_earnings_rows(start_date, end_date, delivery_person_ids=None):
+    """
+    Приходите на доставчиците за периода от дневните обобщения (по един ред на доставчик).
+    """
+    rows = DailyTurnover.objects.filter(
+        day__range=(start_date, end_date),
+        status='delivered',
+        delivery_person__isnull=False,
+    )
+    if delivery_person_ids is not None:
+        rows = rows.filter(delivery_person_id__in=delivery_person_ids)
+    return (
+        rows.values('delivery_person_id', 'delivery_person__user__username')
+        .annotate(order_count=Sum('order_count'), total_earnings=Sum('total_price'))
+        .order_by('delivery_person_id')
+        .values_list(*[field for _, field, _ in COURIER_EARNINGS_COLUMNS])
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+DATASETS = {
+    'orders': (ORDER_COLUMNS, order_rows),
+    'order_items': (ORDER_ITEM_COLUMNS, order_item_rows),
+    'courier_earnings': (COURIER_EARNINGS_COLUMNS, courier_earnings_rows),
+}
+
+
+def stream_csv(columns, rows):
+    """
+    Генерира CSV редове един по един.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow([label for _, _, label in columns])
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_jsonl(columns, rows):
+    """
+    Генерира JSON Lines редове един по един.
+    """
+    keys = [key for key, _, _ in columns]
+    for row in rows:
+        yield json.dumps(dict(zip(keys, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def export_response(dataset, export_format, start_date, end_date, **filters):
+    """
+    Създава StreamingHttpResponse за избрания набор от данни и формат.
+
+    Args:
+        dataset (str): Ключ от DATASETS ('orders', 'order_items', 'courier_earnings').
+        export_format (str): 'csv' или 'jsonl'.
+        start_date (date): Начална дата (включително).
+        end_date (date): Крайна дата (включително).
+        **filters: Допълнителни аргументи за функцията на набора от данни.
+
+    Returns:
+        StreamingHttpResponse: Отговор, който се генерира поточно.
+    """
+    columns, rows_function = DATASETS[dataset]
+    rows = rows_function(start_date, end_date, **filters)
+    stream = stream_csv if export_format == 'csv' else stream_jsonl
+
+    response = StreamingHttpResponse(stream(columns, rows), content_type=EXPORT_FORMATS[export_format])
+    filename = f'{dataset}_{start_date}_{end_date}.{export_format}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -86,56 +86,103 @@ class ProductForm(forms.ModelForm):
 
 
 
-class OrderForm(forms.ModelForm):
+class OrderBuilderForm(forms.Form):
     """
-    Форма за създаване и редактиране на поръчки с включени продукти.
+    Форма за директна поръчка от менюто на един ресторант.
 
-    Предоставя интерфейс с checkbox-и за избор на множество продукти,
-    които да бъдат включени в поръчката. Обслужва many-to-many връзката
-    между Order и Product.
+    Продуктите не са поле с избор (това би заредило цялото меню при всяко
+    показване и проверка), а идват като `quantity_<id>` от страницата с
+    продукти на ресторанта; празно или 0 означава, че продуктът не се поръчва.
+    При проверка всички избрани продукти се търсят с една заявка (id__in,
+    само в менюто на ресторанта), като цените им се вземат от същата заявка.
 
     Полета:
-        items (ModelMultipleChoiceField):
-            - Позволява избор на множество продукти
-            - Визуализира се като checkbox-и (CheckboxSelectMultiple)
-            - Задължително поле (трябва да изберете поне един продукт)
-            - Съдържа всички налични продукти от базата данни
+        address (CharField): Адрес за доставка.
+        phone_number (CharField): Телефонен номер за връзка.
 
-    Meta:
-        model (Order): Моделът Order, на който се базира формата
-        fields (list): Съдържа само полето 'items', което е единственото
-                      необходимо за създаване на поръчка
+    След успешна проверка cleaned_data['lines'] съдържа редовете
+    (product_id, quantity, price) за services.place_order.
 
     Примерна употреба:
-        form = OrderForm()
-        # или със съществуваща поръчка
-        form = OrderForm(instance=поръчка)
-        
-        if request.method == 'POST':
-            form = OrderForm(request.POST, instance=поръчка)
-            if form.is_valid():
-                поръчка = form.save()
-                # Допълнителна обработка...
-
-    Валидация:
-        - Автоматично проверява дали избраните продукти съществуват
-        - Изисква избор на поне един продукт
-
-    Рендиране в шаблони:
-        Показва checkbox-и за избор на продукти. В шаблона използвайте:
-        {% for checkbox in form.items %}
-            {{ checkbox.tag }} {{ checkbox.choice_label }}
-        {% endfor %}
+        form = OrderBuilderForm(restaurant, request.POST)
+        if form.is_valid():
+            place_order(client, form.cleaned_data['lines'], ...)
     """
-    items = forms.ModelMultipleChoiceField(
-        queryset=Product.objects.all(),
-        widget=forms.CheckboxSelectMultiple,
-        required=True
-    )
+    QUANTITY_PREFIX = 'quantity_'
 
-    class Meta:
-        model = Order
-        fields = ['items']
+    # Най-много редове в една поръчка (колкото продукта се показват на страница)
+    MAX_LINES = 50
+
+    # Най-голямо количество от един продукт (пази и колоните за количество и сума от препълване)
+    MAX_QUANTITY = 99
+
+    address = forms.CharField(max_length=255, required=True, label="Адрес")
+    phone_number = forms.CharField(max_length=20, required=True, label="Телефонен номер")
+
+    def __init__(self, restaurant, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.restaurant = restaurant
+
+    def submitted_quantities(self):
+        """
+        Въведените (ненулеви) количества {product_id: стойност} без проверка.
+
+        Използва се за повторно показване на формата и за пренасяне на
+        избора между страниците с продукти.
+        """
+        submitted = {}
+        for key, value in self.data.items():
+            product_id = key[len(self.QUANTITY_PREFIX):]
+            value = value.strip()
+            if key.startswith(self.QUANTITY_PREFIX) and product_id.isdigit() and value not in ('', '0'):
+                submitted[int(product_id)] = value
+        return submitted
+
+    def selected_quantities(self):
+        """
+        Избраните количества {product_id: quantity} от данните на формата.
+
+        Raises:
+            ValidationError: При невалиден продукт или количество (отрицателно или над MAX_QUANTITY).
+        """
+        quantities = {}
+        for key, value in self.data.items():
+            if not key.startswith(self.QUANTITY_PREFIX):
+                continue
+            value = value.strip()
+            if not value:
+                continue
+            try:
+                product_id = int(key[len(self.QUANTITY_PREFIX):])
+                quantity = int(value)
+            except ValueError:
+                raise forms.ValidationError("Невалидно количество.")
+            if quantity < 0:
+                raise forms.ValidationError("Количеството не може да е отрицателно.")
+            if quantity > self.MAX_QUANTITY:
+                raise forms.ValidationError(f"Количеството на продукт може да е най-много {self.MAX_QUANTITY}.")
+            if quantity:
+                quantities[product_id] = quantity
+        return quantities
+
+    def clean(self):
+        cleaned_data = super().clean()
+        quantities = self.selected_quantities()
+        if not quantities:
+            raise forms.ValidationError("Изберете поне един продукт.")
+        if len(quantities) > self.MAX_LINES:
+            raise forms.ValidationError(f"Поръчката може да съдържа най-много {self.MAX_LINES} продукта.")
+
+        prices = dict(
+            Product.objects.filter(restaurant=self.restaurant, id__in=list(quantities)).values_list('id', 'price')
+        )
+        if len(prices) != len(quantities):
+            raise forms.ValidationError("Някои от избраните продукти не са в менюто на ресторанта.")
+
+        cleaned_data['lines'] = [
+            (product_id, quantity, prices[product_id]) for product_id, quantity in quantities.items()
+        ]
+        return cleaned_data
 
 class CheckoutForm(forms.Form):
     """
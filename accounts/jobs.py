@@ -0,0 +1,254 @@
+"""
+Опашка за фонови задачи в базата данни (без външен брокер).
+
+Страничните ефекти на промените по поръчките - дневните обобщения
+(accounts.rollups), журналът на доставчиците с бонусите (accounts.ledger) и
+имейл известията - не се изпълняват в заявката. Вместо това enqueue()
+добавя Job запис в транзакцията на самата промяна: при rollback задачата
+изчезва заедно с нея, а след commit става видима за worker-ите.
+
+manage.py run_workers стартира N процеса. Всеки взима по една задача с
+SELECT ... FOR UPDATE SKIP LOCKED и я изпълнява в транзакцията, в която я
+е заключил. Успешната задача се изтрива атомарно с ефектите си, така че не
+се изпълнява втори път, дори ако worker-ът спре веднага след това. При
+грешка ефектите се отменят и задачата се насрочва отново след
+JOBS_RETRY_BACKOFF * 2**(опит - 1) секунди (най-много JOBS_RETRY_BACKOFF_MAX).
+
+Задачите с външни ефекти (например изпращане на имейл) се регистрират с
+transactional=False: worker-ът само ги "наема" за JOBS_LEASE_TIMEOUT
+секунди и освобождава заключването, а самата задача се изпълнява извън
+транзакцията. Така бавен SMTP сървър не държи заключени редове в базата.
+
+Неуспешните задачи (status='failed') остават за преглед в администрацията
+JOBS_FAILED_RETENTION дни, след което purge_failed_jobs() ги изтрива.
+
+С settings.JOBS_EAGER задачите се изпълняват веднага при enqueue, без
+worker-и (за разработка и тестове).
+"""
+
+import json
+import logging
+import traceback
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import DatabaseError, close_old_connections, transaction
+from django.utils import timezone
+
+from .ledger import adjust_turnover, credit_delivery
+from .models import Job, Order
+from .rollups import apply_rollup_changes
+
+
+logger = logging.getLogger('accounts.jobs')
+
+JobSpec = namedtuple('JobSpec', ['function', 'max_attempts', 'transactional'], defaults=[True])
+
+# Регистрираните задачи: име -> JobSpec
+JOBS = {}
+
+
+def job(name, max_attempts=5, transactional=True):
+    """
+    Регистрира функция като задача с дадено име.
+
+    Функцията получава payload-а като ключови аргументи, затова те трябва
+    да могат да се запишат в JSON (id-та, низове, числа). При
+    transactional=False задачата се изпълнява извън транзакцията на worker-а.
+    """
+    def decorator(function):
+        JOBS[name] = JobSpec(function, max_attempts, transactional)
+        return function
+    return decorator
+
+
+def enqueue(name, **payload):
+    """
+    Добавя задача в опашката (в текущата транзакция, ако има такава).
+
+    Returns:
+        Job | None: Добавената задача или None при settings.JOBS_EAGER.
+
+    Raises:
+        KeyError: Ако няма задача с това име.
+    """
+    spec = JOBS[name]
+    if getattr(settings, 'JOBS_EAGER', False):
+        # Както при worker-а: аргументите минават през JSON
+        spec.function(**json.loads(json.dumps(payload)))
+        return None
+    return Job.objects.create(name=name, payload=payload, max_attempts=spec.max_attempts)
+
+
+def retry_delay(attempts):
+    """
+    Секунди до следващия опит след attempts неуспешни опита (експоненциално).
+    """
+    base = getattr(settings, 'JOBS_RETRY_BACKOFF', 10)
+    return min(base * 2 ** (attempts - 1), getattr(settings, 'JOBS_RETRY_BACKOFF_MAX', 60 * 60))
+
+
+def _record_failure(job):
+    """
+    Отбелязва неуспешен опит: насрочва задачата отново или я маркира като 'failed'.
+    """
+    job.attempts += 1
+    job.last_error = traceback.format_exc()
+    if job.attempts >= job.max_attempts:
+        job.status = 'failed'
+        # run_at пази времето на последния опит (за purge_failed_jobs)
+        job.run_at = timezone.now()
+        logger.error("Задача %s #%s е неуспешна след %s опита", job.name, job.pk, job.attempts)
+    else:
+        job.run_at = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+        logger.warning("Задача %s #%s: опит %s е неуспешен", job.name, job.pk, job.attempts)
+    job.save(update_fields=['attempts', 'last_error', 'status', 'run_at'])
+
+
+def run_next_job():
+    """
+    Изпълнява най-старата готова задача, която не е заключена от друг worker.
+
+    Returns:
+        bool: True, ако е имало задача за изпълнение (успешна или не).
+    """
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status='queued', run_at__lte=timezone.now())
+            .order_by('run_at', 'id')
+            .first()
+        )
+        if job is None:
+            return False
+
+        spec = JOBS.get(job.name)
+        if spec is not None and not spec.transactional:
+            # Наема задачата и освобождава реда; изпълнението е след commit
+            job.run_at = timezone.now() + timedelta(seconds=getattr(settings, 'JOBS_LEASE_TIMEOUT', 5 * 60))
+            job.save(update_fields=['run_at'])
+        else:
+            try:
+                if spec is None:
+                    raise LookupError(f"Непозната задача {job.name!r}")
+                # Savepoint: при грешка се отменят само ефектите на задачата
+                with transaction.atomic():
+                    spec.function(**job.payload)
+            except Exception:
+                _record_failure(job)
+            else:
+                job.delete()
+            return True
+
+    try:
+        spec.function(**job.payload)
+    except Exception:
+        _record_failure(job)
+    else:
+        job.delete()
+    return True
+
+
+def run_pending_jobs(limit=None):
+    """
+    Изпълнява готовите задачи, докато опашката се изпразни (или до limit задачи).
+
+    Returns:
+        int: Брой изпълнени задачи.
+    """
+    count = 0
+    while (limit is None or count < limit) and run_next_job():
+        count += 1
+    return count
+
+
+def purge_failed_jobs(retention_days=None):
+    """
+    Изтрива неуспешните задачи, по-стари от retention_days дни
+    (по подразбиране settings.JOBS_FAILED_RETENTION).
+
+    Returns:
+        int: Брой изтрити задачи.
+    """
+    if retention_days is None:
+        retention_days = getattr(settings, 'JOBS_FAILED_RETENTION', 30)
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    deleted, _ = Job.objects.filter(status='failed', run_at__lt=cutoff).delete()
+    return deleted
+
+
+def work(stop, poll_interval=None):
+    """
+    Цикълът на един worker: изпълнява задачи, докато stop (Event) не бъде вдигнат.
+
+    При празна опашка или грешка в базата изчаква poll_interval секунди
+    (по подразбиране settings.JOBS_POLL_INTERVAL).
+    """
+    if poll_interval is None:
+        poll_interval = getattr(settings, 'JOBS_POLL_INTERVAL', 1)
+    while not stop.is_set():
+        # Затваря изтеклите или прекъснати връзки, както след всяка HTTP заявка
+        close_old_connections()
+        try:
+            ran = run_next_job()
+        except DatabaseError:
+            logger.exception("Грешка в базата при изпълнение на задача")
+            ran = False
+        if not ran:
+            stop.wait(poll_interval)
+
+
+def _existing_order_id(order_id):
+    # Поръчката може да е изтрита, преди задачата да бъде изпълнена
+    return order_id if order_id and Order.objects.filter(pk=order_id).exists() else None
+
+
+@job('rollup.apply')
+def apply_rollup_changes_job(changes):
+    """
+    Прилага промените в дневните обобщения (rollups.rollup_changes).
+    """
+    apply_rollup_changes(changes)
+
+
+@job('ledger.credit_delivery')
+def credit_delivery_job(order_id, delivery_person_id, total_price):
+    """
+    Записва оборота (и бонуса при достигнат праг) в журнала на доставчика.
+    """
+    credit_delivery(Order(
+        pk=_existing_order_id(order_id),
+        delivery_person_id=delivery_person_id,
+        total_price=Decimal(total_price),
+    ))
+
+
+@job('ledger.adjust_turnover')
+def adjust_turnover_job(order_id, adjustments):
+    """
+    Записва корекции на оборота в журнала на доставчиците (ledger.adjust_turnover).
+    """
+    adjust_turnover(_existing_order_id(order_id), adjustments)
+
+
+@job('orders.notify_status', transactional=False)
+def notify_order_status(order_id, status):
+    """
+    Изпраща имейл на клиента за новия статус на поръчката (ако има имейл).
+
+    Изпълнява се извън транзакцията на worker-а: при грешка след изпращането
+    имейлът може да бъде изпратен повторно, но SMTP не държи заключвания.
+    """
+    order = Order.objects.select_related('client__user').filter(pk=order_id).first()
+    if order is None or not order.client.user.email:
+        return
+    label = dict(Order.STATUS_CHOICES).get(status, status)
+    send_mail(
+        subject=f"Поръчка #{order.pk}: {label}",
+        message=f"Статусът на поръчка #{order.pk} е променен на „{label}“.",
+        from_email=None,
+        recipient_list=[order.client.user.email],
+    )
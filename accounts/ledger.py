@@ -0,0 +1,190 @@
+"""
+Журнал на оборота и бонусите на доставчиците (CourierLedgerEntry).
+
+Доставките само добавят редове в журнала (bulk INSERT). Редът на доставчика
+се заключва само докато се проверява прагът за бонус, за да не се пропусне
+бонус при паралелни доставки на един доставчик. Кешираните суми DeliveryPerson.total_turnover и
+total_bonuses се обновяват инкрементално от refresh_courier_totals(),
+който прибавя неотчетените записи с по един UPDATE на партида; manage.py
+run_workers го изпълнява периодично (JOBS_MAINTENANCE_INTERVAL).
+Точните текущи суми (кеш + неотчетени записи) се четат с courier_totals().
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .cache import get_active_bonus_settings
+from .models import CourierLedgerEntry, DeliveryPerson
+
+
+# Брой записи, които refresh_courier_totals обработва в една транзакция
+REFRESH_BATCH_SIZE = 5000
+
+
+def _pending_sum(kind):
+    """
+    Сумата на неотчетените записи от даден вид за доставчика от външната заявка.
+
+    Подзаявката чете само applied=False записи (частичния индекс
+    ledger_unapplied_idx), а не цялата история на журнала.
+    """
+    pending = (
+        CourierLedgerEntry.objects.filter(delivery_person=OuterRef('pk'), applied=False, kind=kind)
+        .order_by()
+        .values('delivery_person')
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+    return Coalesce(
+        Subquery(pending, output_field=DecimalField(max_digits=12, decimal_places=2)),
+        Value(Decimal('0')),
+    )
+
+
+def with_courier_totals(queryset):
+    """
+    Добавя към заявката за доставчици точните им суми (кеш + неотчетени записи).
+
+    Анотациите current_turnover и current_bonuses се изчисляват в същата
+    заявка, без N+1 заявки при списъци (например в администрацията).
+    """
+    return queryset.annotate(
+        current_turnover=F('total_turnover') + _pending_sum('turnover'),
+        current_bonuses=F('total_bonuses') + _pending_sum('bonus'),
+    )
+
+
+def courier_totals(delivery_person_id):
+    """
+    Връща точния оборот и бонуси на доставчика, без да заключва реда му.
+
+    Returns:
+        dict: {'turnover': Decimal, 'bonuses': Decimal}
+    """
+    rows = with_courier_totals(DeliveryPerson.objects.filter(pk=delivery_person_id))
+    row = next(iter(rows.values('current_turnover', 'current_bonuses')), None)
+    if row is None:
+        return {'turnover': Decimal('0'), 'bonuses': Decimal('0')}
+    return {'turnover': row['current_turnover'], 'bonuses': row['current_bonuses']}
+
+
+def credit_delivery(order):
+    """
+    Записва оборота от доставена поръчка и, при достигнат праг, бонус.
+
+    Прагът от активната BonusSettings се сравнява с общия оборот на
+    доставчика след поръчката. Проверката и записите са в една транзакция,
+    в която редът на доставчика е заключен (SELECT ... FOR UPDATE), така че
+    паралелните доставки на един доставчик се сериализират и всяка вижда
+    оборота на предходните. Записите се добавят с един bulk INSERT.
+
+    Args:
+        order (Order): Току-що доставената поръчка (с delivery_person); pk може
+            да е None, ако поръчката е изтрита междувременно.
+
+    Returns:
+        list: Създадените CourierLedgerEntry записи.
+    """
+    entries = [CourierLedgerEntry(
+        delivery_person_id=order.delivery_person_id,
+        kind='turnover',
+        amount=order.total_price,
+        order_id=order.pk,
+    )]
+    bonus_settings = get_active_bonus_settings()
+    if not bonus_settings:
+        return CourierLedgerEntry.objects.bulk_create(entries)
+
+    with transaction.atomic():
+        # Заключването се държи до края на транзакцията (на задачата при worker)
+        list(DeliveryPerson.objects.select_for_update().filter(pk=order.delivery_person_id).values_list('pk'))
+        turnover = courier_totals(order.delivery_person_id)['turnover'] + Decimal(order.total_price)
+        if turnover >= bonus_settings.min_turnover:
+            entries.append(CourierLedgerEntry(
+                delivery_person_id=order.delivery_person_id,
+                kind='bonus',
+                amount=bonus_settings.bonus_amount,
+                order_id=order.pk,
+            ))
+        return CourierLedgerEntry.objects.bulk_create(entries)
+
+
+def adjust_turnover(order_id, adjustments):
+    """
+    Записва корекции на оборота: при отказ, смяна на доставчика или сумата на
+    доставена поръчка, както и при изтриването ѝ. Бонусите не се променят.
+
+    Args:
+        order_id (int | None): Поръчката, довела до корекцията.
+        adjustments (list): Двойки (delivery_person_id, сума); сумите за един
+            доставчик се обединяват, а нулевите и тези без доставчик се пропускат.
+
+    Returns:
+        list: Създадените CourierLedgerEntry записи.
+    """
+    amounts = defaultdict(Decimal)
+    for delivery_person_id, amount in adjustments:
+        if delivery_person_id:
+            amounts[delivery_person_id] += Decimal(amount)
+    return CourierLedgerEntry.objects.bulk_create([
+        CourierLedgerEntry(delivery_person_id=delivery_person_id, kind='turnover', amount=amount, order_id=order_id)
+        for delivery_person_id, amount in amounts.items()
+        if amount
+    ])
+
+
+def refresh_courier_totals(delivery_person_ids=None, batch_size=REFRESH_BATCH_SIZE):
+    """
+    Прибавя неотчетените записи от журнала към кешираните суми на доставчиците.
+
+    Записите се заключват с SELECT ... FOR UPDATE SKIP LOCKED, така че
+    няколко паралелни извиквания обработват различни записи, а сумите на
+    всички засегнати доставчици се обновяват с един UPDATE на партида.
+
+    Args:
+        delivery_person_ids (list | None): Само за тези доставчици (по подразбиране - всички).
+        batch_size (int): Максимален брой записи в една транзакция.
+
+    Returns:
+        int: Брой отчетени записи.
+    """
+    applied = 0
+    while True:
+        with transaction.atomic():
+            pending = CourierLedgerEntry.objects.filter(applied=False)
+            if delivery_person_ids is not None:
+                pending = pending.filter(delivery_person_id__in=delivery_person_ids)
+            rows = list(
+                pending.select_for_update(skip_locked=True)
+                .order_by('id')
+                .values_list('id', 'delivery_person_id', 'kind', 'amount')[:batch_size]
+            )
+            if not rows:
+                return applied
+
+            deltas = defaultdict(lambda: {'turnover': Decimal('0'), 'bonus': Decimal('0')})
+            for _, delivery_person_id, kind, amount in rows:
+                deltas[delivery_person_id][kind] += amount
+
+            def delta(kind):
+                return Case(
+                    *[
+                        When(pk=delivery_person_id, then=Value(values[kind]))
+                        for delivery_person_id, values in deltas.items()
+                    ],
+                    default=Value(Decimal('0')),
+                    output_field=DecimalField(max_digits=12, decimal_places=2),
+                )
+
+            DeliveryPerson.objects.filter(pk__in=list(deltas)).update(
+                total_turnover=F('total_turnover') + delta('turnover'),
+                total_bonuses=F('total_bonuses') + delta('bonus'),
+            )
+            CourierLedgerEntry.objects.filter(pk__in=[row[0] for row in rows]).update(applied=True)
+            applied += len(rows)
+        if len(rows) < batch_size:
+            return applied
@@ -0,0 +1,342 @@
+"""
+Генератор на синтетични данни за натоварващи тестове и бенчмаркове.
+
+seed_load_data() създава ресторанти, продукти, клиенти, доставчици и
+поръчки за няколко години назад с bulk INSERT на партиди, така че
+проблемите с производителността да могат да се възпроизведат при
+реалистичен обем данни. Генерираните записи се разпознават по префикса
+LOAD_USERNAME_PREFIX (потребители) и LOAD_RESTAURANT_TAG (ресторанти) и
+могат да се изтрият с clear_load_data().
+
+Генераторът е детерминиран за даден seed. Записите се вмъкват директно
+(без Order.save()), затова след тях дневните обобщения и кешираните суми
+на доставчиците се изграждат наново.
+"""
+
+import random
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .cache import invalidate_catalog
+from .models import Client, DeliveryPerson, Order, OrderItem, Product, Restaurant, User
+from .rollups import rebuild_daily_turnover
+
+
+LOAD_USERNAME_PREFIX = 'load_'
+LOAD_RESTAURANT_TAG = '[load]'
+LOAD_PASSWORD = 'load-test'
+LOAD_ADMIN_USERNAME = f'{LOAD_USERNAME_PREFIX}admin'
+
+# Център на района на доставка (София) и радиус в градуси
+CENTER = (42.6977, 23.3219)
+RADIUS = 0.12
+
+RESTAURANT_KINDS = ('Пицария', 'Тратория', 'Бистро', 'Механа', 'Кухня', 'Салатен бар')
+RESTAURANT_NAMES = (
+    'Витоша', 'Тракия', 'Странджа', 'Роден край', 'Лозенец', 'Средец',
+    'Сердика', 'Пирин', 'Родопи', 'Балкан', 'Искър', 'Младост',
+)
+STREETS = (
+    'бул. Витоша', 'ул. Граф Игнатиев', 'бул. България', 'ул. Шипка',
+    'бул. Черни връх', 'ул. Оборище', 'бул. Христо Ботев', 'ул. Раковски',
+)
+PRODUCT_NAMES = {
+    'pizza': ('Маргарита', 'Капричоза', 'Четири сирена', 'Прошуто', 'Дявола', 'Вегетариана'),
+    'pasta': ('Карбонара', 'Болонезе', 'Арабиата', 'Песто', 'Лазаня', 'Аматричана'),
+    'salad': ('Шопска', 'Цезар', 'Гръцка', 'Капрезе', 'Овчарска', 'Снежанка'),
+    'dessert': ('Тирамису', 'Панакота', 'Палачинка', 'Сладолед', 'Чийзкейк', 'Баклава'),
+    'drink': ('Лимонада', 'Айрян', 'Минерална вода', 'Кола', 'Портокалов сок', 'Студен чай'),
+}
+PRICE_RANGES = {
+    'pizza': (9, 22),
+    'pasta': (8, 18),
+    'salad': (5, 12),
+    'dessert': (4, 10),
+    'drink': (2, 6),
+}
+VEHICLE_TYPES = ('Велосипед', 'Скутер', 'Мотоциклет', 'Автомобил')
+
+# Разпределение на поръчките по час от деня (пикове на обяд и вечер)
+HOUR_WEIGHTS = (
+    0, 0, 0, 0, 0, 0, 0, 1, 2, 2, 3, 6,
+    10, 9, 5, 3, 3, 5, 9, 11, 9, 5, 2, 1,
+)
+
+
+class LoadDataExists(Exception):
+    """
+    В базата вече има генерирани данни (изтрийте ги с clear_load_data()).
+    """
+
+
+def has_load_data():
+    return User.objects.filter(username__startswith=LOAD_USERNAME_PREFIX).exists()
+
+
+def clear_load_data():
+    """
+    Изтрива генерираните потребители (заедно с поръчките им) и ресторанти.
+    """
+    with transaction.atomic():
+        User.objects.filter(username__startswith=LOAD_USERNAME_PREFIX).delete()
+        Restaurant.objects.filter(name__endswith=LOAD_RESTAURANT_TAG).delete()
+    invalidate_catalog()
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class LoadDataGenerator:
+    """
+    Генерира данните на партиди с фиксиран seed.
+
+    Args:
+        restaurants (int): Брой ресторанти.
+        products_per_restaurant (int): Брой продукти на ресторант.
+        clients (int): Брой клиенти.
+        couriers (int): Брой доставчици.
+        orders (int): Брой поръчки.
+        years (float): Период назад от днес, в който са разпределени поръчките.
+        seed (int): Seed на генератора на случайни числа.
+        batch_size (int): Брой записи в един bulk INSERT.
+    """
+
+    def __init__(self, restaurants=50, products_per_restaurant=30, clients=5000, couriers=300,
+                 orders=200000, years=3, seed=42, batch_size=5000):
+        self.restaurant_count = restaurants
+        self.products_per_restaurant = products_per_restaurant
+        self.client_count = clients
+        self.courier_count = couriers
+        self.order_count = orders
+        self.days = max(1, int(years * 365))
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.now = timezone.now()
+
+    def random_point(self):
+        return (
+            CENTER[0] + self.rng.uniform(-RADIUS, RADIUS),
+            CENTER[1] + self.rng.uniform(-RADIUS, RADIUS),
+        )
+
+    def random_address(self):
+        return f"{self.rng.choice(STREETS)} {self.rng.randint(1, 200)}, София"
+
+    def random_created_at(self):
+        # Броят поръчки расте с времето: по-новите дни са по-вероятни
+        days_ago = int(self.days * (1 - self.rng.random() ** 0.5))
+        day = self.now - timedelta(days=days_ago)
+        hour = self.rng.choices(range(24), weights=HOUR_WEIGHTS)[0]
+        return day.replace(hour=hour, minute=self.rng.randrange(60), second=self.rng.randrange(60), microsecond=0)
+
+    def create_users(self, role, count):
+        """
+        Създава потребители с роля 'client' или 'courier' и връща техните id.
+        """
+        # Паролата се хешира веднъж - хеширането е умишлено бавно
+        password = make_password(LOAD_PASSWORD)
+        users = (
+            User(
+                username=f'{LOAD_USERNAME_PREFIX}{role}_{i}',
+                password=password,
+                first_name=f'{role.capitalize()} {i}',
+                is_client=role == 'client',
+                is_delivery_person=role == 'courier',
+            )
+            for i in range(count)
+        )
+        for batch in _batched(users, self.batch_size):
+            User.objects.bulk_create(batch)
+        return list(
+            User.objects.filter(username__startswith=f'{LOAD_USERNAME_PREFIX}{role}_')
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+
+    def create_admin(self):
+        User.objects.create_superuser(
+            username=LOAD_ADMIN_USERNAME, password=LOAD_PASSWORD, email='load-admin@example.com', is_employee=True,
+        )
+
+    def create_catalog(self):
+        """
+        Създава ресторантите и продуктите им.
+
+        Returns:
+            dict: restaurant_id -> списък от двойки (product_id, цена).
+        """
+        restaurants = []
+        for i in range(self.restaurant_count):
+            latitude, longitude = self.random_point()
+            restaurants.append(Restaurant(
+                name=f"{self.rng.choice(RESTAURANT_KINDS)} {self.rng.choice(RESTAURANT_NAMES)} {i} {LOAD_RESTAURANT_TAG}",
+                address=self.random_address(),
+                latitude=latitude,
+                longitude=longitude,
+            ))
+        Restaurant.objects.bulk_create(restaurants, batch_size=self.batch_size)
+        restaurant_ids = list(
+            Restaurant.objects.filter(name__endswith=LOAD_RESTAURANT_TAG).order_by('id').values_list('id', flat=True)
+        )
+
+        categories = list(PRODUCT_NAMES)
+        products = []
+        for restaurant_id in restaurant_ids:
+            for i in range(self.products_per_restaurant):
+                category = categories[i % len(categories)]
+                low, high = PRICE_RANGES[category]
+                products.append(Product(
+                    restaurant_id=restaurant_id,
+                    name=f"{self.rng.choice(PRODUCT_NAMES[category])} {i // len(categories) + 1}",
+                    description=f"{dict(Product.CATEGORY_CHOICES)[category]} по рецепта на заведението",
+                    price=Decimal(self.rng.randint(low * 10, high * 10)) / 10,
+                    category=category,
+                ))
+        for batch in _batched(products, self.batch_size):
+            Product.objects.bulk_create(batch)
+
+        menu = defaultdict(list)
+        for product_id, restaurant_id, price in (
+            Product.objects.filter(restaurant_id__in=restaurant_ids).values_list('id', 'restaurant_id', 'price')
+        ):
+            menu[restaurant_id].append((product_id, price))
+        return menu
+
+    def create_profiles(self, client_ids, courier_ids):
+        for batch in _batched((Client(user_id=pk, address=self.random_address()) for pk in client_ids), self.batch_size):
+            Client.objects.bulk_create(batch)
+
+        def couriers():
+            for pk in courier_ids:
+                latitude, longitude = self.random_point()
+                yield DeliveryPerson(
+                    user_id=pk,
+                    vehicle_type=self.rng.choice(VEHICLE_TYPES),
+                    is_available=self.rng.random() < 0.3,
+                    latitude=latitude,
+                    longitude=longitude,
+                )
+
+        for batch in _batched(couriers(), self.batch_size):
+            DeliveryPerson.objects.bulk_create(batch)
+
+    def random_status(self, created_at):
+        age = self.now - created_at
+        if age > timedelta(days=1):
+            return 'cancelled' if self.rng.random() < 0.04 else 'delivered'
+        if age > timedelta(hours=2):
+            return self.rng.choice(('shipped', 'delivered'))
+        return self.rng.choice(('pending', 'pending', 'shipped'))
+
+    def create_orders(self, client_ids, courier_ids, menu):
+        """
+        Създава поръчките и артикулите им на партиди.
+
+        Returns:
+            dict: delivery_person_id -> общ оборот от доставените поръчки.
+        """
+        restaurant_ids = list(menu)
+        turnover = defaultdict(Decimal)
+        remaining = self.order_count
+        while remaining > 0:
+            size = min(self.batch_size, remaining)
+            remaining -= size
+
+            orders, lines = [], []
+            for _ in range(size):
+                created_at = self.random_created_at()
+                status = self.random_status(created_at)
+                # Артикулите на една поръчка са от един ресторант
+                restaurant_menu = menu[self.rng.choice(restaurant_ids)]
+                items = []
+                count = min(len(restaurant_menu), self.rng.randint(1, 4))
+                for product_id, price in self.rng.sample(restaurant_menu, count):
+                    quantity = self.rng.randint(1, 3)
+                    items.append((product_id, quantity, price * quantity))
+                latitude, longitude = self.random_point()
+                orders.append(Order(
+                    client_id=self.rng.choice(client_ids),
+                    total_price=sum(line_price for _, _, line_price in items),
+                    status=status,
+                    created_at=created_at,
+                    delivery_person_id=None if status == 'pending' else self.rng.choice(courier_ids),
+                    address=self.random_address(),
+                    phone_number=f'08{self.rng.randint(70000000, 99999999)}',
+                    latitude=latitude,
+                    longitude=longitude,
+                ))
+                lines.append(items)
+
+            with transaction.atomic():
+                Order.objects.bulk_create(orders)
+                OrderItem.objects.bulk_create(
+                    [
+                        OrderItem(order_id=order.pk, product_id=product_id, quantity=quantity, price=price)
+                        for order, items in zip(orders, lines)
+                        for product_id, quantity, price in items
+                    ],
+                    batch_size=self.batch_size,
+                )
+            for order in orders:
+                if order.status == 'delivered':
+                    turnover[order.delivery_person_id] += order.total_price
+        return turnover
+
+    def update_courier_totals(self, turnover):
+        couriers = list(DeliveryPerson.objects.filter(pk__in=list(turnover)))
+        for courier in couriers:
+            courier.total_turnover = turnover[courier.pk]
+        DeliveryPerson.objects.bulk_update(couriers, ['total_turnover'], batch_size=self.batch_size)
+
+    def run(self, log=lambda message: None):
+        """
+        Генерира всички данни и изгражда наново производните таблици.
+
+        Returns:
+            dict: Брой създадени записи по вид.
+        """
+        if has_load_data():
+            raise LoadDataExists("В базата вече има генерирани данни")
+
+        menu = self.create_catalog()
+        log(f"Ресторанти: {len(menu)}, продукти: {sum(len(products) for products in menu.values())}")
+
+        self.create_admin()
+        client_ids = self.create_users('client', self.client_count)
+        courier_ids = self.create_users('courier', self.courier_count)
+        self.create_profiles(client_ids, courier_ids)
+        log(f"Клиенти: {len(client_ids)}, доставчици: {len(courier_ids)}")
+
+        turnover = self.create_orders(client_ids, courier_ids, menu)
+        log(f"Поръчки: {self.order_count}")
+
+        self.update_courier_totals(turnover)
+        first = Order.objects.filter(client_id__in=client_ids).aggregate(first=Min('created_at'))['first']
+        rollup_rows = 0
+        if first is not None:
+            rollup_rows = rebuild_daily_turnover(timezone.localdate(first), timezone.localdate(self.now))
+        log(f"Редове в дневните обобщения: {rollup_rows}")
+        invalidate_catalog()
+
+        return {
+            'restaurants': len(menu),
+            'products': sum(len(products) for products in menu.values()),
+            'clients': len(client_ids),
+            'couriers': len(courier_ids),
+            'orders': self.order_count,
+            'rollup_rows': rollup_rows,
+        }
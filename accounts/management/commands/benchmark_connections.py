@@ -0,0 +1,139 @@
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.urls import reverse
+
+from accounts.models import Client, Order, User
+
+
+# Променливи на средата за всеки режим на връзките към базата (вижте settings.DATABASES)
+CONNECTION_MODES = {
+    'none': {'DB_CONN_MAX_AGE': '0', 'DB_POOL': '0'},
+    'persistent': {'DB_CONN_MAX_AGE': '60', 'DB_POOL': '0'},
+    'pool': {'DB_CONN_MAX_AGE': '0', 'DB_POOL': '1'},
+}
+
+BENCHMARK_USERNAME = 'benchmark_connections_client'
+
+
+class Command(BaseCommand):
+    help = 'Сравнява заявките в секунда към track_orders без постоянни връзки, с постоянни връзки и с пул'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Брой заявки за всеки режим')
+        parser.add_argument('--concurrency', type=int, default=4, help='Брой паралелни нишки')
+        parser.add_argument('--seed-orders', type=int, default=50, help='Брой поръчки на тестовия клиент')
+        parser.add_argument(
+            '--modes',
+            default=','.join(CONNECTION_MODES),
+            help='Режими за сравнение, разделени със запетая (none, persistent, pool)',
+        )
+        parser.add_argument(
+            '--single',
+            action='store_true',
+            help='Измерва само текущия режим от настройките (използва се от сравнението)',
+        )
+
+    def handle(self, *args, **options):
+        if options['single']:
+            self.run_single(options)
+            return
+
+        modes = [mode.strip() for mode in options['modes'].split(',') if mode.strip()]
+        unknown = set(modes) - set(CONNECTION_MODES)
+        if unknown:
+            raise CommandError(f"Непознати режими: {', '.join(sorted(unknown))}")
+
+        # Данните трябва да са записани (commit), защото всеки режим е в отделен процес
+        user = self.seed(options['seed_orders'])
+        try:
+            results = [(mode, self.run_mode(mode, options)) for mode in modes]
+        finally:
+            user.delete()
+
+        self.stdout.write(f"{'Режим':<12}{'заявки/с':>12}{'p50 ms':>10}{'p95 ms':>10}")
+        for mode, line in results:
+            self.stdout.write(f"{mode:<12}{line}")
+
+    def seed(self, order_count):
+        User.objects.filter(username=BENCHMARK_USERNAME).delete()
+        user = User.objects.create_user(username=BENCHMARK_USERNAME, password=None, is_client=True)
+        client = Client.objects.create(user=user, address='ул. Тестова 1')
+        Order.objects.bulk_create([
+            Order(client=client, total_price=Decimal('10.00'), address='ул. Тестова 1')
+            for _ in range(order_count)
+        ])
+        return user
+
+    def run_mode(self, mode, options):
+        env = dict(os.environ, **CONNECTION_MODES[mode])
+        command = [
+            sys.executable, sys.argv[0], 'benchmark_connections', '--single',
+            '--requests', str(options['requests']),
+            '--concurrency', str(options['concurrency']),
+        ]
+        result = subprocess.run(command, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            return f"  грешка: {result.stderr.strip().splitlines()[-1] if result.stderr.strip() else result.returncode}"
+        return result.stdout.strip().splitlines()[-1]
+
+    def login_session(self, user):
+        engine = import_module(settings.SESSION_ENGINE)
+        session = engine.SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        return session
+
+    def run_single(self, options):
+        user = User.objects.get(username=BENCHMARK_USERNAME)
+        session = self.login_session(user)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+        path = reverse('track_orders')
+        connection.close()
+
+        # Истински WSGI handler: сигналите request_started/finished управляват
+        # връзките точно както в продукция (тестовият Client ги изключва)
+        handler = WSGIHandler()
+        factory = RequestFactory()
+        lock = threading.Lock()
+        latencies = []
+
+        def request(_):
+            environ = factory.get(path, HTTP_COOKIE=cookie).environ
+            started = time.perf_counter()
+            response = handler(environ, lambda status, headers: None)
+            b''.join(response)
+            response.close()
+            elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise CommandError(f"track_orders върна {response.status_code}")
+            with lock:
+                latencies.append(elapsed)
+
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                list(executor.map(request, range(options['requests'])))
+        finally:
+            session.delete()
+        total = time.perf_counter() - started
+
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1000
+        p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+        self.stdout.write(f"{len(latencies) / total:>12.1f}{p50:>10.2f}{p95:>10.2f}")
@@ -0,0 +1,49 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.dispatch import DispatchEngine
+
+
+class Command(BaseCommand):
+    help = 'Измерва времето за разпределяне на синтетични поръчки към доставчици (DispatchEngine)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=10000, help='Брой чакащи поръчки')
+        parser.add_argument('--couriers', type=int, default=2000, help='Брой свободни доставчици')
+        parser.add_argument('--radius', type=float, default=0.15, help='Радиус на района в градуси около центъра')
+        parser.add_argument('--cell-size', type=float, default=0.01, help='Размер на клетката на решетката в градуси')
+        parser.add_argument('--seed', type=int, default=42, help='Seed на генератора на случайни числа')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        radius = options['radius']
+        # Център: София
+        center = (42.6977, 23.3219)
+
+        def random_point():
+            return (center[0] + rng.uniform(-radius, radius), center[1] + rng.uniform(-radius, radius))
+
+        orders = [(i, random_point()) for i in range(options['orders'])]
+        couriers = [(i, random_point()) for i in range(options['couriers'])]
+
+        started = time.perf_counter()
+        engine = DispatchEngine(cell_size=options['cell_size'])
+        for order_id, point in orders:
+            engine.add_order(order_id, point)
+        for courier_id, point in couriers:
+            engine.add_courier(courier_id, point)
+        indexed = time.perf_counter()
+        assignments = engine.assign()
+        finished = time.perf_counter()
+
+        total_distance = sum(distance for _, _, distance in assignments)
+        self.stdout.write(f"Поръчки: {len(orders)}, доставчици: {len(couriers)}")
+        self.stdout.write(f"Индексиране: {(indexed - started) * 1000:.1f} ms")
+        self.stdout.write(f"Разпределяне: {(finished - indexed) * 1000:.1f} ms")
+        self.stdout.write(f"Разпределени поръчки: {len(assignments)}")
+        if assignments:
+            self.stdout.write(
+                f"Общо разстояние: {total_distance:.1f} км, средно: {total_distance / len(assignments):.2f} км"
+            )
@@ -1,56 +1,139 @@
-from django.core.management.base import BaseCommand
+from calendar import monthrange
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Sum
 from django.utils import timezone
-from accounts.models import DeliveryPerson, BonusSettings, Order
-from datetime import timedelta
-from django.db.models import Sum, Q
+
+from accounts.cache import get_active_bonus_settings
+from accounts.models import BonusPayout, CourierLedgerEntry, DailyTurnover, DeliveryPerson
+
+
+def _parse_period(value):
+    try:
+        start = datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise CommandError(f"Невалиден период: {value} (очаква се ГГГГ-ММ)")
+    return start, start.replace(day=monthrange(start.year, start.month)[1])
+
+
+def _previous_month():
+    first_of_month = timezone.localdate().replace(day=1)
+    return _parse_period((first_of_month - timedelta(days=1)).strftime('%Y-%m'))
+
 
 class Command(BaseCommand):
-    help = 'Автоматично начисляване на бонуси при преминат оборот'
+    help = 'Автоматично начисляване на бонуси при преминат оборот за месец'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--period',
+            type=_parse_period,
+            help='Месец във формат ГГГГ-ММ (по подразбиране предходният месец)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Само показва кои доставчици биха получили бонус, без да записва',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Брой доставчици, обработвани в една транзакция',
+        )
 
     def handle(self, *args, **options):
         # Взимаме активните настройки
-        bonus_settings = BonusSettings.objects.filter(is_active=True).first()
+        bonus_settings = get_active_bonus_settings()
         if not bonus_settings:
             self.stdout.write("Няма активни бонус настройки")
             return
 
-        # Период - последните 30 дни
-        end_date = timezone.now().date()
-        start_date = end_date - timedelta(days=30)
-
-        qualified_dps = DeliveryPerson.objects.annotate(
-            turnover=Sum('orders__total_price',
-                         filter=Q(orders__created_at__range=[start_date, end_date],
-                                  orders__status='delivered')
-                         )
-        ).filter(turnover__gte=bonus_settings.min_turnover)
-
-        # Сигурни сме, че qualified_dps е дефинирана
-        for dp in qualified_dps:
-            dp.total_bonuses += bonus_settings.bonus_amount
-            dp.save()
-            self.stdout.write(
-                f"Начислен бонус {bonus_settings.bonus_amount} лв. за {dp.user.username} (Оборот: {dp.total_turnover} лв.)")
+        start_date, end_date = options['period'] or _previous_month()
+        amount = bonus_settings.bonus_amount
 
-        self.stdout.write(
-            f"Готово! Начислени бонуси на {qualified_dps.count()} доставчика"
+        # Една агрегираща заявка върху дневните обобщения; вече изплатените
+        # за периода доставчици се изключват (повторното изпълнение е безопасно)
+        already_paid = BonusPayout.objects.filter(
+            delivery_person_id=OuterRef('delivery_person_id'),
+            period_start=start_date,
+            period_end=end_date,
+        )
+        qualified = list(
+            DailyTurnover.objects.filter(
+                day__range=(start_date, end_date),
+                status='delivered',
+                delivery_person__isnull=False,
+            )
+            .values('delivery_person_id', 'delivery_person__user__username')
+            .annotate(turnover=Sum('total_price'))
+            .filter(turnover__gte=bonus_settings.min_turnover)
+            .filter(~Exists(already_paid))
+            .order_by('delivery_person_id')
         )
 
-'''
-# 1. Намираме доставчиците с оборот над прага
-        qualified_dps = DeliveryPerson.objects.annotate(
-            turnover=Sum('orders__total_price',
-                        filter=Q(orders__created_at__range=[start_date, end_date],
-                               orders__status='delivered')
-        ).filter(turnover__gte=bonus_settings.min_turnover)
-
-        # 2. Начисляваме бонусите
-        for dp in qualified_dps:
-            dp.total_bonuses += bonus_settings.bonus_amount
-            dp.save()
+        if options['verbosity'] >= 2:
+            for row in qualified:
+                self.stdout.write(
+                    f"Бонус {amount} лв. за {row['delivery_person__user__username']} "
+                    f"(Оборот: {row['turnover']} лв.)"
+                )
+
+        if options['dry_run']:
             self.stdout.write(
-                f"Начислен бонус {bonus_settings.bonus_amount} лв. за "
-                f"{dp.user.username} (Оборот: {dp.turnover} лв.)"
+                f"Пробно изпълнение: {len(qualified)} доставчика биха получили общо "
+                f"{amount * len(qualified)} лв. за {start_date} - {end_date}"
             )
+            return
+
+        chunk_size = options['chunk_size']
+        credited = 0
+        for offset in range(0, len(qualified), chunk_size):
+            credited += self.pay_chunk(qualified[offset:offset + chunk_size], start_date, end_date, amount)
 
-'''
\ No newline at end of file
+        self.stdout.write(
+            f"Готово! Начислени бонуси на {credited} доставчика за {start_date} - {end_date}"
+        )
+
+    def pay_chunk(self, chunk, start_date, end_date, amount):
+        """
+        Записва изплащанията и записите в журнала за една група доставчици.
+
+        Редовете на доставчиците се заключват (select_for_update, подредени по
+        ключ), след което вече изплатените за периода се изключват отново. Така
+        паралелно изпълнение за същия период изчаква първото и не начислява
+        бонус втори път, вместо да спре с IntegrityError.
+
+        Returns:
+            int: Броят на новите изплащания.
+        """
+        ids = [row['delivery_person_id'] for row in chunk]
+        with transaction.atomic():
+            list(DeliveryPerson.objects.select_for_update().filter(pk__in=ids).order_by('pk').values_list('pk'))
+            paid = set(
+                BonusPayout.objects.filter(
+                    delivery_person_id__in=ids, period_start=start_date, period_end=end_date,
+                ).values_list('delivery_person_id', flat=True)
+            )
+            chunk = [row for row in chunk if row['delivery_person_id'] not in paid]
+            BonusPayout.objects.bulk_create([
+                BonusPayout(
+                    delivery_person_id=row['delivery_person_id'],
+                    period_start=start_date,
+                    period_end=end_date,
+                    turnover=row['turnover'],
+                    amount=amount,
+                )
+                for row in chunk
+            ])
+            CourierLedgerEntry.objects.bulk_create([
+                CourierLedgerEntry(
+                    delivery_person_id=row['delivery_person_id'],
+                    kind='bonus',
+                    amount=amount,
+                )
+                for row in chunk
+            ])
+        return len(chunk)
@@ -0,0 +1,115 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import Client, DailyTurnover, DeliveryPerson, Order, User
+
+
+class _Rollback(Exception):
+    """
+    Използва се за връщане на транзакцията със синтетичните данни.
+    """
+
+
+class Command(BaseCommand):
+    help = 'Показва плана за изпълнение (EXPLAIN ANALYZE) на най-натоварените заявки от изгледите'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed-orders',
+            type=int,
+            default=0,
+            help='Брой синтетични поръчки, които да се създадат преди анализа (връщат се след това)',
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Seed на генератора на случайни числа')
+
+    def handle(self, *args, **options):
+        if not options['seed_orders']:
+            self.explain_all()
+            return
+
+        # Синтетичните данни живеят само в тази транзакция
+        try:
+            with transaction.atomic():
+                self.seed(options['seed_orders'], random.Random(options['seed']))
+                self.explain_all()
+                raise _Rollback
+        except _Rollback:
+            self.stdout.write("Синтетичните данни са премахнати.")
+
+    def seed(self, order_count, rng):
+        """
+        Създава клиенти, доставчици и поръчки с реалистично разпределение на статусите.
+        """
+        client_count = max(order_count // 50, 1)
+        courier_count = max(order_count // 500, 1)
+
+        users = User.objects.bulk_create(
+            [User(username=f'explain_client_{i}', is_client=True) for i in range(client_count)]
+            + [User(username=f'explain_courier_{i}', is_delivery_person=True) for i in range(courier_count)]
+        )
+        if users[0].pk is None:
+            # Базата не връща id при bulk_create
+            users = list(User.objects.filter(username__startswith='explain_').order_by('id'))
+        clients = Client.objects.bulk_create(
+            [Client(user=user, address='ул. Тестова 1') for user in users[:client_count]]
+        )
+        couriers = DeliveryPerson.objects.bulk_create(
+            [DeliveryPerson(user=user, vehicle_type='bike') for user in users[client_count:]]
+        )
+
+        now = timezone.now()
+        statuses = ['delivered'] * 85 + ['cancelled'] * 5 + ['shipped'] * 5 + ['pending'] * 5
+        orders = []
+        for _ in range(order_count):
+            status = rng.choice(statuses)
+            orders.append(Order(
+                client=rng.choice(clients),
+                delivery_person=None if status == 'pending' else rng.choice(couriers),
+                status=status,
+                total_price=Decimal(rng.randint(500, 8000)) / 100,
+                created_at=now - timedelta(minutes=rng.randint(0, 365 * 24 * 60)),
+            ))
+        Order.objects.bulk_create(orders, batch_size=5000)
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        self.stdout.write(f"Създадени {order_count} поръчки, {client_count} клиенти, {courier_count} доставчици.")
+
+    def hot_queries(self):
+        """
+        Връща заявките, които изгледите изпълняват, с описание на източника.
+        """
+        today = timezone.localdate()
+        start = today - timedelta(days=30)
+        client = Client.objects.order_by('?').first()
+        courier = DeliveryPerson.objects.order_by('?').first()
+
+        queries = [
+            ('turnover_report (обобщения)', DailyTurnover.objects.filter(day__range=(start, today), status='delivered')),
+            ('доставени поръчки за период', Order.objects.filter(status='delivered', created_at__gte=timezone.now() - timedelta(days=30))),
+            ('пул от неразпределени поръчки', Order.objects.filter(status='pending', delivery_person__isnull=True).order_by('created_at')[:20]),
+        ]
+        if courier is not None:
+            queries += [
+                ('delivery_dashboard', Order.objects.filter(delivery_person=courier, status='shipped')),
+                ('earnings_report', Order.objects.filter(delivery_person=courier, status='delivered')),
+            ]
+        if client is not None:
+            queries.append(('track_orders', Order.objects.filter(client=client).order_by('-created_at')[:20]))
+        return queries
+
+    def explain_all(self):
+        analyze = connection.vendor == 'postgresql'
+        for label, queryset in self.hot_queries():
+            self.stdout.write(self.style.MIGRATE_HEADING(f"== {label}"))
+            self.stdout.write(str(queryset.query))
+            plan = queryset.explain(analyze=True) if analyze else queryset.explain()
+            self.stdout.write(plan)
+            self.stdout.write("")
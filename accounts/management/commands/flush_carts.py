@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from accounts.cart import get_cart
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Записва в CartItem кешираните колички, неактивни от settings.CART_IDLE_FLUSH_SECONDS (за CacheCart)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--idle-seconds',
+            type=int,
+            help='Минимална неактивност в секунди (по подразбиране settings.CART_IDLE_FLUSH_SECONDS)',
+        )
+
+    def handle(self, *args, **options):
+        backend = type(get_cart(User()))
+        if not hasattr(backend, 'flush_idle'):
+            self.stdout.write(f"{backend.__name__} записва директно в базата - няма какво да се записва.")
+            return
+        flushed = backend.flush_idle(options['idle_seconds'])
+        self.stdout.write(f"Записани колички: {flushed}")
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from accounts.models import Order
+from accounts.rollups import rebuild_daily_turnover
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f"Невалидна дата: {value} (очаква се ГГГГ-ММ-ДД)")
+
+
+class Command(BaseCommand):
+    help = 'Изграждане наново на дневните обобщения на оборота (DailyTurnover) за период'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=_parse_date, help='Начална дата (ГГГГ-ММ-ДД), по подразбиране най-старата поръчка')
+        parser.add_argument('--end', type=_parse_date, help='Крайна дата (ГГГГ-ММ-ДД), по подразбиране днес')
+
+    def handle(self, *args, **options):
+        end_date = options['end'] or timezone.localdate()
+        start_date = options['start']
+        if start_date is None:
+            first_order = Order.objects.aggregate(first=Min('created_at'))['first']
+            if first_order is None:
+                self.stdout.write("Няма поръчки за обобщаване")
+                return
+            start_date = timezone.localdate(first_order)
+
+        if start_date > end_date:
+            raise CommandError("Началната дата е след крайната")
+
+        created = rebuild_daily_turnover(start_date, end_date)
+        self.stdout.write(
+            f"Готово! Обобщенията от {start_date} до {end_date} са изградени наново ({created} реда)"
+        )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from accounts.ledger import REFRESH_BATCH_SIZE, refresh_courier_totals
+
+
+class Command(BaseCommand):
+    help = 'Прибавя неотчетените записи от журнала към оборота и бонусите на доставчиците'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=REFRESH_BATCH_SIZE,
+            help='Брой записи, обработвани в една транзакция',
+        )
+
+    def handle(self, *args, **options):
+        applied = refresh_courier_totals(batch_size=options['batch_size'])
+        self.stdout.write(f"Отчетени {applied} записа от журнала.")
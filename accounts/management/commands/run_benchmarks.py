@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.benchmarks import (
+    BENCHMARKS, BenchmarkError, compare_results, load_results, run_benchmarks, save_results,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Измерва основните потоци (меню, количка, плащане, разпределяне, доставка, справки) '
+        'върху генерираните от seed_load_data данни'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=20, help='Брой измервани кръгове на бенчмарк')
+        parser.add_argument('--warmup', type=int, default=1, help='Брой неизмервани кръгове преди измерването')
+        parser.add_argument(
+            '--only',
+            help=f"Бенчмаркове, разделени със запетая ({', '.join(BENCHMARKS)})",
+        )
+        parser.add_argument('--output', help='Файл, в който да се запише резултатът (JSON)')
+        parser.add_argument('--compare', help='Предишен резултат (JSON), с който да се сравни')
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=20,
+            help='Допустимо забавяне на медианата в проценти спрямо --compare',
+        )
+
+    def handle(self, *args, **options):
+        if options['rounds'] < 1:
+            raise CommandError("--rounds трябва да е поне 1")
+        names = [name.strip() for name in options['only'].split(',') if name.strip()] if options['only'] else None
+        baseline = load_results(options['compare']) if options['compare'] else None
+
+        self.stdout.write(
+            f"{'Name (time in ms)':<32}{'Min':>10}{'Max':>10}{'Mean':>10}"
+            f"{'StdDev':>10}{'Median':>10}{'Rounds':>8}{'Queries':>9}"
+        )
+
+        def log(name, stats):
+            self.stdout.write(
+                f"{name:<32}"
+                + ''.join(f"{stats[key] * 1000:>10.2f}" for key in ('min', 'max', 'mean', 'stddev', 'median'))
+                + f"{stats['rounds']:>8}{stats['queries']:>9}"
+            )
+
+        try:
+            results = run_benchmarks(names, rounds=options['rounds'], warmup=options['warmup'], log=log)
+        except BenchmarkError as error:
+            raise CommandError(str(error))
+
+        if options['output']:
+            save_results(results, options['output'])
+            self.stdout.write(f"Резултатът е записан в {options['output']}")
+
+        if baseline is not None:
+            regressions = compare_results(results, baseline, options['threshold'])
+            if regressions:
+                raise CommandError("Регресии спрямо {}:\n{}".format(options['compare'], '\n'.join(regressions)))
+            self.stdout.write(f"Няма регресии над {options['threshold']:g}% спрямо {options['compare']}")
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.dispatch import dispatch_pending_orders
+
+
+class Command(BaseCommand):
+    help = 'Автоматично разпределяне на чакащите поръчки към най-близките свободни доставчици на всеки N секунди'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=getattr(settings, 'DISPATCH_INTERVAL', 5),
+            help='Секунди между две партиди',
+        )
+        parser.add_argument('--once', action='store_true', help='Изпълнява само една партида')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            assignments = dispatch_pending_orders()
+            if assignments:
+                self.stdout.write(
+                    f"Разпределени {len(assignments)} поръчки за {(time.monotonic() - started) * 1000:.0f} ms"
+                )
+            if options['once']:
+                return
+            time.sleep(max(options['interval'] - (time.monotonic() - started), 0))
@@ -0,0 +1,109 @@
+import multiprocessing
+import signal
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections
+
+from accounts.jobs import purge_failed_jobs, run_pending_jobs, work
+from accounts.ledger import refresh_courier_totals
+
+
+def _worker_main(stop, poll_interval):
+    # При spawn (не fork) процесът започва без настроен Django
+    django.setup()
+    # Ctrl+C стига до цялата група процеси - worker-ът спира чрез stop след текущата задача
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    work(stop, poll_interval)
+
+
+def _maintenance():
+    """
+    Периодична поддръжка, изпълнявана от родителския процес: прибавя
+    неотчетените записи от журнала към сумите на доставчиците и изтрива
+    старите неуспешни задачи.
+    """
+    refresh_courier_totals()
+    purge_failed_jobs()
+
+
+class Command(BaseCommand):
+    help = 'Изпълнява фоновите задачи от опашката в базата (accounts.jobs) с N процеса'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=getattr(settings, 'JOBS_WORKER_PROCESSES', 2),
+            help='Брой worker процеси',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=getattr(settings, 'JOBS_POLL_INTERVAL', 1),
+            help='Секунди изчакване при празна опашка',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Изпълнява готовите задачи в текущия процес и излиза',
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.stdout.write(f"Изпълнени {run_pending_jobs()} задачи")
+            _maintenance()
+            return
+        if options['processes'] < 1:
+            raise CommandError("--processes трябва да е поне 1")
+
+        stop = multiprocessing.Event()
+        stopping = []
+
+        def request_stop(signum, frame):
+            # Само флаг: stop.set() от обработчика може да блокира, ако главната
+            # нишка е вътре в stop.wait() (ключалката на Event не е reentrant)
+            stopping.append(signum)
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        # Дъщерните процеси не трябва да наследяват отворени връзки към базата
+        connections.close_all()
+
+        def start():
+            process = multiprocessing.Process(
+                target=_worker_main,
+                args=(stop, options['poll_interval']),
+                daemon=True,
+            )
+            process.start()
+            return process
+
+        workers = [start() for _ in range(options['processes'])]
+        self.stdout.write(f"Стартирани {len(workers)} worker-а (Ctrl+C за спиране)")
+
+        interval = getattr(settings, 'JOBS_MAINTENANCE_INTERVAL', 60)
+        next_maintenance = time.monotonic()
+        while not stopping:
+            for index, process in enumerate(workers):
+                if not process.is_alive():
+                    self.stderr.write(f"Worker {process.pid} спря с код {process.exitcode} - рестартиране")
+                    workers[index] = start()
+            if time.monotonic() >= next_maintenance:
+                try:
+                    _maintenance()
+                except DatabaseError as error:
+                    self.stderr.write(f"Грешка при поддръжката: {error}")
+                finally:
+                    # Рестартираните worker-и не трябва да наследяват връзката на родителя
+                    connections.close_all()
+                next_maintenance = time.monotonic() + interval
+            time.sleep(1)
+
+        stop.set()
+        for process in workers:
+            process.join()
+        self.stdout.write("Worker-ите са спрени")
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.loadtest import LoadDataExists, LoadDataGenerator, clear_load_data
+
+
+class Command(BaseCommand):
+    help = 'Генерира синтетични ресторанти, продукти, клиенти, доставчици и поръчки за натоварващи тестове'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=50, help='Брой ресторанти')
+        parser.add_argument('--products-per-restaurant', type=int, default=30, help='Брой продукти на ресторант')
+        parser.add_argument('--clients', type=int, default=5000, help='Брой клиенти')
+        parser.add_argument('--couriers', type=int, default=300, help='Брой доставчици')
+        parser.add_argument('--orders', type=int, default=200000, help='Брой поръчки')
+        parser.add_argument('--years', type=float, default=3, help='Период назад в години, в който са разпределени поръчките')
+        parser.add_argument('--seed', type=int, default=42, help='Seed на генератора на случайни числа')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Брой записи в един bulk INSERT')
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Изтрива генерираните преди това данни, преди да генерира нови',
+        )
+
+    def handle(self, *args, **options):
+        for name in ('restaurants', 'products_per_restaurant', 'clients', 'couriers', 'batch_size'):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} трябва да е поне 1")
+
+        if options['clear']:
+            clear_load_data()
+            self.stdout.write("Генерираните преди това данни са изтрити")
+
+        generator = LoadDataGenerator(
+            restaurants=options['restaurants'],
+            products_per_restaurant=options['products_per_restaurant'],
+            clients=options['clients'],
+            couriers=options['couriers'],
+            orders=options['orders'],
+            years=options['years'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+        )
+        started = time.perf_counter()
+        try:
+            generator.run(log=self.stdout.write)
+        except LoadDataExists:
+            raise CommandError("В базата вече има генерирани данни - използвайте --clear")
+        self.stdout.write(f"Готово за {time.perf_counter() - started:.1f} s")
@@ -0,0 +1,211 @@
+"""
+Метрики на заявките: брой SQL заявки, време в базата, време за шаблони и обща латентност.
+
+RequestMetricsMiddleware (accounts.middleware) събира стойностите за всяка
+заявка и ги записва в REGISTRY по име на изгледа. Изгледът metrics_view
+ги връща в текстовия формат на Prometheus (хистограми и броячи).
+
+Регистърът е в паметта на процеса - всеки worker се наблюдава отделно
+(Prometheus агрегира по инстанции).
+"""
+
+import math
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.template.backends.django import DjangoTemplates, Template
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Метриките на текущата заявка (задават се от middleware-а)
+current_request_metrics = ContextVar('current_request_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    Стойностите, събрани за една заявка.
+
+    Attributes:
+        query_count (int): Брой изпълнени SQL заявки.
+        db_time (float): Общо време в базата (секунди).
+        template_time (float): Време за рендериране на шаблони (секунди).
+        queries (list): SQL текстът на заявките (до METRICS_MAX_LOGGED_QUERIES).
+    """
+
+    def __init__(self, max_logged_queries):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.queries = []
+        self.max_logged_queries = max_logged_queries
+
+    def __call__(self, execute, sql, params, many, context):
+        # Execute wrapper (connection.execute_wrapper) - работи и без DEBUG
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.query_count += 1
+            if len(self.queries) < self.max_logged_queries:
+                self.queries.append(sql)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+class Histogram:
+    """
+    Хистограма с кумулативни кофи (като prometheus_client), по набор от етикети.
+    """
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.setdefault(labels, {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['counts'][i] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self.series.items()):
+            for bound, count in zip(self.buckets, series['counts']):
+                le = '+Inf' if bound == math.inf else repr(float(bound))
+                lines.append(f'{self.name}_bucket{_labels(labels + (("le", le),))} {count}')
+            lines.append(f'{self.name}_sum{_labels(labels)} {series["sum"]}')
+            lines.append(f'{self.name}_count{_labels(labels)} {series["count"]}')
+        return lines
+
+
+class Counter:
+    """
+    Брояч по набор от етикети.
+    """
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+
+    def inc(self, labels, amount=1):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.series.items()):
+            lines.append(f'{self.name}{_labels(labels)} {value}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+class MetricsRegistry:
+    """
+    Всички метрики на процеса; record() и render() са защитени с lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter('http_requests_total', 'Брой заявки по изглед, метод и статус.')
+        self.latency = Histogram(
+            'http_request_duration_seconds', 'Обща латентност на заявката.', LATENCY_BUCKETS,
+        )
+        self.db_time = Histogram(
+            'http_request_db_duration_seconds', 'Време в базата данни за заявка.', LATENCY_BUCKETS,
+        )
+        self.template_time = Histogram(
+            'http_request_template_duration_seconds', 'Време за рендериране на шаблони за заявка.', LATENCY_BUCKETS,
+        )
+        self.queries = Histogram(
+            'http_request_db_queries', 'Брой SQL заявки за заявка.', QUERY_COUNT_BUCKETS,
+        )
+
+    def record(self, view, method, status, metrics, elapsed):
+        labels = (('view', view),)
+        with self.lock:
+            self.requests.inc(labels + (('method', method), ('status', str(status))))
+            self.latency.observe(labels, elapsed)
+            self.db_time.observe(labels, metrics.db_time)
+            self.template_time.observe(labels, metrics.template_time)
+            self.queries.observe(labels, metrics.query_count)
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for metric in (self.requests, self.latency, self.queries, self.db_time, self.template_time):
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+class InstrumentedTemplate(Template):
+    """
+    Шаблон, който добавя времето за рендериране към метриките на заявката.
+    """
+
+    def render(self, context=None, request=None):
+        metrics = current_request_metrics.get()
+        if metrics is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """
+    Стандартният DjangoTemplates backend с измерване на времето за рендериране.
+
+    Измерва се само рендерирането от най-горно ниво (render/render_to_string);
+    {% include %} и {% extends %} се включват във времето на родителския шаблон.
+    """
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return InstrumentedTemplate(template.template, self)
+
+
+def metrics_view(request):
+    """
+    Метриките в текстовия формат на Prometheus.
+
+    Ако е зададен settings.METRICS_TOKEN, изисква заглавка
+    "Authorization: Bearer <token>"; иначе е достъпен само за служители (is_staff).
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        allowed = request.headers.get('Authorization') == f'Bearer {token}'
+    else:
+        allowed = request.user.is_authenticated and request.user.is_staff
+    if not allowed:
+        return HttpResponse(status=403)
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
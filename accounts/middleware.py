@@ -0,0 +1,139 @@
+"""
+Middleware на приложението 'accounts'.
+"""
+
+import logging
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from .metrics import REGISTRY, RequestMetrics, current_request_metrics
+from .routers import STICKY_COOKIE, replica_alias, request_routing
+
+
+logger = logging.getLogger('accounts.metrics')
+
+
+class RequestMetricsMiddleware:
+    """
+    Измерва броя SQL заявки, времето в базата, времето за шаблони и общата
+    латентност на всяка заявка.
+
+    Стойностите се записват в accounts.metrics.REGISTRY по име на изгледа и
+    (при settings.METRICS_SERVER_TIMING) се връщат в заглавка Server-Timing.
+    Заявките с повече от settings.METRICS_QUERY_LOG_THRESHOLD SQL заявки се
+    логват заедно с SQL текста в логера 'accounts.metrics' - така се откриват
+    N+1 изгледите. Трябва да е първият middleware, за да измерва цялата заявка.
+
+    При асинхронни изгледи SQL заявките се изпълняват в друга нишка и не се
+    отчитат; записват се само латентността и времето за шаблони.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'METRICS_QUERY_LOG_THRESHOLD', 50)
+        self.server_timing = getattr(settings, 'METRICS_SERVER_TIMING', True)
+        self.max_logged_queries = getattr(settings, 'METRICS_MAX_LOGGED_QUERIES', 500)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        metrics = RequestMetrics(self.max_logged_queries)
+        token = current_request_metrics.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            current_request_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics(self.max_logged_queries)
+        token = current_request_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        elapsed = metrics.elapsed
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        REGISTRY.record(view, request.method, response.status_code, metrics, elapsed)
+
+        if self.server_timing:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.query_count} queries"',
+                f'tpl;dur={metrics.template_time * 1000:.1f}',
+                f'total;dur={elapsed * 1000:.1f}',
+            ])
+
+        if self.threshold and metrics.query_count > self.threshold:
+            logger.warning(
+                "%s %s (%s): %d SQL заявки за %.1f ms\n%s",
+                request.method, request.path, view, metrics.query_count,
+                metrics.db_time * 1000, '\n'.join(metrics.queries),
+            )
+        return response
+
+
+class ReplicaRouterMiddleware:
+    """
+    Задава състоянието на accounts.routers.ReplicaRouter за всяка заявка.
+
+    Ако заявката е писала в базата, поставя бисквитка STICKY_COOKIE със срок
+    settings.REPLICA_STICKY_SECONDS; докато тя е валидна, четенията на
+    браузъра остават на основната база (read-your-writes), дори в изгледите
+    с @replica_reads. Без конфигурирана реплика бисквитка не се поставя.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with request_routing(pinned=self.is_pinned(request)) as state:
+            response = self.get_response(request)
+        return self.finish(state, response)
+
+    async def __acall__(self, request):
+        with request_routing(pinned=self.is_pinned(request)) as state:
+            response = await self.get_response(request)
+        return self.finish(state, response)
+
+    def is_pinned(self, request):
+        try:
+            return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def finish(self, state, response):
+        if state.wrote and self.sticky_seconds and replica_alias():
+            response.set_cookie(
+                STICKY_COOKIE,
+                f'{time.time() + self.sticky_seconds:.3f}',
+                max_age=self.sticky_seconds,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
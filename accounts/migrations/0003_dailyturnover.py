@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-18 15:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_bonussettings_deliveryperson_total_bonuses'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTurnover',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('status', models.CharField(choices=[('pending', 'В процес'), ('shipped', 'Изпратена'), ('delivered', 'Доставена'), ('cancelled', 'Отказана')], max_length=20)),
+                ('order_count', models.IntegerField(default=0)),
+                ('total_price', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('delivery_person', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_turnover', to='accounts.deliveryperson')),
+                ('restaurant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_turnover', to='accounts.restaurant')),
+            ],
+            options={
+                'verbose_name': 'Дневен оборот',
+                'verbose_name_plural': 'Дневен оборот',
+                'constraints': [models.UniqueConstraint(fields=('day', 'delivery_person', 'restaurant', 'status'), name='unique_daily_turnover_bucket', nulls_distinct=False)],
+            },
+        ),
+    ]
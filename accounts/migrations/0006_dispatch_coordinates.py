@@ -0,0 +1,48 @@
+# Generated by Django 5.2 on 2026-10-18 15:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_order_history_keyset'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryperson',
+            name='is_available',
+            field=models.BooleanField(default=False, verbose_name='На линия'),
+        ),
+        migrations.AddField(
+            model_name='deliveryperson',
+            name='latitude',
+            field=models.FloatField(blank=True, help_text='Текуща географска ширина', null=True),
+        ),
+        migrations.AddField(
+            model_name='deliveryperson',
+            name='longitude',
+            field=models.FloatField(blank=True, help_text='Текуща географска дължина', null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
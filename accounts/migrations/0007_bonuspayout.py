@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18 15:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_dispatch_coordinates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BonusPayout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField()),
+                ('period_end', models.DateField()),
+                ('turnover', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('delivery_person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bonus_payouts', to='accounts.deliveryperson')),
+            ],
+            options={
+                'verbose_name': 'Изплатен бонус',
+                'verbose_name_plural': 'Изплатени бонуси',
+                'constraints': [models.UniqueConstraint(fields=('delivery_person', 'period_start', 'period_end'), name='unique_bonus_payout_per_period')],
+            },
+        ),
+    ]
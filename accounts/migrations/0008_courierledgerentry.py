@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18 15:35
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_bonuspayout'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourierLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('turnover', 'Оборот'), ('bonus', 'Бонус')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('applied', models.BooleanField(default=False)),
+                ('delivery_person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='accounts.deliveryperson')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='accounts.order')),
+            ],
+            options={
+                'verbose_name': 'Запис в журнала на доставчик',
+                'verbose_name_plural': 'Журнал на доставчиците',
+                'indexes': [models.Index(condition=models.Q(('applied', False)), fields=['delivery_person'], name='ledger_unapplied_idx')],
+            },
+        ),
+    ]
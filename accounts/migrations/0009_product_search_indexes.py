@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+# Изразите трябва да съвпадат с тези в accounts.search._POSTGRES_SEARCH_SQL
+SEARCH_INDEXES = [
+    ('product_search_vector_idx', 'accounts_product',
+     "gin (to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, '')))"),
+    ('product_name_trgm_idx', 'accounts_product', 'gin (name gin_trgm_ops)'),
+    ('product_description_trgm_idx', 'accounts_product', 'gin (description gin_trgm_ops)'),
+    ('restaurant_search_vector_idx', 'accounts_restaurant', "gin (to_tsvector('simple', name))"),
+    ('restaurant_name_trgm_idx', 'accounts_restaurant', 'gin (name gin_trgm_ops)'),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    # Индексите са специфични за PostgreSQL; другите бази използват индекса в паметта
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, definition in SEARCH_INDEXES:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING {definition}')
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_courierledgerentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
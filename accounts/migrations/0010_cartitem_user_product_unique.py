@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-18 15:55
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    # Повтарящите се редове (user, product) се сливат в най-стария със сумарно количество
+    CartItem = apps.get_model('accounts', 'CartItem')
+    duplicates = (
+        CartItem.objects.values('user_id', 'product_id')
+        .annotate(rows=Count('id'), first_id=Min('id'), total=Sum('quantity'))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    for row in duplicates.iterator():
+        CartItem.objects.filter(pk=row['first_id']).update(quantity=row['total'])
+        CartItem.objects.filter(user_id=row['user_id'], product_id=row['product_id']).exclude(
+            pk=row['first_id'],
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_product_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='cartitem_user_product_uniq'),
+        ),
+    ]
@@ -1,7 +1,7 @@
 from decimal import Decimal
 
-from django.core.mail import send_mail
 from django.db import models, transaction
+from django.db.models import DEFERRED
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 
@@ -57,11 +57,18 @@ class DeliveryPerson(models.Model):
     """
     Модел за доставчик.
 
-    Съдържа тип на превозното средство.
+    Съдържа тип на превозното средство и текущото местоположение,
+    използвано при автоматичното разпределяне на поръчки.
 
     Attributes:
         user (User): Свързаният потребител.
         vehicle_type (str): Типът на превозното средство.
+        is_available (bool): Дали доставчикът приема поръчки в момента.
+        latitude (float): Текуща географска ширина (по избор).
+        longitude (float): Текуща географска дължина (по избор).
+
+    total_turnover и total_bonuses са кеширани суми от журнала CourierLedgerEntry;
+    точните текущи стойности връща accounts.ledger.courier_totals().
     """
     user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
     vehicle_type = models.CharField(max_length=50)
@@ -77,6 +84,9 @@ class DeliveryPerson(models.Model):
         default=0,
         verbose_name="Общо получени бонуси"
     )
+    is_available = models.BooleanField(default=False, verbose_name="На линия")
+    latitude = models.FloatField(null=True, blank=True, help_text="Текуща географска ширина")
+    longitude = models.FloatField(null=True, blank=True, help_text="Текуща географска дължина")
 
 
     def __str__(self):
@@ -105,9 +115,13 @@ class Restaurant(models.Model):
     Attributes:
         name (str): Името на ресторанта.
         address (str): Адресът на ресторанта.
+        latitude (float): Географска ширина на адреса (по избор).
+        longitude (float): Географска дължина на адреса (по избор).
     """
     name = models.CharField(max_length=255)
     address = models.CharField(max_length=255)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -144,7 +158,82 @@ class Product(models.Model):
         return f"{self.name} ({self.restaurant.name})"
 
 
-class Order(models.Model):
+class TrackedFieldsMixin:
+    """
+    Mixin за проследяване на промени в полета на модел без повторно четене от базата.
+
+    При създаване на инстанцията (включително при зареждане от базата) се
+    запомнят стойностите на полетата от `tracked_fields`. След успешен запис
+    моментната снимка се обновява.
+
+    Attributes:
+        tracked_fields (tuple): Имена на полетата, които се проследяват.
+
+    Методи:
+        has_changed(field): Дали полето е променено спрямо заредената стойност.
+        previous(field): Заредената (последно записаната) стойност на полето.
+    """
+    tracked_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tracked_initial = {}
+        self._reset_tracking()
+
+    def _tracked_attname(self, field):
+        return self._meta.get_field(field).attname
+
+    def _reset_tracking(self, fields=None):
+        """
+        Обновява моментната снимка за дадените полета (по подразбиране - всички).
+
+        Отложените (deferred) полета се четат директно от __dict__, за да не
+        се предизвиква допълнителна заявка.
+        """
+        for field in fields if fields is not None else self.tracked_fields:
+            if field in self.tracked_fields:
+                attname = self._tracked_attname(field)
+                self._tracked_initial[field] = self.__dict__.get(attname, DEFERRED)
+
+    def has_changed(self, field):
+        """
+        Проверява дали стойността на полето е различна от заредената.
+
+        Args:
+            field (str): Име на проследявано поле.
+
+        Returns:
+            bool: True, ако полето е променено.
+        """
+        attname = self._tracked_attname(field)
+        initial = self._tracked_initial[field]
+        if initial is DEFERRED:
+            # Полето не е било заредено - променено е само ако е зададено ръчно
+            return attname in self.__dict__
+        return self.__dict__.get(attname, DEFERRED) != initial
+
+    def previous(self, field):
+        """
+        Връща заредената (последно записаната) стойност на полето.
+
+        Args:
+            field (str): Име на проследявано поле.
+
+        Returns:
+            Стойността при зареждане или None, ако полето е било отложено.
+        """
+        initial = self._tracked_initial[field]
+        return None if initial is DEFERRED else initial
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        if fields is None:
+            self._reset_tracking()
+        else:
+            self._reset_tracking([f for f in self.tracked_fields if self._tracked_attname(f) in fields or f in fields])
+
+
+class Order(TrackedFieldsMixin, models.Model):
     """
     Полета:
         client (ForeignKey): Свързана клиентска поръчка.
@@ -155,9 +244,11 @@ class Order(models.Model):
         delivery_person (ForeignKey): Доставчик, който се свързва с поръчката.
         address (CharField): Адрес за доставка.
         phone_number (CharField): Телефонен номер на клиента.
+        latitude / longitude (FloatField): Координати на адреса за доставка (по избор).
 
     Методи:
         save: Записва поръчката в базата данни и при необходимост обработва бонусите за доставчика.
+        has_changed / previous: Проследяване на промени в статуса и доставчика (TrackedFieldsMixin).
         _check_and_apply_bonus: Приложение на бонуси към доставчика при изпълнение на условията.
     """
     
@@ -182,59 +273,151 @@ class Order(models.Model):
     )
     address = models.CharField(max_length=255, blank=True, null=True)  # Поле за адрес
     phone_number = models.CharField(max_length=20, blank=True, null=True)  # Поле за телефонен номер
+    latitude = models.FloatField(null=True, blank=True)  # Геокодиран адрес за доставка
+    longitude = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Справки за оборот: status='delivered' AND created_at в период
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+            # Табло и справки на доставчика: delivery_person=X AND status=Y
+            models.Index(fields=['delivery_person', 'status'], name='order_courier_status_idx'),
+            # История на поръчките на клиента, най-новите първи (keyset пагинация)
+            models.Index(fields=['client', '-created_at', '-id'], name='order_client_created_idx'),
+            # Пул от неразпределени чакащи поръчки за доставчиците
+            models.Index(
+                fields=['created_at'],
+                name='order_unassigned_pending_idx',
+                condition=models.Q(status='pending', delivery_person__isnull=True),
+            ),
+        ]
+
+    tracked_fields = ('status', 'delivery_person', 'total_price')
 
     def save(self, *args, **kwargs):
         """
         Записва поръчката и при промяна на статуса на 'delivered' проверява и прилага бонуси за доставчика.
 
-        Ако поръчката е нова или статусът е променен на 'delivered', методът проверява дали доставчикът 
-        има право на бонуси на база стойността на поръчката и общия му оборот.
+        Предишният статус се взима от паметта (TrackedFieldsMixin), без допълнителна
+        заявка към базата. Преходът към 'delivered' на вече съществуваща поръчка се
+        "заявява" с условен UPDATE ... WHERE status <> 'delivered', така че при
+        паралелни записи бонусът се начислява само веднъж.
+
+        При влизане в (или излизане от) статус 'delivered' в същата транзакция се
+        добавят фонови задачи (accounts.jobs) за дневните обобщения DailyTurnover
+        и журнала на доставчика. Смяната на доставчика или сумата на доставена
+        поръчка я прехвърля в обобщенията и журнала (записаните стойности се
+        четат със SELECT ... FOR UPDATE). Всяка промяна на статуса на съществуваща
+        поръчка се изпраща в реално време на клиента и доставчика и по имейл на клиента.
 
         Аргументи:
             *args: Допълнителни аргументи за метода.
             **kwargs: Допълнителни ключови аргументи за метода.
         """
         is_new = self._state.adding
-
-        # Ако поръчката вече съществува, взимаме стария статус
-        if not is_new:
-            old_order = Order.objects.get(pk=self.pk)
-            old_status = old_order.status
-        else:
-            old_status = None
-
-        # Първо записваме без да тригерираме бонус логиката
-        super().save(*args, **kwargs)
-
-        # Проверка за бонус (само при промяна на статус на 'delivered')
-        if (is_new or old_status != 'delivered') and self.status == 'delivered':
-            if not hasattr(self, '_bonus_processed'):  # Критична проверка!
-                with transaction.atomic():
-                    delivery_person = DeliveryPerson.objects.select_for_update().get(pk=self.delivery_person_id)
-                    self._check_and_apply_bonus(delivery_person)  # Подаваме delivery_person
-                    self._bonus_processed = True
-
-    def _check_and_apply_bonus(self, delivery_person):
+        status_changed = is_new or self.has_changed('status')
+        enters_delivered = status_changed and self.status == 'delivered'
+        leaves_delivered = not is_new and status_changed and self.previous('status') == 'delivered'
+        delivered_changed = (
+            not is_new
+            and not status_changed
+            and self.status == 'delivered'
+            and (self.has_changed('delivery_person') or self.has_changed('total_price'))
+        )
+
+        previous_status = self.previous('status')
+        previous_delivery_person_id = self.previous('delivery_person')
+        previous_total_price = self.previous('total_price')
+
+        if not (enters_delivered or leaves_delivered or delivered_changed):
+            super().save(*args, **kwargs)
+            self._reset_tracking(kwargs.get('update_fields'))
+            if status_changed and not is_new:
+                self._publish_status_change(previous_status, previous_delivery_person_id)
+            return
+
+        with transaction.atomic():
+            if is_new:
+                claimed = True
+            elif delivered_changed:
+                # От обобщенията се изважда записаното в базата, а не стойностите в паметта
+                stored = (
+                    Order.objects.select_for_update()
+                    .filter(pk=self.pk, status='delivered')
+                    .values('delivery_person_id', 'total_price')
+                    .first()
+                )
+                claimed = stored is not None
+                if claimed:
+                    previous_delivery_person_id = stored['delivery_person_id']
+                    previous_total_price = stored['total_price']
+            else:
+                # Само един от паралелните записи успява да смени статуса
+                queryset = Order.objects.filter(pk=self.pk)
+                if enters_delivered:
+                    queryset = queryset.exclude(status='delivered')
+                else:
+                    queryset = queryset.filter(status='delivered')
+                claimed = queryset.update(status=self.status) == 1
+
+            super().save(*args, **kwargs)
+            self._reset_tracking(kwargs.get('update_fields'))
+
+            if not claimed:
+                return
+
+            if status_changed and not is_new:
+                self._publish_status_change(previous_status, previous_delivery_person_id)
+
+            from .jobs import enqueue
+            from .rollups import rollup_changes
+
+            changes = []
+            adjustments = []
+            if leaves_delivered or delivered_changed:
+                if previous_total_price is None:
+                    previous_total_price = self.total_price
+                changes += rollup_changes(self, 'delivered', previous_delivery_person_id, previous_total_price, -1)
+                adjustments.append((previous_delivery_person_id, str(-Decimal(previous_total_price))))
+            if not leaves_delivered:
+                changes += rollup_changes(self, self.status, self.delivery_person_id, self.total_price, 1)
+            if delivered_changed:
+                # Само оборотът се прехвърля; бонусите остават при вече кредитирания доставчик
+                adjustments.append((self.delivery_person_id, str(Decimal(self.total_price))))
+
+            enqueue('rollup.apply', changes=changes)
+            if any(delivery_person_id for delivery_person_id, _ in adjustments):
+                enqueue('ledger.adjust_turnover', order_id=self.pk, adjustments=adjustments)
+            if enters_delivered and self.delivery_person_id:
+                self._check_and_apply_bonus()
+
+    def _publish_status_change(self, previous_status, previous_delivery_person_id):
+        """
+        Известява клиента и доставчика за новия статус след commit (accounts.events)
+        и добавя задача за имейл известие до клиента.
         """
-        Проверява дали доставчикът има право на бонус и го прилага, ако е необходимо.
+        from .events import publish_order_status_on_commit
+        from .jobs import enqueue
 
-        Прилага бонус, ако доставчикът е достигнал минималния оборот, 
-        зададен в настройките на бонусите.
+        publish_order_status_on_commit(self, previous_status, previous_delivery_person_id)
+        enqueue('orders.notify_status', order_id=self.pk, status=self.status)
 
-        Аргументи:
-            delivery_person (DeliveryPerson): Доставчикът, за когото ще се провери и приложи бонус.
+    def _check_and_apply_bonus(self):
         """
-        bonus_settings = BonusSettings.objects.filter(is_active=True).first()
-
-        # Добавяме САМО стойността на поръчката (без бонуса)
-        delivery_person.total_turnover += Decimal(str(self.total_price))
+        Добавя задача за запис на оборота и, ако е необходимо, бонус в журнала на доставчика.
 
-        # Проверка за бонус
-        if bonus_settings and delivery_person.total_turnover >= bonus_settings.min_turnover:
-            delivery_person.total_turnover += bonus_settings.bonus_amount
-            delivery_person.total_bonuses += bonus_settings.bonus_amount
+        Бонус се записва, ако доставчикът е достигнал минималния оборот,
+        зададен в настройките на бонусите. Редът на доставчика се заключва от
+        задачата, а не тук (вижте accounts.ledger.credit_delivery).
+        """
+        from .jobs import enqueue
 
-        delivery_person.save(update_fields=['total_turnover', 'total_bonuses'])
+        enqueue(
+            'ledger.credit_delivery',
+            order_id=self.pk,
+            delivery_person_id=self.delivery_person_id,
+            total_price=str(Decimal(self.total_price)),
+        )
 
     def __str__(self):
         """
@@ -259,7 +442,7 @@ class OrderItem(models.Model):
         quantity (int): Брой на продукта.
         price (Decimal): Цена на продукта за дадената поръчка.
     """
-    order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -329,6 +512,12 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            # Един ред на продукт в количката; добавянето е upsert (services.add_product_to_cart)
+            models.UniqueConstraint(fields=['user', 'product'], name='cartitem_user_product_uniq'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name} (Потребител: {self.user.username})"
 
@@ -373,3 +562,208 @@ class BonusSettings(models.Model):
             str: Текстовото представяне, включващо сумата на бонуса и минималния оборот.
         """
         return f"Бонус: {self.bonus_amount} лв. при оборот ≥ {self.min_turnover} лв."
+
+
+
+class DailyTurnover(models.Model):
+    """
+    Предварително агрегиран дневен оборот за справките.
+
+    Всеки ред обобщава поръчките за един ден (по датата на създаване), доставчик,
+    ресторант и статус. Стойността на поръчката се разпределя по ресторанти според
+    цените на артикулите; остатъкът без ресторант (напр. поръчка без артикули)
+    се записва с restaurant=None. Всяка поръчка се отчита в order_count точно веднъж -
+    в реда на ресторанта с най-малък id, така че сумата на order_count по ден или
+    доставчик е броят на поръчките.
+
+    Таблицата се поддържа инкрементално от Order.save() и може да бъде изградена
+    наново с командата `manage.py rebuild_turnover_rollup`.
+
+    Attributes:
+        day (date): Ден на създаване на поръчките.
+        delivery_person (DeliveryPerson): Доставчик (по избор).
+        restaurant (Restaurant): Ресторант (по избор).
+        status (str): Статус на поръчките.
+        order_count (int): Брой поръчки.
+        total_price (Decimal): Оборот.
+    """
+    day = models.DateField(db_index=True)
+    delivery_person = models.ForeignKey(
+        DeliveryPerson,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='daily_turnover'
+    )
+    restaurant = models.ForeignKey(
+        Restaurant,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='daily_turnover'
+    )
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    order_count = models.IntegerField(default=0)
+    total_price = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "Дневен оборот"
+        verbose_name_plural = "Дневен оборот"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'delivery_person', 'restaurant', 'status'],
+                name='unique_daily_turnover_bucket',
+                nulls_distinct=False,
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day}: {self.total_price} лв. ({self.order_count} поръчки)"
+
+
+
+class BonusPayout(models.Model):
+    """
+    Запис за изплатен периодичен бонус на доставчик (командата calculate_bonuses).
+
+    Уникалността по (доставчик, период) гарантира, че повторно изпълнение на
+    командата за същия период няма да изплати бонуса втори път.
+
+    Attributes:
+        delivery_person (DeliveryPerson): Доставчикът, получил бонуса.
+        period_start (date): Начало на периода (включително).
+        period_end (date): Край на периода (включително).
+        turnover (Decimal): Оборотът на доставчика за периода.
+        amount (Decimal): Изплатената сума.
+        created_at (datetime): Кога е начислен бонусът.
+    """
+    delivery_person = models.ForeignKey(
+        DeliveryPerson,
+        on_delete=models.CASCADE,
+        related_name='bonus_payouts'
+    )
+    period_start = models.DateField()
+    period_end = models.DateField()
+    turnover = models.DecimalField(max_digits=14, decimal_places=2)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Изплатен бонус"
+        verbose_name_plural = "Изплатени бонуси"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['delivery_person', 'period_start', 'period_end'],
+                name='unique_bonus_payout_per_period',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.amount} лв. за {self.period_start} - {self.period_end}"
+
+
+
+class CourierLedgerEntry(models.Model):
+    """
+    Запис в журнала на оборота и бонусите на доставчик (само добавяне).
+
+    Всяко движение (оборот от доставена поръчка, бонус, корекция при отказ)
+    е отделен ред - записите никога не се променят по сума и не се трият.
+    Полетата DeliveryPerson.total_turnover и total_bonuses са кеширана
+    материализация: към тях периодично се прибавят още неотчетените
+    (applied=False) записи, вижте accounts.ledger.refresh_courier_totals.
+
+    Attributes:
+        delivery_person (DeliveryPerson): Доставчикът.
+        kind (str): Вид на движението ('turnover' или 'bonus').
+        amount (Decimal): Сума (отрицателна при корекция).
+        order (Order): Поръчката, довела до движението (по избор).
+        created_at (datetime): Време на записа.
+        applied (bool): Дали сумата вече е отразена в кешираните суми на доставчика.
+    """
+    KIND_CHOICES = [
+        ('turnover', 'Оборот'),
+        ('bonus', 'Бонус'),
+    ]
+
+    delivery_person = models.ForeignKey(
+        DeliveryPerson,
+        on_delete=models.CASCADE,
+        related_name='ledger_entries'
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='ledger_entries'
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    applied = models.BooleanField(default=False)
+
+    class Meta:
+        verbose_name = "Запис в журнала на доставчик"
+        verbose_name_plural = "Журнал на доставчиците"
+        indexes = [
+            # Само неотчетените записи - малък индекс за материализацията
+            models.Index(
+                fields=['delivery_person'],
+                name='ledger_unapplied_idx',
+                condition=models.Q(applied=False),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.amount} лв. ({self.delivery_person_id})"
+
+
+
+class Job(models.Model):
+    """
+    Фонова задача в опашката в базата данни (вижте accounts.jobs).
+
+    Задачите се добавят в транзакцията на промяната, която ги поражда, и се
+    изпълняват от manage.py run_workers. Успешно изпълнените се изтриват;
+    неуспешните се опитват отново с нарастващо забавяне, а след max_attempts
+    опита остават със статус 'failed' за проверка.
+
+    Attributes:
+        name (str): Името, с което задачата е регистрирана (@job).
+        payload (dict): Ключовите аргументи на задачата (JSON).
+        status (str): 'queued' (чака изпълнение) или 'failed' (изчерпани опити).
+        attempts (int): Брой неуспешни опити досега.
+        max_attempts (int): Максимален брой опити.
+        run_at (datetime): Кога задачата може да бъде изпълнена (най-рано).
+        last_error (str): Грешката от последния неуспешен опит.
+        created_at (datetime): Кога е добавена задачата.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'В опашката'),
+        ('failed', 'Неуспешна'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Фонова задача"
+        verbose_name_plural = "Фонови задачи"
+        indexes = [
+            # Само чакащите задачи, в реда, в който worker-ите ги взимат
+            models.Index(
+                fields=['run_at', 'id'],
+                name='job_queued_run_at_idx',
+                condition=models.Q(status='queued'),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.get_status_display()})"
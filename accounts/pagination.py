@@ -0,0 +1,134 @@
+"""
+Keyset (cursor) пагинация за дълги списъци.
+
+За разлика от OFFSET пагинацията, тук всяка следваща страница се взима с
+условие "след последния показан запис" по уникална подредба (напр.
+(-created_at, -id)). Така цената на страницата не зависи от това колко
+навътре в историята е стигнал потребителят, а курсорът остава стабилен,
+дори ако междувременно се добавят нови записи.
+"""
+
+import base64
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """
+    Изключение при невалиден или повреден курсор.
+    """
+
+
+class KeysetPage:
+    """
+    Една страница от keyset пагинацията.
+
+    Attributes:
+        object_list (list): Записите в страницата.
+        next_cursor (str | None): Курсор за следващата страница или None, ако няма такава.
+    """
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _serialize(value):
+    # isoformat() запазва микросекундите (DjangoJSONEncoder ги закръглява)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (int, float, str)) or value is None:
+        return value
+    return str(value)
+
+
+def encode_cursor(values):
+    """
+    Кодира стойностите на ключа за подредба в URL-безопасен низ.
+    """
+    raw = json.dumps([_serialize(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, model, ordering):
+    """
+    Декодира курсор и преобразува стойностите към типовете на полетата.
+
+    Raises:
+        InvalidCursor: Ако курсорът не може да бъде декодиран.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise InvalidCursor(token)
+        return [
+            model._meta.get_field(field.lstrip('-')).to_python(value)
+            for field, value in zip(ordering, values)
+        ]
+    except (ValueError, TypeError, ValidationError) as exc:
+        raise InvalidCursor(token) from exc
+
+
+def _after(ordering, values):
+    """
+    Строи условие "след (values)" за лексикографска подредба по ordering.
+    """
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        step = Q(**{f'{name}__{lookup}': values[i]})
+        for prev_field, prev_value in zip(ordering[:i], values[:i]):
+            step &= Q(**{prev_field.lstrip('-'): prev_value})
+        condition |= step
+    return condition
+
+
+def keyset_paginate(queryset, cursor=None, page_size=20, ordering=('-created_at', '-id')):
+    """
+    Връща една страница от queryset по зададената уникална подредба.
+
+    Взима се един запис повече от размера на страницата, за да се разбере
+    дали има следваща страница, без отделна COUNT заявка.
+
+    Args:
+        queryset (QuerySet): Базовата заявка (филтри, select_related/prefetch_related
+            или values() с полетата от ordering).
+        cursor (str | None): Курсор от предишна страница; None за първата страница.
+        page_size (int): Брой записи на страница.
+        ordering (tuple): Уникална подредба; последното поле трябва да е уникално (напр. id).
+
+    Returns:
+        KeysetPage: Страницата и курсор за следващата.
+
+    Raises:
+        InvalidCursor: Ако курсорът е невалиден.
+    """
+    ordering = tuple(ordering)
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(_after(ordering, decode_cursor(cursor, queryset.model, ordering)))
+
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        # values() връща речници, а обикновеният queryset - модели
+        value = last.__getitem__ if isinstance(last, dict) else lambda name: getattr(last, name)
+        next_cursor = encode_cursor([value(field.lstrip('-')) for field in ordering])
+    return KeysetPage(rows, next_cursor)
@@ -0,0 +1,239 @@
+"""
+Поддръжка и четене на дневните обобщения на оборота (DailyTurnover).
+
+Справките за оборот използват тези функции вместо агрегиране на суровите
+Order записи, така че времето за отговор зависи от броя дни в периода,
+а не от броя поръчки.
+"""
+
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import DailyTurnover, Order, OrderItem
+
+
+# Статуси, за които се поддържат обобщения
+ROLLUP_STATUSES = ('delivered',)
+
+
+def _order_day(order):
+    return timezone.localdate(order.created_at)
+
+
+def day_bounds(day):
+    """
+    Връща началото на деня и началото на следващия ден като aware datetime.
+    """
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _order_buckets(total_price, restaurant_totals):
+    """
+    Разпределя стойността на поръчка по ресторанти.
+
+    Args:
+        total_price (Decimal): Общата цена на поръчката.
+        restaurant_totals (list): Двойки (restaurant_id, сума на артикулите).
+
+    Returns:
+        list: Тройки (restaurant_id, сума, брой поръчки). Поръчката се отчита
+        веднъж - при ресторанта с най-малък id (или при None, ако няма артикули).
+    """
+    buckets = {}
+    remainder = Decimal(total_price)
+    for restaurant_id, amount in sorted(restaurant_totals, key=lambda row: row[0]):
+        buckets[restaurant_id] = amount
+        remainder -= amount
+    if remainder or not buckets:
+        buckets[None] = buckets.get(None, Decimal('0')) + remainder
+
+    counted = next(iter(buckets))
+    return [
+        (restaurant_id, amount, 1 if restaurant_id == counted else 0)
+        for restaurant_id, amount in buckets.items()
+    ]
+
+
+def _restaurant_totals(order):
+    return list(
+        OrderItem.objects.filter(order=order)
+        .values_list('product__restaurant_id')
+        .annotate(total=Sum('price'))
+        .order_by()
+    )
+
+
+def _increment(day, delivery_person_id, restaurant_id, status, amount, count):
+    """
+    Добавя сума и брой поръчки към реда на дадения ден (създава го при нужда).
+    """
+    lookup = {
+        'day': day,
+        'delivery_person_id': delivery_person_id,
+        'restaurant_id': restaurant_id,
+        'status': status,
+    }
+    changes = {
+        'total_price': F('total_price') + amount,
+        'order_count': F('order_count') + count,
+    }
+    if DailyTurnover.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            DailyTurnover.objects.create(total_price=amount, order_count=count, **lookup)
+    except IntegrityError:
+        # Редът е създаден паралелно от друга транзакция
+        DailyTurnover.objects.filter(**lookup).update(**changes)
+
+
+def rollup_changes(order, status, delivery_person_id, total_price, sign):
+    """
+    Изчислява промените в дневните обобщения от добавяне (sign=1) или
+    изваждане (sign=-1) на поръчка със зададените статус, доставчик и сума.
+
+    Промените са моментна снимка във вид за JSON (за фонова задача), така че
+    прилагането им не зависи от по-късни промени или изтриване на поръчката.
+
+    Args:
+        order (Order): Поръчката (използват се id и created_at).
+        status (str): Статусът, под който се отчита поръчката.
+        delivery_person_id (int | None): Доставчикът, под който се отчита.
+        total_price (Decimal): Сумата, която се отчита.
+        sign (int): 1 за добавяне, -1 за изваждане.
+
+    Returns:
+        list: Речници (day, delivery_person_id, restaurant_id, status, amount, count);
+        празен, ако статусът не е в ROLLUP_STATUSES.
+    """
+    if status not in ROLLUP_STATUSES:
+        return []
+    day = _order_day(order).isoformat()
+    return [
+        {
+            'day': day,
+            'delivery_person_id': delivery_person_id,
+            'restaurant_id': restaurant_id,
+            'status': status,
+            'amount': str(sign * amount),
+            'count': sign * count,
+        }
+        for restaurant_id, amount, count in _order_buckets(total_price, _restaurant_totals(order))
+    ]
+
+
+def apply_rollup_changes(changes):
+    """
+    Прилага промените, изчислени с rollup_changes().
+    """
+    for change in changes:
+        _increment(
+            date.fromisoformat(change['day']),
+            change['delivery_person_id'],
+            change['restaurant_id'],
+            change['status'],
+            Decimal(change['amount']),
+            change['count'],
+        )
+
+
+def rebuild_daily_turnover(start_date, end_date):
+    """
+    Изгражда наново обобщенията за периода от суровите поръчки.
+
+    Всеки ден се обработва в отделна транзакция с фиксиран брой заявки,
+    така че паметта не зависи от дължината на периода.
+
+    Args:
+        start_date (date): Начална дата (включително).
+        end_date (date): Крайна дата (включително).
+
+    Returns:
+        int: Брой създадени редове.
+    """
+    created = 0
+    day = start_date
+    while day <= end_date:
+        start, end = day_bounds(day)
+        with transaction.atomic():
+            DailyTurnover.objects.filter(day=day).delete()
+
+            orders = Order.objects.filter(
+                status__in=ROLLUP_STATUSES,
+                created_at__gte=start,
+                created_at__lt=end,
+            )
+            restaurant_totals = defaultdict(list)
+            for order_id, restaurant_id, total in (
+                OrderItem.objects.filter(order__in=orders)
+                .values_list('order_id', 'product__restaurant_id')
+                .annotate(total=Sum('price'))
+                .order_by()
+            ):
+                restaurant_totals[order_id].append((restaurant_id, total))
+
+            rows = defaultdict(lambda: [Decimal('0'), 0])
+            for order_id, delivery_person_id, status, total_price in orders.values_list(
+                'id', 'delivery_person_id', 'status', 'total_price'
+            ).iterator():
+                for restaurant_id, amount, count in _order_buckets(total_price, restaurant_totals[order_id]):
+                    row = rows[(delivery_person_id, restaurant_id, status)]
+                    row[0] += amount
+                    row[1] += count
+
+            DailyTurnover.objects.bulk_create([
+                DailyTurnover(
+                    day=day,
+                    delivery_person_id=delivery_person_id,
+                    restaurant_id=restaurant_id,
+                    status=status,
+                    total_price=total_price,
+                    order_count=order_count,
+                )
+                for (delivery_person_id, restaurant_id, status), (total_price, order_count) in rows.items()
+            ])
+            created += len(rows)
+        day += timedelta(days=1)
+    return created
+
+
+def turnover_rows(start_date, end_date, status='delivered', **filters):
+    """
+    Връща редовете от обобщенията за периода (включително двете дати).
+    """
+    return DailyTurnover.objects.filter(day__range=(start_date, end_date), status=status, **filters)
+
+
+def turnover_totals(start_date, end_date, status='delivered', **filters):
+    """
+    Връща общия оборот и броя поръчки за периода.
+
+    Returns:
+        dict: {'total': Decimal, 'order_count': int}
+    """
+    totals = turnover_rows(start_date, end_date, status, **filters).aggregate(
+        total=Sum('total_price'),
+        order_count=Sum('order_count'),
+    )
+    return {
+        'total': totals['total'] or Decimal('0'),
+        'order_count': totals['order_count'] or 0,
+    }
+
+
+def turnover_by_day(start_date, end_date, status='delivered', **filters):
+    """
+    Връща оборота и броя поръчки по дни за периода, подредени по дата.
+    """
+    return (
+        turnover_rows(start_date, end_date, status, **filters)
+        .values('day')
+        .annotate(total=Sum('total_price'), order_count=Sum('order_count'))
+        .order_by('day')
+    )
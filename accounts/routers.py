@@ -0,0 +1,133 @@
+"""
+Насочване на четенията за справки и табла към реплика само за четене.
+
+Репликата се конфигурира като псевдоним REPLICA_ALIAS в settings.DATABASES
+(вижте DB_REPLICA_HOST). Четенията отиват към нея само в изгледи, отбелязани
+с @replica_reads (или в блок `with use_replica():`); всички записи и
+останалите четения остават на основната база.
+
+Read-your-writes: след заявка, която е писала в базата, ReplicaRouterMiddleware
+поставя бисквитка и следващите заявки на същия браузър четат от основната
+база в продължение на settings.REPLICA_STICKY_SECONDS секунди - докато
+репликата навакса. Четене след запис в рамките на същата заявка също
+остава на основната база.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+REPLICA_ALIAS = 'replica'
+
+# Бисквитка, която задържа четенията на основната база след запис
+STICKY_COOKIE = 'db_primary_pin'
+
+
+class RoutingState:
+    """
+    Състоянието на насочването за текущата заявка (или блок use_replica).
+
+    Attributes:
+        replica (bool): Четенията могат да отидат към репликата.
+        pinned (bool): Четенията остават на основната база (скорошен запис).
+        wrote (bool): В текущата заявка е писано в базата.
+    """
+
+    def __init__(self, pinned=False):
+        self.replica = False
+        self.pinned = pinned
+        self.wrote = False
+
+
+_state = ContextVar('replica_routing_state', default=None)
+
+
+def replica_alias():
+    """
+    Псевдонимът на репликата или None, ако не е конфигурирана.
+    """
+    return REPLICA_ALIAS if REPLICA_ALIAS in settings.DATABASES else None
+
+
+@contextmanager
+def request_routing(pinned=False):
+    """
+    Ново състояние на насочването за една заявка (използва се от middleware-а).
+    """
+    state = RoutingState(pinned)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def use_replica():
+    """
+    Позволява четенията в блока да отидат към репликата.
+
+    Извън заявка (напр. в management команда) създава собствено състояние.
+    """
+    state = _state.get()
+    if state is None:
+        with request_routing() as state:
+            state.replica = True
+            yield
+        return
+
+    previous = state.replica
+    state.replica = True
+    try:
+        yield
+    finally:
+        state.replica = previous
+
+
+def replica_reads(view):
+    """
+    Декоратор за изгледи само за четене (справки и табла): четенията им
+    отиват към репликата, освен ако потребителят скоро е писал в базата.
+
+    Работи и за методи (напр. изгледите на ModelAdmin).
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with use_replica():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Router: четения в @replica_reads изгледи -> реплика, всичко останало -> основна база.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replica or state.pinned or state.wrote:
+            return None
+        return replica_alias()
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        # Изрично: обект, прочетен от репликата, се записва в основната база
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, REPLICA_ALIAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Репликата получава схемата чрез репликацията от основната база
+        if db == REPLICA_ALIAS:
+            return False
+        return None
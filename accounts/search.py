@@ -0,0 +1,253 @@
+"""
+Търсене на продукти по име, описание и ресторант.
+
+В PostgreSQL търсенето използва пълнотекстово търсене (tsvector/tsquery с
+префиксно съвпадение) и pg_trgm (word similarity за правописни грешки),
+като всяко условие се обслужва от GIN индекс (миграция 0009). Кандидатите
+от всеки индекс се подреждат по собствената си релевантност (ts_rank или
+разстоянието <<-> на pg_trgm) и се ограничават до SEARCH_CANDIDATE_LIMIT,
+така че при много съвпадения отпадат най-слабите, а не случайни редове.
+Окончателното подреждане по обща релевантност е само върху кандидатите.
+
+За други бази (напр. SQLite при тестовете) се използва ProductSearchIndex -
+индекс в паметта, построен от кешираното меню (accounts.cache.get_catalog)
+и обновяван при смяна на версията му.
+"""
+
+import bisect
+import re
+from collections import defaultdict
+
+from django.db import connection
+
+from .cache import get_catalog, get_catalog_version
+from .models import Product
+
+
+# Брой резултати по подразбиране
+SEARCH_LIMIT = 20
+
+# Максимален брой кандидати от всеки индекс преди подреждането
+SEARCH_CANDIDATE_LIMIT = 1000
+
+# Минимално сходство (0..1) на триграмите за "почти" съвпадение
+TRIGRAM_THRESHOLD = 0.3
+
+# Тегла на полетата при подреждането
+FIELD_WEIGHTS = {'name': 1.0, 'restaurant_name': 0.6, 'description': 0.4}
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Разделя текста на думи с малки букви.
+    """
+    return _TOKEN_RE.findall((text or '').lower())
+
+
+def trigrams(word):
+    """
+    Триграмите на думата по правилата на pg_trgm (с два интервала отпред и един отзад).
+    """
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ProductSearchIndex:
+    """
+    Обърнат индекс в паметта върху редовете на менюто.
+
+    Всяка дума от полетата в FIELD_WEIGHTS се пази в сортиран списък
+    (за префиксно търсене с bisect) и в индекс по триграми (за думи с
+    правописни грешки). Продуктът трябва да съвпада с всяка дума от
+    заявката - точно, по префикс или по сходство на триграмите.
+
+    Attributes:
+        rows (dict): Редовете на менюто по id.
+        words (list): Сортирани уникални думи.
+        postings (dict): Дума -> {product_id: тегло на най-доброто поле}.
+        trigram_index (dict): Триграма -> множество от думи.
+    """
+
+    def __init__(self, rows):
+        self.rows = {row['id']: row for row in rows}
+        self.postings = defaultdict(dict)
+        for row in rows:
+            for field, weight in FIELD_WEIGHTS.items():
+                for word in tokenize(row.get(field)):
+                    if self.postings[word].get(row['id'], 0) < weight:
+                        self.postings[word][row['id']] = weight
+        self.words = sorted(self.postings)
+        self.trigram_index = defaultdict(set)
+        for word in self.words:
+            for trigram in trigrams(word):
+                self.trigram_index[trigram].add(word)
+
+    def _prefix_words(self, term):
+        start = bisect.bisect_left(self.words, term)
+        end = bisect.bisect_left(self.words, term + '\uffff')
+        return self.words[start:end]
+
+    def _similar_words(self, term):
+        term_trigrams = trigrams(term)
+        candidates = set()
+        for trigram in term_trigrams:
+            candidates |= self.trigram_index.get(trigram, set())
+        return [
+            (word, score) for word in candidates
+            if (score := _similarity(term_trigrams, trigrams(word))) >= TRIGRAM_THRESHOLD
+        ]
+
+    def _term_scores(self, term):
+        """
+        Връща {product_id: оценка} за една дума от заявката.
+        """
+        scores = {}
+        matches = [(word, 1.0 if word == term else 0.8) for word in self._prefix_words(term)]
+        if not matches:
+            matches = [(word, score * 0.5) for word, score in self._similar_words(term)]
+        for word, score in matches:
+            for product_id, weight in self.postings[word].items():
+                scores[product_id] = max(scores.get(product_id, 0), score * weight)
+        return scores
+
+    def search(self, query, category=None, limit=SEARCH_LIMIT):
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        totals = None
+        for term in terms:
+            scores = self._term_scores(term)
+            if totals is None:
+                totals = scores
+            else:
+                totals = {
+                    product_id: totals[product_id] + score
+                    for product_id, score in scores.items() if product_id in totals
+                }
+            if not totals:
+                return []
+
+        ranked = sorted(
+            (
+                (score, product_id) for product_id, score in totals.items()
+                if not category or self.rows[product_id]['category'] == category
+            ),
+            key=lambda item: (-item[0], item[1]),
+        )
+        return [dict(self.rows[product_id], rank=score) for score, product_id in ranked[:limit]]
+
+
+_memory_index = {}
+
+
+def _get_memory_index():
+    """
+    Връща индекса в паметта за текущата версия на менюто (построява го при нужда).
+    """
+    version = get_catalog_version()
+    if _memory_index.get('version') != version:
+        _memory_index['index'] = ProductSearchIndex(get_catalog())
+        _memory_index['version'] = version
+    return _memory_index['index']
+
+
+# Изразите съвпадат точно с индексите от миграция 0009
+_POSTGRES_SEARCH_SQL = """
+WITH candidates AS (
+    (SELECT p.id FROM accounts_product p
+     WHERE to_tsvector('simple', coalesce(p.name, '') || ' ' || coalesce(p.description, ''))
+           @@ to_tsquery('simple', %(tsquery)s)
+       AND (%(category)s = '' OR p.category = %(category)s)
+     ORDER BY ts_rank(
+                  to_tsvector('simple', coalesce(p.name, '') || ' ' || coalesce(p.description, '')),
+                  to_tsquery('simple', %(tsquery)s)
+              ) DESC, p.id
+     LIMIT %(candidate_limit)s)
+    UNION
+    (SELECT p.id FROM accounts_product p
+     WHERE (%(query)s <%% p.name OR %(query)s <%% p.description)
+       AND (%(category)s = '' OR p.category = %(category)s)
+     ORDER BY least(%(query)s <<-> p.name, %(query)s <<-> coalesce(p.description, '')), p.id
+     LIMIT %(candidate_limit)s)
+    UNION
+    (SELECT p.id FROM accounts_product p
+     JOIN accounts_restaurant r ON r.id = p.restaurant_id
+     WHERE (to_tsvector('simple', r.name) @@ to_tsquery('simple', %(tsquery)s)
+            OR %(query)s <%% r.name)
+       AND (%(category)s = '' OR p.category = %(category)s)
+     ORDER BY ts_rank(to_tsvector('simple', r.name), to_tsquery('simple', %(tsquery)s))
+              + word_similarity(%(query)s, r.name) DESC, p.id
+     LIMIT %(candidate_limit)s)
+)
+SELECT p.id, p.name, p.description, p.price, p.category, p.restaurant_id, r.name,
+       ts_rank(
+           setweight(to_tsvector('simple', coalesce(p.name, '')), 'A')
+           || setweight(to_tsvector('simple', r.name), 'B')
+           || setweight(to_tsvector('simple', coalesce(p.description, '')), 'C'),
+           to_tsquery('simple', %(tsquery)s)
+       ) + word_similarity(%(query)s, p.name) AS rank
+FROM candidates c
+JOIN accounts_product p ON p.id = c.id
+JOIN accounts_restaurant r ON r.id = p.restaurant_id
+ORDER BY rank DESC, p.id
+LIMIT %(limit)s
+"""
+
+
+def _search_postgres(query, category, limit):
+    terms = tokenize(query)
+    if not terms:
+        return []
+    params = {
+        # Всяка дума е префикс: "марг пиц" -> марг:* & пиц:*
+        'tsquery': ' & '.join(f"'{term}':*" for term in terms),
+        'query': ' '.join(terms),
+        'category': category or '',
+        'candidate_limit': SEARCH_CANDIDATE_LIMIT,
+        'limit': limit,
+    }
+    categories = dict(Product.CATEGORY_CHOICES)
+    with connection.cursor() as cursor:
+        cursor.execute(_POSTGRES_SEARCH_SQL, params)
+        return [
+            {
+                'id': product_id,
+                'name': name,
+                'description': description,
+                'price': price,
+                'category': product_category,
+                'category_display': categories.get(product_category, product_category),
+                'restaurant_id': restaurant_id,
+                'restaurant_name': restaurant_name,
+                'rank': rank,
+            }
+            for product_id, name, description, price, product_category, restaurant_id, restaurant_name, rank
+            in cursor.fetchall()
+        ]
+
+
+def search_products(query, category=None, limit=SEARCH_LIMIT):
+    """
+    Търси продукти по име, описание и име на ресторанта.
+
+    Args:
+        query (str): Текстът за търсене; всяка дума се търси и като префикс.
+        category (str | None): Ограничава резултатите до категория.
+        limit (int): Максимален брой резултати.
+
+    Returns:
+        list: Редове като тези от get_catalog() с допълнителен ключ 'rank',
+        подредени по релевантност.
+    """
+    if connection.vendor == 'postgresql':
+        return _search_postgres(query, category, limit)
+    return _get_memory_index().search(query, category=category, limit=limit)
@@ -0,0 +1,169 @@
+"""
+Бизнес услуги на приложението 'accounts'.
+
+Модулът съдържа операции, които засягат няколко модела наведнъж и трябва
+да се изпълняват атомарно и с фиксиран брой заявки към базата данни,
+независимо от обема на данните (напр. финализиране на поръчка от количката).
+"""
+
+from decimal import Decimal
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F
+
+from .models import CartItem, Order, OrderItem, Product
+
+
+class EmptyCartError(Exception):
+    """
+    Изключение при опит за финализиране на поръчка с празна количка.
+    """
+
+
+# Бази с INSERT ... ON CONFLICT DO UPDATE ... RETURNING (SQLite >= 3.35)
+UPSERT_VENDORS = ('postgresql', 'sqlite')
+
+
+def _upsert_cart_item_sql(connection):
+    quote = connection.ops.quote_name
+    cart = quote(CartItem._meta.db_table)
+    product = quote(Product._meta.db_table)
+    user_id = quote(CartItem._meta.get_field('user').column)
+    product_id = quote(CartItem._meta.get_field('product').column)
+    quantity = quote(CartItem._meta.get_field('quantity').column)
+    # Редът се вмъква само ако продуктът съществува (SELECT ... WHERE), така че
+    # проверката и добавянето са една заявка
+    return (
+        f'INSERT INTO {cart} ({user_id}, {product_id}, {quantity}) '
+        f'SELECT %s, {product}.{quote("id")}, %s FROM {product} WHERE {product}.{quote("id")} = %s '
+        f'ON CONFLICT ({user_id}, {product_id}) '
+        f'DO UPDATE SET {quantity} = {cart}.{quantity} + EXCLUDED.{quantity} '
+        f'RETURNING {quantity}'
+    )
+
+
+def add_product_to_cart(user, product_id, quantity=1):
+    """
+    Добавя продукт в количката или увеличава количеството му с една заявка.
+
+    В PostgreSQL и SQLite се изпълнява един атомарен
+    INSERT ... ON CONFLICT (user, product) DO UPDATE SET quantity = quantity + EXCLUDED.quantity,
+    така че паралелните добавяния (напр. двойно натискане) не губят количество
+    и не създават повтарящи се редове.
+
+    Args:
+        user (User): Потребителят, чиято е количката.
+        product_id (int): ID на продукта.
+        quantity (int): Брой бройки за добавяне (поне 1).
+
+    Returns:
+        tuple: (новото количество, True ако редът е създаден).
+
+    Raises:
+        Product.DoesNotExist: Ако продуктът не съществува.
+        ValueError: Ако количеството е по-малко от 1.
+    """
+    if quantity < 1:
+        raise ValueError("Количеството трябва да е поне 1.")
+
+    connection = connections[router.db_for_write(CartItem)]
+    if connection.vendor in UPSERT_VENDORS:
+        with connection.cursor() as cursor:
+            cursor.execute(_upsert_cart_item_sql(connection), [user.pk, quantity, product_id])
+            row = cursor.fetchone()
+        if row is None:
+            raise Product.DoesNotExist(f"Продукт {product_id} не съществува.")
+        # Съществуващият ред има количество >= 1, затова равенство означава нов ред
+        return row[0], row[0] == quantity
+
+    # Резервен вариант за бази без upsert: условен UPDATE, после INSERT
+    if not Product.objects.filter(pk=product_id).exists():
+        raise Product.DoesNotExist(f"Продукт {product_id} не съществува.")
+    items = CartItem.objects.filter(user=user, product_id=product_id)
+    if not items.update(quantity=F('quantity') + quantity):
+        try:
+            with transaction.atomic():
+                CartItem.objects.create(user=user, product_id=product_id, quantity=quantity)
+            return quantity, True
+        except IntegrityError:
+            # Редът е създаден паралелно
+            items.update(quantity=F('quantity') + quantity)
+    return items.values_list('quantity', flat=True).get(), False
+
+
+def place_order_from_cart(user, client, address, phone_number):
+    """
+    Създава поръчка от съдържанието на количката на потребителя.
+
+    Количката се зарежда заедно с продуктите с една заявка (select_related),
+    общата сума се изчислява еднократно, всички OrderItem записи се създават
+    с един bulk INSERT, а количката се изчиства с един DELETE. Всичко се
+    изпълнява в една транзакция, така че броят заявки не зависи от броя на
+    артикулите в количката.
+
+    Args:
+        user (User): Потребителят, чиято количка се финализира.
+        client (Client): Клиентският профил, към който се записва поръчката.
+        address (str): Адрес за доставка.
+        phone_number (str): Телефонен номер за връзка.
+
+    Returns:
+        Order: Новосъздадената поръчка.
+
+    Raises:
+        EmptyCartError: Ако количката на потребителя е празна.
+    """
+    with transaction.atomic():
+        cart_items = list(
+            CartItem.objects.filter(user=user).select_related('product')
+        )
+        if not cart_items:
+            raise EmptyCartError("Количката е празна.")
+
+        order = place_order(
+            client,
+            [(item.product_id, item.quantity, item.product.price) for item in cart_items],
+            address,
+            phone_number,
+        )
+        CartItem.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
+
+    return order
+
+
+def place_order(client, lines, address, phone_number):
+    """
+    Създава поръчка с дадените редове с две заявки (Order и bulk INSERT на OrderItem).
+
+    Сумите на редовете и общата сума се изчисляват еднократно от подадените
+    цени, така че извикващият трябва да ги е прочел от базата (напр. с една
+    заявка по id__in).
+
+    Args:
+        client (Client): Клиентският профил, към който се записва поръчката.
+        lines (list): Редове (product_id, quantity, price) с единичната цена на продукта.
+        address (str): Адрес за доставка.
+        phone_number (str): Телефонен номер за връзка.
+
+    Returns:
+        Order: Новосъздадената поръчка.
+    """
+    # Цените на редовете се изчисляват веднъж и се преизползват
+    priced = [(product_id, quantity, price * quantity) for product_id, quantity, price in lines]
+    total_price = sum((line_total for _, _, line_total in priced), Decimal('0'))
+
+    # Без savepoint: при извикване от place_order_from_cart вече сме в транзакция
+    with transaction.atomic(savepoint=False):
+        order = Order.objects.create(
+            client=client,
+            total_price=total_price,
+            status='pending',
+            address=address,
+            phone_number=phone_number,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=product_id, quantity=quantity, price=line_total)
+            for product_id, quantity, line_total in priced
+        ])
+
+    return order
@@ -1,6 +1,49 @@
-from django.db.models.signals import post_save
+from decimal import Decimal
+
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from .models import Order
+from .cache import invalidate_bonus_settings, invalidate_catalog
+from .jobs import enqueue
+from .models import BonusSettings, Order, Product, Restaurant
+from .rollups import rollup_changes
+
+
+@receiver(post_save, sender=BonusSettings)
+@receiver(post_delete, sender=BonusSettings)
+def invalidate_bonus_settings_cache(sender, instance, **kwargs):
+    """
+    Обезсилва кешираната активна бонус настройка при промяна или изтриване.
+    """
+    invalidate_bonus_settings()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def invalidate_catalog_cache(sender, instance, **kwargs):
+    """
+    Обезсилва кешираното меню при промяна на продукт или ресторант.
+    """
+    invalidate_catalog()
+
+
+@receiver(pre_delete, sender=Order)
+def remove_deleted_order(sender, instance, **kwargs):
+    """
+    Изважда изтрита доставена поръчка от дневните обобщения и оборота на доставчика.
+
+    Промените се изчисляват преди изтриването (докато артикулите съществуват)
+    от записаните стойности и се прилагат от фонова задача.
+    """
+    if instance.previous('status') != 'delivered':
+        return
+    delivery_person_id = instance.previous('delivery_person')
+    total_price = Decimal(instance.previous('total_price'))
+    enqueue('rollup.apply', changes=rollup_changes(instance, 'delivered', delivery_person_id, total_price, -1))
+    if delivery_person_id:
+        enqueue('ledger.adjust_turnover', order_id=None, adjustments=[(delivery_person_id, str(-total_price))])
+
 
 
 '''
@@ -1,3 +1,1824 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+import asyncio
+import importlib.util
+import json
+import os
+import queue
+import tempfile
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+
+from .benchmarks import BENCHMARKS
+from .models import (
+    BonusPayout, BonusSettings, CartItem, Client, CourierLedgerEntry, DailyTurnover, DeliveryPerson,
+    Job, Order, OrderItem, Product, Restaurant, User,
+)
+from .cache import (
+    get_active_bonus_settings, get_catalog, get_catalog_products, invalidate_bonus_settings, invalidate_catalog,
+)
+from .forms import OrderBuilderForm
+from .jobs import JOBS, JobSpec, enqueue, purge_failed_jobs, run_next_job, run_pending_jobs
+from .cart import CacheCart, CartBusyError, DatabaseCart, get_cart, get_cart_badge
+from .checks import check_debug_with_production_hosts
+from .dispatch import DispatchEngine, claim_next_order, claim_order, dispatch_pending_orders
+from .events import LocalBroker, RedisBroker, user_channel
+from .exports import export_response
+from .ledger import courier_totals, refresh_courier_totals, with_courier_totals
+from .loadtest import LOAD_RESTAURANT_TAG
+from .management.commands.calculate_bonuses import Command as CalculateBonusesCommand
+from .pagination import InvalidCursor, keyset_paginate
+from .rollups import turnover_by_day, turnover_totals
+from .routers import STICKY_COOKIE, ReplicaRouter, request_routing, use_replica
+from .search import search_products
+from .services import EmptyCartError, add_product_to_cart, place_order_from_cart
+
+
+class CheckoutServiceTests(TestCase):
+    """
+    Тестове за услугата за финализиране на поръчка от количката.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurant = Restaurant.objects.create(name='Пицария', address='ул. Витоша 1')
+        cls.products = [
+            Product.objects.create(
+                restaurant=cls.restaurant,
+                name=f'Продукт {i}',
+                price=Decimal('2.50') + i,
+                category='pizza',
+            )
+            for i in range(30)
+        ]
+
+    def make_client(self, username):
+        user = User.objects.create_user(username=username, password='secret', is_client=True)
+        return user, Client.objects.create(user=user, address='ул. Шипка 5')
+
+    def fill_cart(self, user, count):
+        CartItem.objects.bulk_create([
+            CartItem(user=user, product=product, quantity=2)
+            for product in self.products[:count]
+        ])
+
+    def test_places_order_with_items_and_clears_cart(self):
+        user, client = self.make_client('ivan')
+        self.fill_cart(user, 3)
+
+        order = place_order_from_cart(user, client, 'ул. Шипка 5', '0888123456')
+
+        expected = sum(p.price * 2 for p in self.products[:3])
+        self.assertEqual(order.total_price, expected)
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+        self.assertFalse(CartItem.objects.filter(user=user).exists())
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        small_user, small_client = self.make_client('small')
+        big_user, big_client = self.make_client('big')
+        self.fill_cart(small_user, 1)
+        self.fill_cart(big_user, 30)
+
+        # SELECT количка, INSERT поръчка, bulk INSERT редове, DELETE количка
+        # + SAVEPOINT/RELEASE на вложената транзакция
+        with self.assertNumQueries(6):
+            place_order_from_cart(small_user, small_client, 'адрес', '0888')
+        with self.assertNumQueries(6):
+            place_order_from_cart(big_user, big_client, 'адрес', '0888')
+
+    def test_empty_cart_raises(self):
+        user, client = self.make_client('empty')
+        with self.assertRaises(EmptyCartError):
+            place_order_from_cart(user, client, 'адрес', '0888')
+        self.assertFalse(Order.objects.exists())
+
+    def test_checkout_view_redirects_on_empty_cart(self):
+        user, _ = self.make_client('viewer')
+        self.client.force_login(user)
+        response = self.client.post(
+            reverse('checkout'), {'address': 'адрес', 'phone_number': '0888'}
+        )
+        self.assertRedirects(response, reverse('view_cart'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderStatusTrackingTests(TestCase):
+    """
+    Тестове за проследяването на статуса на поръчка и начисляването на бонуси.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        client_user = User.objects.create_user(username='client', password='secret', is_client=True)
+        cls.client_profile = Client.objects.create(user=client_user, address='адрес')
+        courier_user = User.objects.create_user(username='courier', password='secret', is_delivery_person=True)
+        cls.courier = DeliveryPerson.objects.create(user=courier_user, vehicle_type='bike')
+        BonusSettings.objects.create(min_turnover=Decimal('10.00'), bonus_amount=Decimal('5.00'))
+
+    def setUp(self):
+        invalidate_bonus_settings()
+
+    def make_order(self, status='shipped'):
+        return Order.objects.create(
+            client=self.client_profile,
+            delivery_person=self.courier,
+            total_price=Decimal('20.00'),
+            status=status,
+        )
+
+    def test_tracks_status_changes_in_memory(self):
+        order = Order.objects.get(pk=self.make_order().pk)
+        self.assertFalse(order.has_changed('status'))
+
+        order.status = 'delivered'
+        self.assertTrue(order.has_changed('status'))
+        self.assertEqual(order.previous('status'), 'shipped')
+
+    @override_settings(JOBS_EAGER=False)
+    def test_plain_status_update_issues_single_update(self):
+        order = Order.objects.get(pk=self.make_order(status='pending').pk)
+        order.status = 'shipped'
+        # UPDATE на поръчката и задачата за имейл известието
+        with self.assertNumQueries(2):
+            order.save()
+        self.assertEqual(list(Job.objects.values_list('name', flat=True)), ['orders.notify_status'])
+        self.assertFalse(order.has_changed('status'))
+        self.assertEqual(order.previous('status'), 'shipped')
+
+    def test_bonus_applied_once_per_delivery(self):
+        order = self.make_order()
+        order.status = 'delivered'
+        order.save()
+        order.save()
+
+        totals = courier_totals(self.courier.pk)
+        self.assertEqual(totals['turnover'], Decimal('20.00'))
+        self.assertEqual(totals['bonuses'], Decimal('5.00'))
+
+    def test_concurrent_delivery_does_not_double_credit(self):
+        order = self.make_order()
+        first = Order.objects.get(pk=order.pk)
+        second = Order.objects.get(pk=order.pk)
+
+        first.status = 'delivered'
+        first.save()
+        second.status = 'delivered'
+        second.save()
+
+        self.assertEqual(courier_totals(self.courier.pk)['bonuses'], Decimal('5.00'))
+
+
+class BonusSettingsCacheTests(TestCase):
+    """
+    Тестове за кешираната активна бонус настройка.
+    """
+
+    def setUp(self):
+        invalidate_bonus_settings()
+
+    def test_cached_lookup_does_not_hit_database(self):
+        BonusSettings.objects.create(min_turnover=Decimal('100.00'), bonus_amount=Decimal('10.00'))
+        self.assertEqual(get_active_bonus_settings().bonus_amount, Decimal('10.00'))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_active_bonus_settings().bonus_amount, Decimal('10.00'))
+
+    def test_missing_settings_are_cached(self):
+        self.assertIsNone(get_active_bonus_settings())
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_active_bonus_settings())
+
+    def test_save_and_delete_invalidate_cache(self):
+        bonus = BonusSettings.objects.create(min_turnover=Decimal('100.00'), bonus_amount=Decimal('10.00'))
+        get_active_bonus_settings()
+
+        bonus.bonus_amount = Decimal('15.00')
+        bonus.save()
+        self.assertEqual(get_active_bonus_settings().bonus_amount, Decimal('15.00'))
+
+        bonus.delete()
+        self.assertIsNone(get_active_bonus_settings())
+
+    def test_entry_expires_after_ttl(self):
+        BonusSettings.objects.create(min_turnover=Decimal('100.00'), bonus_amount=Decimal('10.00'))
+        get_active_bonus_settings()
+        # Промяна, заобикаляща сигналите (напр. от друг процес без споделен кеш)
+        BonusSettings.objects.update(bonus_amount=Decimal('20.00'))
+
+        with self.settings(BONUS_SETTINGS_CACHE_TTL=0):
+            self.assertEqual(get_active_bonus_settings().bonus_amount, Decimal('20.00'))
+
+
+class DailyTurnoverRollupTests(TestCase):
+    """
+    Тестове за инкременталното поддържане и изграждането на DailyTurnover.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        client_user = User.objects.create_user(username='client', password='secret', is_client=True)
+        cls.client_profile = Client.objects.create(user=client_user, address='адрес')
+        courier_user = User.objects.create_user(username='courier', password='secret', is_delivery_person=True)
+        cls.courier = DeliveryPerson.objects.create(user=courier_user, vehicle_type='bike')
+        cls.pizzeria = Restaurant.objects.create(name='Пицария', address='адрес 1')
+        cls.bistro = Restaurant.objects.create(name='Бистро', address='адрес 2')
+        cls.pizza = Product.objects.create(restaurant=cls.pizzeria, name='Пица', price=Decimal('10.00'), category='pizza')
+        cls.salad = Product.objects.create(restaurant=cls.bistro, name='Салата', price=Decimal('6.00'), category='salad')
+
+    def setUp(self):
+        invalidate_bonus_settings()
+        self.today = timezone.localdate()
+
+    def make_order(self, *products, created_at=None):
+        order = Order.objects.create(
+            client=self.client_profile,
+            delivery_person=self.courier,
+            total_price=sum(p.price for p in products),
+            status='shipped',
+            created_at=created_at or timezone.now(),
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=p, quantity=1, price=p.price) for p in products
+        ])
+        return order
+
+    def deliver(self, order):
+        order.status = 'delivered'
+        order.save()
+
+    def test_delivery_updates_rollup_per_restaurant(self):
+        self.deliver(self.make_order(self.pizza, self.salad))
+        self.deliver(self.make_order(self.pizza))
+
+        totals = turnover_totals(self.today, self.today)
+        self.assertEqual(totals, {'total': Decimal('26.00'), 'order_count': 2})
+        self.assertEqual(
+            turnover_totals(self.today, self.today, restaurant=self.bistro)['total'],
+            Decimal('6.00'),
+        )
+        self.assertEqual(
+            turnover_totals(self.today, self.today, delivery_person=self.courier)['order_count'],
+            2,
+        )
+
+    def test_leaving_delivered_removes_order_from_rollup(self):
+        order = self.make_order(self.pizza)
+        self.deliver(order)
+        order.status = 'cancelled'
+        order.save()
+
+        self.assertEqual(turnover_totals(self.today, self.today), {'total': Decimal('0'), 'order_count': 0})
+
+    def test_reassigning_delivered_order_moves_turnover(self):
+        other_user = User.objects.create_user(username='courier2', password='secret', is_delivery_person=True)
+        other = DeliveryPerson.objects.create(user=other_user, vehicle_type='car')
+        order = self.make_order(self.pizza)
+        self.deliver(order)
+
+        order.delivery_person = other
+        order.save()
+
+        self.assertEqual(turnover_totals(self.today, self.today, delivery_person=self.courier)['order_count'], 0)
+        self.assertEqual(
+            turnover_totals(self.today, self.today, delivery_person=other),
+            {'total': Decimal('10.00'), 'order_count': 1},
+        )
+        self.assertEqual(courier_totals(self.courier.pk)['turnover'], Decimal('0'))
+        self.assertEqual(courier_totals(other.pk)['turnover'], Decimal('10.00'))
+
+    def test_editing_total_of_delivered_order_updates_rollup(self):
+        order = self.make_order(self.pizza)
+        self.deliver(order)
+
+        order.total_price = Decimal('12.50')
+        order.save()
+
+        self.assertEqual(turnover_totals(self.today, self.today), {'total': Decimal('12.50'), 'order_count': 1})
+        self.assertEqual(courier_totals(self.courier.pk)['turnover'], Decimal('12.50'))
+
+    def test_deleting_delivered_order_removes_it_from_rollup(self):
+        order = self.make_order(self.pizza)
+        self.deliver(order)
+        self.deliver(self.make_order(self.salad))
+
+        order.delete()
+
+        self.assertEqual(turnover_totals(self.today, self.today), {'total': Decimal('6.00'), 'order_count': 1})
+        self.assertEqual(turnover_totals(self.today, self.today, restaurant=self.pizzeria)['order_count'], 0)
+        self.assertEqual(courier_totals(self.courier.pk)['turnover'], Decimal('6.00'))
+
+    def test_rebuild_command_matches_incremental_rollup(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        self.deliver(self.make_order(self.pizza, self.salad, created_at=yesterday))
+        self.deliver(self.make_order(self.salad))
+        self.make_order(self.pizza)  # Недоставена - не влиза в обобщенията
+        expected = list(turnover_by_day(self.today - timedelta(days=1), self.today))
+
+        DailyTurnover.objects.all().delete()
+        call_command(
+            'rebuild_turnover_rollup',
+            '--start', (self.today - timedelta(days=1)).isoformat(),
+            '--end', self.today.isoformat(),
+            stdout=StringIO(),
+        )
+
+        self.assertEqual(list(turnover_by_day(self.today - timedelta(days=1), self.today)), expected)
+        self.assertEqual([row['total'] for row in expected], [Decimal('16.00'), Decimal('6.00')])
+
+    def test_report_view_reads_from_rollup(self):
+        self.deliver(self.make_order(self.pizza))
+        day = self.today.isoformat()
+        response = self.client.get(reverse('turnover_report'), {'start_date': day, 'end_date': day})
+        self.assertEqual(response.context['total_turnover'], Decimal('10.00'))
+
+
+class OrderHistoryPaginationTests(TestCase):
+    """
+    Тестове за keyset пагинацията на историята на поръчките.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='client', password='secret', is_client=True)
+        cls.client_profile = Client.objects.create(user=cls.user, address='адрес')
+        restaurant = Restaurant.objects.create(name='Пицария', address='адрес')
+        product = Product.objects.create(restaurant=restaurant, name='Пица', price=Decimal('10.00'), category='pizza')
+        now = timezone.now()
+        # Няколко поръчки с еднакво време, за да се провери подредбата по id
+        cls.orders = Order.objects.bulk_create([
+            Order(client=cls.client_profile, total_price=Decimal('10.00'), created_at=now - timedelta(minutes=i // 3))
+            for i in range(25)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1, price=Decimal('10.00'))
+            for order in cls.orders
+        ])
+
+    def test_pages_cover_all_orders_without_overlap(self):
+        seen = []
+        cursor = None
+        while True:
+            page = keyset_paginate(Order.objects.filter(client=self.client_profile), cursor, page_size=7)
+            seen.extend(order.pk for order in page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+
+        expected = list(
+            Order.objects.filter(client=self.client_profile)
+            .order_by('-created_at', '-id')
+            .values_list('pk', flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+    def test_deep_page_costs_the_same_as_first_page(self):
+        orders = Order.objects.filter(client=self.client_profile).prefetch_related('items__product')
+        first = keyset_paginate(orders, page_size=5)
+        with self.assertNumQueries(3):
+            page = keyset_paginate(orders, first.next_cursor, page_size=5)
+            [item.product.name for order in page for item in order.items.all()]
+
+    def test_invalid_cursor_raises(self):
+        with self.assertRaises(InvalidCursor):
+            keyset_paginate(Order.objects.all(), 'not-a-cursor')
+
+    def test_view_renders_first_page_with_next_link(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('track_orders'))
+        self.assertEqual(len(response.context['orders']), 20)
+        self.assertTrue(response.context['page'].has_next)
+
+        response = self.client.get(reverse('track_orders'), {'cursor': response.context['page'].next_cursor})
+        self.assertEqual(len(response.context['orders']), 5)
+        self.assertContains(response, 'Пица')
+
+
+class StreamingExportTests(TestCase):
+    """
+    Тестове за поточния експорт на поръчки и приходи.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        client_user = User.objects.create_user(username='client', password='secret', is_client=True)
+        client_profile = Client.objects.create(user=client_user, address='адрес')
+        courier_user = User.objects.create_user(username='courier', password='secret', is_delivery_person=True)
+        cls.courier = DeliveryPerson.objects.create(user=courier_user, vehicle_type='bike')
+        restaurant = Restaurant.objects.create(name='Пицария', address='адрес')
+        product = Product.objects.create(restaurant=restaurant, name='Пица', price=Decimal('10.00'), category='pizza')
+        for _ in range(3):
+            order = Order.objects.create(
+                client=client_profile, delivery_person=cls.courier, total_price=Decimal('10.00'), status='shipped'
+            )
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=Decimal('10.00'))
+            order.status = 'delivered'
+            order.save()
+        cls.admin = User.objects.create_superuser(username='admin', password='secret')
+
+    def setUp(self):
+        invalidate_bonus_settings()
+        self.today = timezone.localdate()
+
+    def read(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_orders_csv(self):
+        content = self.read(export_response('orders', 'csv', self.today, self.today))
+        lines = content.splitlines()
+        self.assertEqual(lines[0].split(',')[0], 'Поръчка')
+        self.assertEqual(len(lines), 4)
+
+    def test_order_items_jsonl(self):
+        content = self.read(export_response('order_items', 'jsonl', self.today, self.today))
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['product'], 'Пица')
+
+    def test_courier_earnings_jsonl(self):
+        content = self.read(export_response('courier_earnings', 'jsonl', self.today, self.today))
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['delivery_person'], 'courier')
+        self.assertEqual(rows[0]['order_count'], 3)
+        self.assertEqual(Decimal(rows[0]['total_earnings']), Decimal('30.00'))
+
+    def test_admin_export_view_streams(self):
+        self.client.force_login(self.admin)
+        day = self.today.isoformat()
+        response = self.client.get(reverse('admin:order_export'), {
+            'start_date': day, 'end_date': day, 'dataset': 'orders', 'export_format': 'csv',
+        })
+        self.assertEqual(len(self.read(response).splitlines()), 4)
+
+    def test_admin_courier_action_streams(self):
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('admin:accounts_deliveryperson_changelist'), {
+            'action': 'export_to_csv', '_selected_action': [self.courier.pk],
+        })
+        header, row = self.read(response).splitlines()
+        self.assertEqual(row.split(',')[1:3], ['courier', '3'])
+
+    def test_admin_courier_action_ends_on_local_date(self):
+        self.client.force_login(self.admin)
+        local_today = self.today + timedelta(days=1)  # Напр. след полунощ местно време, преди полунощ UTC
+        with mock.patch('accounts.admin.timezone.localdate', return_value=local_today), \
+                mock.patch('accounts.admin.export_response', wraps=export_response) as export:
+            self.client.post(reverse('admin:accounts_deliveryperson_changelist'), {
+                'action': 'export_to_csv', '_selected_action': [self.courier.pk],
+            })
+        self.assertEqual(export.call_args.args[2:4], (self.today, local_today))
+
+
+class CourierOrderListTests(TestCase):
+    """
+    Тестове за списъците с поръчки на доставчика (брой заявки и страници).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        client_user = User.objects.create_user(username='client', password='secret', is_client=True)
+        client_profile = Client.objects.create(user=client_user, address='адрес')
+        courier_user = User.objects.create_user(username='courier', password='secret', is_delivery_person=True)
+        cls.courier = DeliveryPerson.objects.create(user=courier_user, vehicle_type='bike')
+        restaurant = Restaurant.objects.create(name='Пицария', address='адрес')
+        products = [
+            Product.objects.create(restaurant=restaurant, name=f'Пица {i}', price=Decimal('10.00'), category='pizza')
+            for i in range(3)
+        ]
+        for status, count in (('shipped', 5), ('delivered', 25)):
+            orders = Order.objects.bulk_create([
+                Order(client=client_profile, delivery_person=cls.courier, total_price=Decimal('20.00'), status=status)
+                for _ in range(count)
+            ])
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, price=product.price)
+                for order in orders for product in products[:2]
+            ])
+
+    def setUp(self):
+        self.client.force_login(self.courier.user)
+
+    def test_delivery_dashboard_prefetches_items(self):
+        # Сесия, потребител, доставчик, поръчки, артикули с продуктите
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('delivery_dashboard'))
+        self.assertEqual(len(response.context['orders']), 5)
+        self.assertContains(response, 'Пица 1', count=5)
+
+    def test_earnings_report_is_paginated_and_prefetched(self):
+        url = reverse('earnings_report', args=[self.courier.pk])
+        # Доставчик, поръчки, артикули с продуктите, оборот от журнала, потребител на доставчика
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['orders']), 20)
+        self.assertTrue(response.context['page'].has_next)
+
+        response = self.client.get(url, {'cursor': response.context['page'].next_cursor})
+        self.assertEqual(len(response.context['orders']), 5)
+        self.assertFalse(response.context['page'].has_next)
+
+
+class DispatchTests(TestCase):
+    """
+    Тестове за атомарното заявяване на поръчки от доставчици.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        client_user = User.objects.create_user(username='client', password='secret', is_client=True)
+        cls.client_profile = Client.objects.create(user=client_user, address='адрес')
+        cls.couriers = []
+        for name in ('first', 'second'):
+            user = User.objects.create_user(username=name, password='secret', is_delivery_person=True)
+            cls.couriers.append(DeliveryPerson.objects.create(user=user, vehicle_type='bike'))
+
+    def make_order(self, minutes_ago=0):
+        return Order.objects.create(
+            client=self.client_profile,
+            total_price=Decimal('12.50'),
+            created_at=timezone.now() - timedelta(minutes=minutes_ago),
+        )
+
+    def test_only_first_claim_succeeds(self):
+        order = self.make_order()
+        first, second = self.couriers
+
+        self.assertTrue(claim_order(order.pk, first))
+        self.assertFalse(claim_order(order.pk, second))
+
+        order.refresh_from_db()
+        self.assertEqual((order.delivery_person_id, order.status), (first.pk, 'shipped'))
+
+    def test_turnover_is_credited_on_delivery_not_on_claim(self):
+        courier = self.couriers[0]
+        order = self.make_order()
+        claim_order(order.pk, courier)
+        self.assertEqual(courier_totals(courier.pk)['turnover'], Decimal('0'))
+
+        order.refresh_from_db()
+        order.status = 'delivered'
+        order.save()
+        self.assertEqual(courier_totals(courier.pk)['turnover'], Decimal('12.50'))
+
+    def test_claim_next_hands_out_oldest_unclaimed_order(self):
+        newest = self.make_order(minutes_ago=1)
+        oldest = self.make_order(minutes_ago=10)
+        first, second = self.couriers
+
+        self.assertEqual(claim_next_order(first).pk, oldest.pk)
+        self.assertEqual(claim_next_order(second).pk, newest.pk)
+        self.assertIsNone(claim_next_order(first))
+
+    def test_accept_delivery_view_rejects_taken_order(self):
+        order = self.make_order()
+        claim_order(order.pk, self.couriers[0])
+
+        self.client.force_login(self.couriers[1].user)
+        self.client.post(reverse('accept_delivery', args=[order.pk]))
+        order.refresh_from_db()
+        self.assertEqual(order.delivery_person_id, self.couriers[0].pk)
+
+
+class DispatchEngineTests(TestCase):
+    """
+    Тестове за разпределянето на поръчки по близост.
+    """
+
+    def test_assigns_nearest_pairs_and_removes_them(self):
+        engine = DispatchEngine()
+        engine.add_order('a', (42.700, 23.320))
+        engine.add_order('b', (42.650, 23.380))
+        engine.add_courier(1, (42.651, 23.381))
+        engine.add_courier(2, (42.701, 23.321))
+
+        assignments = engine.assign()
+
+        self.assertEqual(sorted((o, c) for o, c, _ in assignments), [('a', 2), ('b', 1)])
+        self.assertEqual((len(engine.orders), len(engine.couriers)), (0, 0))
+
+    def test_contended_courier_goes_to_closest_order(self):
+        engine = DispatchEngine(candidates=1)
+        engine.add_order('near', (42.7000, 23.3200))
+        engine.add_order('far', (42.7050, 23.3250))
+        engine.add_courier(1, (42.7001, 23.3201))
+        engine.add_courier(2, (42.7200, 23.3400))
+
+        assignments = dict((o, c) for o, c, _ in engine.assign())
+        self.assertEqual(assignments, {'near': 1, 'far': 2})
+
+    def test_pluggable_distance_function(self):
+        calls = []
+
+        def manhattan(a, b):
+            calls.append((a, b))
+            return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+        engine = DispatchEngine(distance=manhattan)
+        engine.add_order(1, (0.0, 0.0))
+        engine.add_courier(1, (0.001, 0.001))
+        self.assertEqual(engine.assign()[0][:2], (1, 1))
+        self.assertTrue(calls)
+
+    def test_out_of_range_orders_wait_for_next_batch(self):
+        engine = DispatchEngine(max_rings=2)
+        engine.add_order(1, (42.70, 23.32))
+        engine.add_courier(1, (43.70, 24.32))
+        self.assertEqual(engine.assign(), [])
+        self.assertEqual(len(engine.orders), 1)
+
+    def test_dispatch_batch_claims_orders_for_available_couriers(self):
+        client_user = User.objects.create_user(username='client', password='secret', is_client=True)
+        client_profile = Client.objects.create(user=client_user, address='адрес')
+        restaurant = Restaurant.objects.create(name='Пицария', address='адрес', latitude=42.70, longitude=23.32)
+        product = Product.objects.create(restaurant=restaurant, name='Пица', price=Decimal('10.00'), category='pizza')
+        order = Order.objects.create(client=client_profile, total_price=Decimal('10.00'))
+        OrderItem.objects.create(order=order, product=product, quantity=1, price=Decimal('10.00'))
+        courier_user = User.objects.create_user(username='courier', password='secret', is_delivery_person=True)
+        courier = DeliveryPerson.objects.create(
+            user=courier_user, vehicle_type='bike', is_available=True, latitude=42.701, longitude=23.321
+        )
+        offline_user = User.objects.create_user(username='offline', password='secret', is_delivery_person=True)
+        DeliveryPerson.objects.create(user=offline_user, vehicle_type='bike', latitude=42.70, longitude=23.32)
+
+        assignments = dispatch_pending_orders()
+
+        self.assertEqual([(o, c) for o, c, _ in assignments], [(order.pk, courier.pk)])
+        order.refresh_from_db()
+        self.assertEqual((order.delivery_person_id, order.status), (courier.pk, 'shipped'))
+        # Доставчикът вече има активна доставка и не получава нова
+        self.assertEqual(dispatch_pending_orders(), [])
+
+
+class CalculateBonusesCommandTests(TestCase):
+    """
+    Тестове за партидното начисляване на бонуси.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        BonusSettings.objects.create(min_turnover=Decimal('100.00'), bonus_amount=Decimal('20.00'))
+        cls.couriers = []
+        for i, turnover in enumerate(['150.00', '99.99', '100.00']):
+            user = User.objects.create_user(username=f'courier{i}', password='secret', is_delivery_person=True)
+            courier = DeliveryPerson.objects.create(user=user, vehicle_type='bike')
+            DailyTurnover.objects.create(
+                day=date(2025, 5, 10), delivery_person=courier, status='delivered',
+                order_count=3, total_price=Decimal(turnover),
+            )
+            cls.couriers.append(courier)
+
+    def setUp(self):
+        invalidate_bonus_settings()
+
+    def run_command(self, *args):
+        out = StringIO()
+        call_command('calculate_bonuses', '--period', '2025-05', *args, stdout=out)
+        return out.getvalue()
+
+    def bonuses(self):
+        return [courier_totals(courier.pk)['bonuses'] for courier in self.couriers]
+
+    def test_credits_qualified_couriers_once_per_period(self):
+        self.run_command()
+        self.run_command()
+
+        self.assertEqual(self.bonuses(), [Decimal('20.00'), Decimal('0'), Decimal('20.00')])
+        self.assertEqual(BonusPayout.objects.filter(period_start=date(2025, 5, 1)).count(), 2)
+
+    def test_dry_run_does_not_write(self):
+        output = self.run_command('--dry-run')
+        self.assertIn('2 доставчика', output)
+        self.assertEqual(self.bonuses(), [Decimal('0')] * 3)
+        self.assertFalse(BonusPayout.objects.exists())
+
+    def test_query_count_does_not_depend_on_courier_count(self):
+        get_active_bonus_settings()
+        # Агрегираща заявка + (SAVEPOINT, заключване, изплатени, bulk INSERT на изплащанията
+        # и в журнала, RELEASE) за един chunk
+        with self.assertNumQueries(7):
+            self.run_command()
+
+    def test_overlapping_run_skips_couriers_paid_meanwhile(self):
+        """Паралелно изпълнение, платило част от групата, не води до IntegrityError."""
+        first, _, third = self.couriers
+        BonusPayout.objects.create(
+            delivery_person=first, period_start=date(2025, 5, 1), period_end=date(2025, 5, 31),
+            turnover=Decimal('150.00'), amount=Decimal('20.00'),
+        )
+        chunk = [
+            {'delivery_person_id': courier.pk, 'turnover': Decimal('150.00')} for courier in (first, third)
+        ]
+
+        credited = CalculateBonusesCommand().pay_chunk(chunk, date(2025, 5, 1), date(2025, 5, 31), Decimal('20.00'))
+        self.assertEqual(credited, 1)
+        self.assertEqual(
+            list(CourierLedgerEntry.objects.values_list('delivery_person_id', 'kind')), [(third.pk, 'bonus')],
+        )
+
+
+class CourierLedgerTests(TestCase):
+    """
+    Тестове за журнала на доставчиците и кешираните им суми.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        client_user = User.objects.create_user(username='client', password='secret', is_client=True)
+        cls.client_profile = Client.objects.create(user=client_user, address='адрес')
+        cls.couriers = []
+        for name in ('first', 'second'):
+            user = User.objects.create_user(username=name, password='secret', is_delivery_person=True)
+            cls.couriers.append(DeliveryPerson.objects.create(user=user, vehicle_type='bike'))
+
+    def setUp(self):
+        invalidate_bonus_settings()
+
+    def deliver(self, courier, total_price):
+        order = Order.objects.create(
+            client=self.client_profile, delivery_person=courier, total_price=total_price, status='shipped',
+        )
+        order.status = 'delivered'
+        order.save()
+        return order
+
+    def test_delivery_only_appends_to_ledger(self):
+        courier = self.couriers[0]
+        self.deliver(courier, Decimal('10.00'))
+
+        courier.refresh_from_db()
+        self.assertEqual(courier.total_turnover, Decimal('0'))
+        self.assertEqual(
+            list(CourierLedgerEntry.objects.values_list('kind', 'amount', 'applied')),
+            [('turnover', Decimal('10.00'), False)],
+        )
+
+    def test_refresh_applies_pending_entries_once(self):
+        first, second = self.couriers
+        self.deliver(first, Decimal('10.00'))
+        self.deliver(first, Decimal('2.50'))
+        self.deliver(second, Decimal('7.00'))
+
+        self.assertEqual(refresh_courier_totals(batch_size=2), 3)
+        self.assertEqual(refresh_courier_totals(), 0)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.total_turnover, Decimal('12.50'))
+        self.assertEqual(second.total_turnover, Decimal('7.00'))
+        self.assertEqual(courier_totals(first.pk)['turnover'], Decimal('12.50'))
+
+    def test_cancelling_delivered_order_appends_reversal(self):
+        courier = self.couriers[0]
+        order = self.deliver(courier, Decimal('10.00'))
+        order.status = 'cancelled'
+        order.save()
+
+        self.assertEqual(courier_totals(courier.pk)['turnover'], Decimal('0'))
+        self.assertEqual(CourierLedgerEntry.objects.filter(order=order).count(), 2)
+
+    def test_totals_read_only_unapplied_entries(self):
+        courier = self.couriers[0]
+        self.deliver(courier, Decimal('10.00'))
+        refresh_courier_totals()
+        self.deliver(courier, Decimal('4.00'))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(courier_totals(courier.pk), {'turnover': Decimal('14.00'), 'bonuses': Decimal('0')})
+        # Подзаявка само по неотчетените записи (частичният индекс), без JOIN към целия журнал
+        self.assertNotIn('JOIN', queries[0]['sql'])
+        self.assertIn('"applied"', queries[0]['sql'])
+
+    def test_admin_ledger_is_append_only(self):
+        courier = self.couriers[0]
+        order = self.deliver(courier, Decimal('10.00'))
+        refresh_courier_totals()
+        entry = CourierLedgerEntry.objects.get()
+        admin_user = User.objects.create_superuser(username='admin', password='secret')
+        self.client.force_login(admin_user)
+        changelist = reverse('admin:accounts_courierledgerentry_changelist')
+
+        response = self.client.post(
+            reverse('admin:accounts_courierledgerentry_change', args=[entry.pk]),
+            {'delivery_person': courier.pk, 'kind': 'turnover', 'amount': '99.00'},
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(
+            self.client.get(reverse('admin:accounts_courierledgerentry_delete', args=[entry.pk])).status_code, 403,
+        )
+        action_choices = self.client.get(changelist).context['action_form'].fields['action'].choices
+        self.assertNotIn('delete_selected', [name for name, _ in action_choices])
+
+        self.client.post(changelist, {'action': 'reverse_entries', '_selected_action': [entry.pk]})
+        reversal = CourierLedgerEntry.objects.exclude(pk=entry.pk).get()
+        self.assertEqual((reversal.amount, reversal.order_id, reversal.applied), (Decimal('-10.00'), order.pk, False))
+        self.assertEqual(courier_totals(courier.pk)['turnover'], Decimal('0'))
+
+    def test_run_workers_refreshes_cached_totals(self):
+        courier = self.couriers[0]
+        self.deliver(courier, Decimal('10.00'))
+
+        call_command('run_workers', '--once', stdout=StringIO())
+
+        courier = with_courier_totals(DeliveryPerson.objects.filter(pk=courier.pk)).get()
+        self.assertEqual(courier.total_turnover, Decimal('10.00'))
+        self.assertEqual(courier.current_turnover, Decimal('10.00'))
+        self.assertFalse(CourierLedgerEntry.objects.filter(applied=False).exists())
+
+    @override_settings(JOBS_EAGER=False)
+    def test_parallel_credits_are_serialized_per_courier(self):
+        courier = self.couriers[0]
+        DeliveryPerson.objects.filter(pk=courier.pk).update(total_turnover=Decimal('90.00'))
+        BonusSettings.objects.create(min_turnover=Decimal('100.00'), bonus_amount=Decimal('10.00'))
+        first = self.deliver(courier, Decimal('5.00'))
+        second = self.deliver(courier, Decimal('6.00'))
+
+        manager = DeliveryPerson.objects
+        with mock.patch.object(manager, 'select_for_update', wraps=manager.select_for_update) as lock:
+            run_pending_jobs()
+
+        # Всяка проверка на прага заключва реда на доставчика
+        self.assertEqual(lock.call_count, 2)
+        self.assertFalse(CourierLedgerEntry.objects.filter(order=first, kind='bonus').exists())
+        self.assertTrue(CourierLedgerEntry.objects.filter(order=second, kind='bonus').exists())
+        self.assertEqual(courier_totals(courier.pk), {'turnover': Decimal('101.00'), 'bonuses': Decimal('10.00')})
+
+
+class CatalogCacheTests(TestCase):
+    """
+    Тестове за кешираното меню по категории.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurant = Restaurant.objects.create(name='Ресторант', address='адрес')
+        cls.pizza = Product.objects.create(
+            restaurant=cls.restaurant, name='Маргарита', price=Decimal('9.50'), category='pizza',
+        )
+        Product.objects.create(restaurant=cls.restaurant, name='Вода', price=Decimal('1.00'), category='drink')
+
+    def setUp(self):
+        invalidate_catalog()
+
+    def test_cached_catalog_costs_no_queries(self):
+        rows = get_catalog('pizza')
+        self.assertEqual(
+            [(row['name'], row['restaurant_name'], row['category_display']) for row in rows],
+            [('Маргарита', 'Ресторант', 'Пица')],
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(get_catalog('pizza'), rows)
+            self.assertEqual(get_catalog('unknown'), [])
+
+    def test_product_and_restaurant_changes_invalidate_catalog(self):
+        self.assertEqual(len(get_catalog()), 2)
+
+        self.pizza.price = Decimal('10.00')
+        self.pizza.save()
+        self.assertEqual(get_catalog('pizza')[0]['price'], Decimal('10.00'))
+
+        self.restaurant.name = 'Нов ресторант'
+        self.restaurant.save()
+        self.assertEqual({row['restaurant_name'] for row in get_catalog()}, {'Нов ресторант'})
+
+        Product.objects.filter(category='drink').delete()
+        self.assertEqual([row['name'] for row in get_catalog()], ['Маргарита'])
+
+    def test_view_products_uses_cached_catalog(self):
+        user = User.objects.create_user(username='client', password='secret', is_client=True)
+        self.client.force_login(user)
+        get_catalog('pizza')
+
+        response = self.client.get(reverse('view_products'), {'category': 'pizza'})
+        self.assertContains(response, 'Маргарита (Ресторант)')
+        self.assertNotContains(response, 'Вода')
+
+
+class ProductSearchTests(TestCase):
+    """
+    Тестове за търсенето на продукти (индекс в паметта при SQLite).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        mama = Restaurant.objects.create(name='Мама Миа', address='адрес')
+        grill = Restaurant.objects.create(name='Скара Бар', address='адрес')
+        cls.margherita = Product.objects.create(
+            restaurant=mama, name='Пица Маргарита', description='Доматен сос и моцарела',
+            price=Decimal('9.50'), category='pizza',
+        )
+        cls.carbonara = Product.objects.create(
+            restaurant=mama, name='Паста Карбонара', description='Бекон и яйца',
+            price=Decimal('11.00'), category='pasta',
+        )
+        cls.kebapche = Product.objects.create(
+            restaurant=grill, name='Кебапче', description='Подходящо с паста',
+            price=Decimal('3.00'), category='salad',
+        )
+
+    def setUp(self):
+        invalidate_catalog()
+
+    def names(self, query, **kwargs):
+        return [row['name'] for row in search_products(query, **kwargs)]
+
+    def test_prefix_match_ranks_name_above_description(self):
+        self.assertEqual(self.names('марг'), ['Пица Маргарита'])
+        self.assertEqual(self.names('паст'), ['Паста Карбонара', 'Кебапче'])
+
+    def test_all_terms_must_match_across_fields(self):
+        self.assertEqual(self.names('мама паста'), ['Паста Карбонара'])
+        self.assertEqual(self.names('скара карбонара'), [])
+        self.assertEqual(self.names('мама', category='pizza'), ['Пица Маргарита'])
+
+    def test_typo_falls_back_to_trigram_similarity(self):
+        self.assertEqual(self.names('карбонра'), ['Паста Карбонара'])
+
+    def test_index_is_rebuilt_after_catalog_change(self):
+        self.assertEqual(self.names('лазаня'), [])
+        Product.objects.create(
+            restaurant=self.margherita.restaurant, name='Лазаня', price=Decimal('12.00'), category='pasta',
+        )
+        self.assertEqual(self.names('лазаня'), ['Лазаня'])
+
+    def test_search_endpoint_returns_ranked_json(self):
+        user = User.objects.create_user(username='client', password='secret', is_client=True)
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('product_search'), {'q': 'мама'})
+        results = response.json()['results']
+        self.assertEqual({row['name'] for row in results}, {'Пица Маргарита', 'Паста Карбонара'})
+        self.assertEqual(results[0]['restaurant'], 'Мама Миа')
+
+
+class JsonApiTests(TestCase):
+    """
+    Тестове за JSON API (избор на полета, ETag, курсорна пагинация).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='client', password='secret', is_client=True)
+        cls.client_profile = Client.objects.create(user=cls.client_user, address='адрес')
+        courier_user = User.objects.create_user(username='courier', password='secret', is_delivery_person=True)
+        cls.courier = DeliveryPerson.objects.create(user=courier_user, vehicle_type='bike')
+        restaurant = Restaurant.objects.create(name='Ресторант', address='адрес')
+        cls.products = [
+            Product.objects.create(
+                restaurant=restaurant, name=f'Продукт {i}', price=Decimal('2.50'), category='pizza',
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        invalidate_catalog()
+        invalidate_bonus_settings()
+
+    def post_json(self, name, data, args=()):
+        return self.client.post(reverse(name, args=args), json.dumps(data), content_type='application/json')
+
+    def test_requires_authentication_and_role(self):
+        self.assertEqual(self.client.get(reverse('api_products')).status_code, 401)
+        self.client.force_login(self.courier.user)
+        self.assertEqual(self.client.get(reverse('api_cart')).status_code, 403)
+
+    def test_products_field_selection_and_cursor(self):
+        self.client.force_login(self.client_user)
+        url = reverse('api_products')
+
+        first = self.client.get(url, {'fields': 'id,name', 'limit': 2}).json()
+        self.assertEqual(first['results'], [
+            {'id': self.products[0].pk, 'name': 'Продукт 0'},
+            {'id': self.products[1].pk, 'name': 'Продукт 1'},
+        ])
+        second = self.client.get(url, {'fields': 'id', 'limit': 2, 'cursor': first['next_cursor']}).json()
+        self.assertEqual(second, {'results': [{'id': self.products[2].pk}], 'next_cursor': None})
+
+        self.assertEqual(self.client.get(url, {'fields': 'id,secret'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cursor': 'broken'}).status_code, 400)
+
+    def test_conditional_get_returns_not_modified(self):
+        self.client.force_login(self.client_user)
+        response = self.client.get(reverse('api_products'))
+        etag = response['ETag']
+
+        cached = self.client.get(reverse('api_products'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+
+        self.products[0].price = Decimal('3.00')
+        self.products[0].save()
+        self.assertEqual(self.client.get(reverse('api_products'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_products_page_reads_only_the_page(self):
+        self.client.force_login(self.client_user)
+        url = reverse('api_products')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'limit': 1})
+        product_queries = [query['sql'] for query in queries if 'accounts_product' in query['sql']]
+        self.assertEqual(len(product_queries), 1)
+        self.assertIn('LIMIT 2', product_queries[0])
+
+        with mock.patch('accounts.api.get_catalog_page') as get_page:
+            cached = self.client.get(url, {'limit': 1}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        get_page.assert_not_called()
+
+    def test_checkout_without_client_profile_is_an_api_error(self):
+        user = User.objects.create_user(username='noprofile', password='secret', is_client=True)
+        self.client.force_login(user)
+        response = self.post_json('api_checkout', {'address': 'адрес', 'phone_number': '0888123456'})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('error', response.json())
+
+    def test_cart_checkout_and_order_status(self):
+        self.client.force_login(self.client_user)
+        product = self.products[0]
+        self.post_json('api_cart', {'product_id': product.pk, 'quantity': 2})
+        cart = self.post_json('api_cart', {'product_id': product.pk}).json()
+        self.assertEqual(cart['items'][0]['quantity'], 3)
+        self.assertEqual(Decimal(cart['total_price']), Decimal('7.50'))
+
+        response = self.post_json('api_checkout', {'address': 'ул. Тестова 1', 'phone_number': '0888123456'})
+        self.assertEqual(response.status_code, 201)
+        order_id = response.json()['id']
+        self.assertEqual(self.client.get(reverse('api_cart')).json()['items'], [])
+
+        detail = self.client.get(reverse('api_order_detail', args=[order_id]), {'fields': 'status,items'}).json()
+        self.assertEqual(detail['status'], 'pending')
+        self.assertEqual(detail['items'][0]['quantity'], 3)
+        self.assertEqual(self.post_json('api_checkout', {'address': 'адрес', 'phone_number': '0888123456'}).status_code, 409)
+
+    def test_courier_claims_and_delivers(self):
+        order = Order.objects.create(client=self.client_profile, total_price=Decimal('10.00'))
+        self.client.force_login(self.courier.user)
+
+        available = self.client.get(reverse('api_available_deliveries')).json()['results']
+        self.assertEqual([row['id'] for row in available], [order.pk])
+
+        self.assertEqual(self.post_json('api_accept_delivery', {}, args=[order.pk]).json()['status'], 'shipped')
+        self.assertEqual(self.post_json('api_accept_delivery', {}, args=[order.pk]).status_code, 409)
+        self.assertEqual(self.post_json('api_claim_next_delivery', {}).status_code, 204)
+
+        self.assertEqual(self.post_json('api_mark_delivered', {}, args=[order.pk]).json()['status'], 'delivered')
+        self.assertEqual(self.post_json('api_mark_delivered', {}, args=[order.pk]).status_code, 409)
+
+
+class OrderEventsTests(TestCase):
+    """
+    Тестове за известията в реално време при смяна на статуса.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        client_user = User.objects.create_user(username='client', password='secret', is_client=True)
+        cls.client_profile = Client.objects.create(user=client_user, address='адрес')
+        courier_user = User.objects.create_user(username='courier', password='secret', is_delivery_person=True)
+        cls.courier = DeliveryPerson.objects.create(user=courier_user, vehicle_type='bike')
+
+    def setUp(self):
+        invalidate_bonus_settings()
+
+    def test_local_broker_delivers_across_threads(self):
+        broker = LocalBroker()
+
+        async def receive():
+            subscription = broker.subscribe('user:1')
+            await asyncio.to_thread(broker.publish, 'user:1', {'type': 'order.status'})
+            message = await asyncio.wait_for(subscription.get(), timeout=1)
+            subscription.close()
+            return message
+
+        self.assertEqual(asyncio.run(receive()), {'type': 'order.status'})
+        self.assertEqual(broker.publish('user:1', {}), 0)
+
+    def test_redis_broker_delivers_across_processes(self):
+        """Съобщенията минават през Redis, а не през паметта на процеса."""
+
+        class FakeRedis:
+            def __init__(self):
+                self.messages = queue.Queue()
+
+            def publish(self, channel, data):
+                self.messages.put({'type': 'pmessage', 'channel': channel.encode(), 'data': data})
+                return 1
+
+            def pubsub(self, ignore_subscribe_messages=False):
+                return self
+
+            def psubscribe(self, pattern):
+                self.pattern = pattern
+
+            def listen(self):
+                while True:
+                    yield self.messages.get()
+
+        client = FakeRedis()
+        publisher, listener = RedisBroker(client=client), RedisBroker(client=client)
+
+        async def receive():
+            subscription = listener.subscribe('user:1')
+            await asyncio.to_thread(publisher.publish, 'user:1', {'type': 'order.status', 'total': Decimal('1.50')})
+            message = await asyncio.wait_for(subscription.get(), timeout=1)
+            subscription.close()
+            return message
+
+        self.assertEqual(asyncio.run(receive()), {'type': 'order.status', 'total': '1.50'})
+        self.assertEqual(client.pattern, user_channel('*'))
+
+    def test_status_changes_are_published_after_commit(self):
+        order = Order.objects.create(client=self.client_profile, total_price=Decimal('10.00'))
+        broker = mock.Mock()
+        with mock.patch('accounts.events.get_broker', return_value=broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                claim_order(order.pk, self.courier)
+            order.refresh_from_db()
+            with self.captureOnCommitCallbacks(execute=True):
+                order.status = 'delivered'
+                order.save()
+
+        published = [(call.args[0], call.args[1]['status']) for call in broker.publish.call_args_list]
+        self.assertEqual(sorted(published), sorted([
+            (user_channel(self.client_profile.pk), 'shipped'),
+            (user_channel(self.courier.pk), 'shipped'),
+            (user_channel(self.client_profile.pk), 'delivered'),
+            (user_channel(self.courier.pk), 'delivered'),
+        ]))
+
+    def test_event_stream_requires_login(self):
+        self.assertEqual(self.client.get(reverse('order_events')).status_code, 401)
+
+
+class SettingsCheckTests(SimpleTestCase):
+    """
+    Тестове за проверката на DEBUG при стартиране.
+    """
+
+    @override_settings(DEBUG=True, ALLOWED_HOSTS=['localhost', 'delivery.example.com'])
+    def test_debug_with_public_host_is_an_error(self):
+        errors = check_debug_with_production_hosts(None)
+        self.assertEqual([error.id for error in errors], ['accounts.E001'])
+        self.assertIn('delivery.example.com', errors[0].msg)
+
+    @override_settings(DEBUG=True, ALLOWED_HOSTS=['localhost', '127.0.0.1'])
+    def test_debug_with_local_hosts_is_allowed(self):
+        self.assertEqual(check_debug_with_production_hosts(None), [])
+
+    @override_settings(DEBUG=False, ALLOWED_HOSTS=['delivery.example.com'])
+    def test_production_without_debug_is_allowed(self):
+        self.assertEqual(check_debug_with_production_hosts(None), [])
+
+    def load_profile(self, module):
+        # Нов екземпляр на модула, без да се подменя заредения в sys.modules
+        spec = importlib.util.find_spec(module)
+        profile = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(profile)
+        return profile
+
+    def test_settings_profiles_refuse_debug_with_public_host(self):
+        environ = {
+            'DJANGO_DEBUG': '1',
+            'DJANGO_ALLOWED_HOSTS': 'localhost,delivery.example.com',
+            'DJANGO_SECRET_KEY': 'secret',
+        }
+        for module in ('FOOD_DELIVERY_WEB.settings.dev', 'FOOD_DELIVERY_WEB.settings.prod'):
+            with self.subTest(module=module), mock.patch.dict(os.environ, environ):
+                with self.assertRaisesMessage(ImproperlyConfigured, 'delivery.example.com'):
+                    self.load_profile(module)
+
+    def test_settings_profiles_allow_debug_with_local_hosts(self):
+        with mock.patch.dict(os.environ, {'DJANGO_DEBUG': '1', 'DJANGO_ALLOWED_HOSTS': 'localhost,127.0.0.1'}):
+            self.assertTrue(self.load_profile('FOOD_DELIVERY_WEB.settings.dev').DEBUG)
+
+
+class RequestMetricsTests(TestCase):
+    """
+    Тестове за метриките на заявките (Server-Timing, Prometheus, логване на SQL).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='client', password='secret', is_client=True)
+        cls.staff_user = User.objects.create_user(username='staff', password='secret', is_staff=True)
+
+    def setUp(self):
+        invalidate_catalog()
+
+    def test_server_timing_header_reports_queries_and_templates(self):
+        self.client.force_login(self.client_user)
+        response = self.client.get(reverse('view_products'))
+
+        timing = dict(
+            part.split(';', 1) for part in response['Server-Timing'].split(', ')
+        )
+        self.assertEqual(set(timing), {'db', 'tpl', 'total'})
+        self.assertRegex(timing['db'], r'desc="[1-9]\d* queries"')
+        self.assertNotEqual(timing['tpl'], 'dur=0.0')
+
+    def test_prometheus_endpoint_exposes_histograms(self):
+        self.client.force_login(self.client_user)
+        self.client.get(reverse('view_products'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+        self.client.force_login(self.staff_user)
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('# TYPE http_request_db_queries histogram', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="view_products",le="+Inf"}', body)
+        self.assertIn('http_requests_total{view="view_products",method="GET",status="200"}', body)
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_prometheus_endpoint_accepts_bearer_token(self):
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    @override_settings(METRICS_QUERY_LOG_THRESHOLD=1)
+    def test_requests_over_threshold_log_their_sql(self):
+        self.client.force_login(self.client_user)
+        with self.assertLogs('accounts.metrics', 'WARNING') as logs:
+            self.client.get(reverse('view_products'))
+        self.assertIn('view_products', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class LoadTestTests(TestCase):
+    """
+    Тестове за генератора на данни (seed_load_data) и бенчмарковете (run_benchmarks).
+    """
+
+    def setUp(self):
+        invalidate_catalog()
+        call_command(
+            'seed_load_data', '--restaurants', '2', '--products-per-restaurant', '5', '--clients', '3',
+            '--couriers', '2', '--orders', '60', '--years', '0.2', stdout=StringIO(),
+        )
+
+    def test_seed_generates_consistent_orders_and_rollups(self):
+        self.assertEqual(Restaurant.objects.filter(name__endswith=LOAD_RESTAURANT_TAG).count(), 2)
+        self.assertEqual(Product.objects.count(), 10)
+        self.assertEqual(Client.objects.count(), 3)
+        self.assertEqual(DeliveryPerson.objects.count(), 2)
+        self.assertEqual(Order.objects.count(), 60)
+
+        for order in Order.objects.prefetch_related('items'):
+            self.assertEqual(order.total_price, sum(item.price for item in order.items.all()))
+
+        delivered = Order.objects.filter(status='delivered')
+        self.assertEqual(
+            DailyTurnover.objects.aggregate(total=Sum('total_price'))['total'],
+            delivered.aggregate(total=Sum('total_price'))['total'],
+        )
+        for courier in DeliveryPerson.objects.all():
+            expected = delivered.filter(delivery_person=courier).aggregate(total=Sum('total_price'))['total']
+            self.assertEqual(courier_totals(courier.pk)['turnover'], expected or 0)
+
+    def test_seed_refuses_existing_data_unless_cleared(self):
+        with self.assertRaises(CommandError):
+            call_command('seed_load_data', '--orders', '1', stdout=StringIO())
+
+        call_command(
+            'seed_load_data', '--clear', '--restaurants', '1', '--products-per-restaurant', '2', '--clients', '1',
+            '--couriers', '1', '--orders', '5', stdout=StringIO(),
+        )
+        self.assertEqual(Order.objects.count(), 5)
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_benchmarks_write_results_and_fail_on_regression(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('run_benchmarks', '--rounds', '2', '--warmup', '0', '--output', output, stdout=StringIO())
+            with open(output, encoding='utf-8') as file:
+                results = json.load(file)
+            self.assertEqual([entry['name'] for entry in results['benchmarks']], list(BENCHMARKS))
+            self.assertTrue(all(entry['stats']['rounds'] == 2 for entry in results['benchmarks']))
+
+            # Предишен резултат с много по-бърза медиана и по-малко заявки
+            for entry in results['benchmarks']:
+                entry['stats']['median'] /= 100
+                entry['stats']['queries'] = 0
+            with open(output, 'w', encoding='utf-8') as file:
+                json.dump(results, file)
+            with self.assertRaisesMessage(CommandError, 'checkout'):
+                call_command(
+                    'run_benchmarks', '--rounds', '1', '--only', 'checkout', '--compare', output, stdout=StringIO(),
+                )
+
+
+class ReplicaRoutingTests(TestCase):
+    """
+    Тестове за насочването на справките към репликата и read-your-writes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='client', password='secret', is_client=True)
+        cls.staff_user = User.objects.create_user(username='staff', password='secret', is_staff=True)
+        restaurant = Restaurant.objects.create(name='Пицария', address='ул. Витоша 1')
+        cls.product = Product.objects.create(restaurant=restaurant, name='Маргарита', price=10, category='pizza')
+
+    def setUp(self):
+        invalidate_catalog()
+        patcher = mock.patch('accounts.routers.replica_alias', return_value='replica')
+        self.replica_alias = patcher.start()
+        self.addCleanup(patcher.stop)
+        middleware_patcher = mock.patch('accounts.middleware.replica_alias', new=self.replica_alias)
+        middleware_patcher.start()
+        self.addCleanup(middleware_patcher.stop)
+
+    def test_router_uses_replica_only_inside_replica_reads(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Order))
+        with use_replica():
+            self.assertEqual(router.db_for_read(Order), 'replica')
+            # След запис в същия блок четенията остават на основната база
+            self.assertEqual(router.db_for_write(Order), 'default')
+            self.assertIsNone(router.db_for_read(Order))
+        self.assertIsNone(router.db_for_read(Order))
+
+    def test_pinned_request_reads_from_primary(self):
+        router = ReplicaRouter()
+        with request_routing(pinned=True), use_replica():
+            self.assertIsNone(router.db_for_read(Order))
+
+    def test_write_sets_sticky_cookie(self):
+        self.client.force_login(self.client_user)
+        response = self.client.get(reverse('view_cart'))
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+        response = self.client.get(reverse('add_to_cart', args=[self.product.pk]))
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertGreater(float(response.cookies[STICKY_COOKIE].value), timezone.now().timestamp())
+
+    def test_reports_read_from_replica_unless_pinned(self):
+        # Репликата "сочи" към основната база, за да могат заявките да се изпълнят
+        self.replica_alias.return_value = 'default'
+        self.client.force_login(self.staff_user)
+        url = reverse('turnover_report')
+        params = {'start_date': '2025-01-01', 'end_date': '2025-01-31'}
+
+        self.assertEqual(self.client.get(url, params).status_code, 200)
+        self.assertTrue(self.replica_alias.called)
+
+        self.replica_alias.reset_mock()
+        self.client.cookies[STICKY_COOKIE] = str(timezone.now().timestamp() + 60)
+        self.assertEqual(self.client.get(url, params).status_code, 200)
+        self.assertFalse(self.replica_alias.called)
+
+
+class CartUpsertTests(TestCase):
+    """
+    Тестове за добавянето в количката с една заявка (upsert).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='client', password='secret', is_client=True)
+        restaurant = Restaurant.objects.create(name='Пицария', address='ул. Витоша 1')
+        cls.product = Product.objects.create(restaurant=restaurant, name='Маргарита', price=10, category='pizza')
+
+    def setUp(self):
+        invalidate_catalog()
+
+    def test_add_is_a_single_statement_that_accumulates_quantity(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(add_product_to_cart(self.user, self.product.pk, 2), (2, True))
+        with self.assertNumQueries(1):
+            self.assertEqual(add_product_to_cart(self.user, self.product.pk, 3), (5, False))
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 5)
+
+    def test_missing_product_and_invalid_quantity_are_rejected(self):
+        with self.assertRaises(Product.DoesNotExist):
+            add_product_to_cart(self.user, self.product.pk + 1000)
+        with self.assertRaises(ValueError):
+            add_product_to_cart(self.user, self.product.pk, 0)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_fallback_without_upsert_support(self):
+        with mock.patch('accounts.services.UPSERT_VENDORS', ()):
+            self.assertEqual(add_product_to_cart(self.user, self.product.pk), (1, True))
+            self.assertEqual(add_product_to_cart(self.user, self.product.pk, 2), (3, False))
+            with self.assertRaises(Product.DoesNotExist):
+                add_product_to_cart(self.user, self.product.pk + 1000)
+
+    def test_user_product_pair_is_unique(self):
+        CartItem.objects.create(user=self.user, product=self.product)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CartItem.objects.create(user=self.user, product=self.product)
+
+    def test_views_add_through_upsert(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('view_products'), {'product_id': self.product.pk, 'quantity': 2})
+        self.client.get(reverse('add_to_cart', args=[self.product.pk]))
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 3)
+
+        self.assertEqual(self.client.get(reverse('add_to_cart', args=[self.product.pk + 1000])).status_code, 404)
+        response = self.client.post(reverse('view_products'), {'product_id': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CART_BACKEND='accounts.cart.CacheCart')
+class CacheCartTests(TestCase):
+    """
+    Тестове за количката в кеша със запис в CartItem (write-behind).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='client', password='secret', is_client=True)
+        cls.client_profile = Client.objects.create(user=cls.user, address='ул. Шипка 5')
+        restaurant = Restaurant.objects.create(name='Пицария', address='ул. Витоша 1')
+        cls.pizza = Product.objects.create(restaurant=restaurant, name='Маргарита', price=Decimal('10.00'), category='pizza')
+        cls.drink = Product.objects.create(restaurant=restaurant, name='Лимонада', price=Decimal('3.50'), category='drink')
+
+    def setUp(self):
+        cache.clear()
+        invalidate_catalog()
+
+    def test_backend_is_selected_from_settings(self):
+        self.assertIsInstance(get_cart(self.user), CacheCart)
+        with self.settings(CART_BACKEND='accounts.cart.DatabaseCart'):
+            self.assertIsInstance(get_cart(self.user), DatabaseCart)
+
+    def test_cart_mutations_do_not_touch_the_database(self):
+        cart = get_cart(self.user)
+        cart.lines()  # Зарежда (празната) количка
+        get_catalog_products([self.pizza.pk, self.drink.pk])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(cart.add(self.pizza.pk, 2), (2, True))
+            self.assertEqual(cart.add(self.pizza.pk), (3, False))
+            cart.add(self.drink.pk)
+            self.assertTrue(cart.set_quantity(self.drink.pk, 2))
+            lines = get_cart(self.user).lines()
+        self.assertEqual([(line.name, line.quantity) for line in lines], [('Маргарита', 3), ('Лимонада', 2)])
+        self.assertEqual(cart.total(lines), Decimal('37.00'))
+        self.assertFalse(CartItem.objects.exists())
+
+        with self.assertRaises(Product.DoesNotExist):
+            cart.add(self.pizza.pk + 1000)
+
+    def test_lines_load_only_cart_products(self):
+        """Количката чете от кеша само своите продукти, а не цялото меню."""
+        cart = get_cart(self.user)
+        cart.add(self.pizza.pk)
+        invalidate_catalog()  # Нова версия на менюто - продуктът не е в кеша
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual([line.name for line in cart.lines()], ['Маргарита'])
+        self.assertEqual(len(queries), 1)
+        self.assertIn('IN', queries[0]['sql'])
+        with self.assertNumQueries(0):
+            cart.lines()
+        self.assertEqual(list(get_catalog_products([self.pizza.pk, 0])), [self.pizza.pk])
+
+    def test_checkout_persists_cart_and_creates_order(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('add_to_cart', args=[self.pizza.pk]))
+        self.client.get(reverse('add_to_cart', args=[self.drink.pk]))
+        self.client.get(reverse('remove_from_cart', args=[self.drink.pk]))
+        self.assertEqual(self.client.get(reverse('remove_from_cart', args=[self.drink.pk])).status_code, 404)
+        self.assertContains(self.client.get(reverse('view_cart')), 'Маргарита')
+
+        self.client.post(reverse('checkout'), {'address': 'ул. Шипка 5', 'phone_number': '0888123456'})
+        order = Order.objects.get()
+        self.assertEqual(order.total_price, Decimal('10.00'))
+        self.assertEqual(list(order.items.values_list('product_id', 'quantity')), [(self.pizza.pk, 1)])
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(get_cart(self.user).lines(), [])
+
+    def test_idle_carts_are_flushed_to_cart_items(self):
+        cart = get_cart(self.user)
+        cart.add(self.pizza.pk, 2)
+
+        # Активната количка не се записва, но остава в дневника
+        self.assertEqual(CacheCart.flush_idle(idle_seconds=3600), 0)
+        self.assertFalse(CartItem.objects.exists())
+
+        out = StringIO()
+        call_command('flush_carts', '--idle-seconds', '0', stdout=out)
+        self.assertIn('1', out.getvalue())
+        self.assertEqual(list(CartItem.objects.values_list('product_id', 'quantity')), [(self.pizza.pk, 2)])
+        self.assertEqual(CacheCart.flush_idle(idle_seconds=0), 0)
+
+        # Премахнатите продукти се изтриват от CartItem при следващия запис
+        cart.remove(self.pizza.pk)
+        cart.add(self.drink.pk)
+        self.assertEqual(CacheCart.flush_idle(idle_seconds=0), 1)
+        self.assertEqual(list(CartItem.objects.values_list('product_id', 'quantity')), [(self.drink.pk, 1)])
+
+    def test_cache_miss_loads_persisted_cart(self):
+        CartItem.objects.create(user=self.user, product=self.pizza, quantity=4)
+        self.assertEqual([(line.product_id, line.quantity) for line in get_cart(self.user).lines()], [(self.pizza.pk, 4)])
+
+    def test_busy_lock_rejects_changes(self):
+        cart = get_cart(self.user)
+        cart.add(self.pizza.pk)
+        cache.add(f'{cart.key}:lock', 1)  # Друга заявка държи ключалката
+
+        with mock.patch('accounts.cart.time.sleep'):
+            with self.assertRaises(CartBusyError):
+                cart.add(self.pizza.pk)
+            self.assertEqual(cart.lines()[0].quantity, 1)
+            self.assertEqual(CacheCart.flush_idle(idle_seconds=0), 0)
+
+            self.client.force_login(self.user)
+            response = self.client.post(
+                reverse('api_cart'), {'product_id': self.pizza.pk}, content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertTrue(cache.get(f'{cart.key}:lock'))  # Чуждата ключалка не е освободена
+
+        cache.delete(f'{cart.key}:lock')
+        self.assertEqual(CacheCart.flush_idle(idle_seconds=0), 1)  # Количката остава в дневника
+
+
+class CartSummaryTests(TestCase):
+    """
+    Тестове за обобщението на количката и кешираната значка.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='client', password='secret', is_client=True)
+        restaurant = Restaurant.objects.create(name='Пицария', address='ул. Витоша 1')
+        cls.pizza = Product.objects.create(restaurant=restaurant, name='Маргарита', price=Decimal('10.00'), category='pizza')
+        cls.drink = Product.objects.create(restaurant=restaurant, name='Лимонада', price=Decimal('3.50'), category='drink')
+
+    def setUp(self):
+        cache.clear()
+        invalidate_catalog()
+
+    def test_summary_is_a_single_query(self):
+        cart = DatabaseCart(self.user)
+        self.assertEqual(cart.summary(), ([], Decimal('0'), 0))
+        cart.add(self.pizza.pk, 2)
+        cart.add(self.drink.pk, 3)
+
+        with self.assertNumQueries(1):
+            summary = cart.summary()
+        self.assertEqual(
+            [(line.name, line.quantity, line.line_total, line.restaurant_name) for line in summary.lines],
+            [('Маргарита', 2, Decimal('20.00'), 'Пицария'), ('Лимонада', 3, Decimal('10.50'), 'Пицария')],
+        )
+        self.assertEqual(summary.total, Decimal('30.50'))
+        self.assertEqual(summary.item_count, 5)
+
+    def test_badge_is_cached_and_invalidated_on_changes(self):
+        cart = DatabaseCart(self.user)
+        cart.add(self.pizza.pk, 2)
+        self.assertEqual(get_cart_badge(self.user), {'count': 2, 'total': Decimal('20.00')})
+        with self.assertNumQueries(0):
+            get_cart_badge(self.user)
+
+        cart.add(self.drink.pk)
+        self.assertEqual(get_cart_badge(self.user), {'count': 3, 'total': Decimal('23.50')})
+        cart.set_quantity(self.drink.pk, 2)
+        self.assertEqual(get_cart_badge(self.user)['count'], 4)
+        cart.remove(self.pizza.pk)
+        self.assertEqual(get_cart_badge(self.user), {'count': 2, 'total': Decimal('7.00')})
+
+        # Промяна на цените в менюто обезсилва значката
+        Product.objects.filter(pk=self.drink.pk).update(price=Decimal('4.00'))
+        invalidate_catalog()
+        self.assertEqual(get_cart_badge(self.user)['total'], Decimal('8.00'))
+
+        cart.clear()
+        self.assertEqual(get_cart_badge(self.user), {'count': 0, 'total': Decimal('0')})
+
+    @override_settings(CART_BACKEND='accounts.cart.CacheCart')
+    def test_pages_show_badge_without_queries(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('add_to_cart', args=[self.pizza.pk]))
+        self.client.get(reverse('add_to_cart', args=[self.pizza.pk]))
+        self.assertContains(self.client.get(reverse('client_dashboard')), '(2 бр., 20.00 лв.)')
+
+        # Сесия и потребител; значката идва от кеша
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('client_dashboard'))
+        self.assertContains(response, '(2 бр., 20.00 лв.)')
+
+        response = self.client.get(reverse('view_cart'))
+        self.assertContains(response, 'Общо 2 бр., обща цена: 20.00 лв.')
+
+
+class OrderBuilderTests(TestCase):
+    """
+    Тестове за създаването на поръчка от менюто на един ресторант.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='client', password='secret', is_client=True)
+        Client.objects.create(user=cls.user, address='ул. Шипка 5')
+        cls.restaurant = Restaurant.objects.create(name='Пицария', address='ул. Витоша 1')
+        cls.other = Restaurant.objects.create(name='Бистро', address='ул. Раковски 2')
+        cls.products = Product.objects.bulk_create([
+            Product(restaurant=cls.restaurant, name=f'Пица {i}', price=Decimal('5.00') + i, category='pizza')
+            for i in range(OrderBuilderForm.MAX_LINES + 10)
+        ])
+        cls.foreign = Product.objects.create(restaurant=cls.other, name='Супа', price=Decimal('4.00'), category='soup')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.url = reverse('create_order')
+
+    def test_pages_are_bounded(self):
+        response = self.client.get(self.url)
+        self.assertEqual([r.name for r in response.context['restaurants']], ['Бистро', 'Пицария'])
+
+        response = self.client.get(self.url, {'restaurant': self.restaurant.pk})
+        self.assertEqual(len(response.context['products']), OrderBuilderForm.MAX_LINES)
+        self.assertTrue(response.context['page'].has_next)
+        self.assertNotContains(response, 'Супа')
+
+        response = self.client.get(
+            self.url, {'restaurant': self.restaurant.pk, 'cursor': response.context['page'].next_cursor},
+        )
+        self.assertEqual(len(response.context['products']), 10)
+        self.assertEqual(self.client.get(self.url, {'restaurant': 'x'}).status_code, 404)
+
+    def test_creates_order_with_fixed_number_of_queries(self):
+        data = {'address': 'ул. Шипка 5', 'phone_number': '0888123456'}
+        data.update({f'quantity_{product.pk}': 2 for product in self.products[:20]})
+        data[f'quantity_{self.products[20].pk}'] = '0'
+        url = f'{self.url}?restaurant={self.restaurant.pk}'
+
+        # Сесия, потребител, ресторант, клиент, продукти (id__in), поръчка, редове (bulk)
+        with self.assertNumQueries(7):
+            response = self.client.post(url, data)
+        self.assertRedirects(response, reverse('track_orders'))
+
+        order = Order.objects.get()
+        self.assertEqual(order.items.count(), 20)
+        self.assertEqual(order.total_price, sum(((Decimal('5.00') + i) * 2 for i in range(20)), Decimal('0')))
+        self.assertEqual(order.address, 'ул. Шипка 5')
+
+    def test_rejects_products_from_other_restaurants(self):
+        url = f'{self.url}?restaurant={self.restaurant.pk}'
+        data = {'address': 'ул. Шипка 5', 'phone_number': '0888123456'}
+
+        response = self.client.post(url, {**data, f'quantity_{self.foreign.pk}': 1})
+        self.assertContains(response, 'не са в менюто на ресторанта')
+        response = self.client.post(url, data)
+        self.assertContains(response, 'Изберете поне един продукт')
+        self.assertFalse(Order.objects.exists())
+
+    def test_rejects_quantities_above_limit(self):
+        url = f'{self.url}?restaurant={self.restaurant.pk}'
+        data = {'address': 'ул. Шипка 5', 'phone_number': '0888123456'}
+        product = self.products[0]
+
+        for quantity in (OrderBuilderForm.MAX_QUANTITY + 1, 10 ** 20):
+            response = self.client.post(url, {**data, f'quantity_{product.pk}': quantity})
+            self.assertContains(response, f'най-много {OrderBuilderForm.MAX_QUANTITY}')
+        self.assertFalse(Order.objects.exists())
+
+        response = self.client.post(url, {**data, f'quantity_{product.pk}': OrderBuilderForm.MAX_QUANTITY})
+        self.assertRedirects(response, reverse('track_orders'))
+
+    def test_quantities_are_carried_across_pages(self):
+        url = f'{self.url}?restaurant={self.restaurant.pk}'
+        first, last = self.products[0], self.products[-1]
+        data = {'address': 'ул. Шипка 5', 'phone_number': '0888123456', 'category': '', 'page_cursor': ''}
+        next_cursor = self.client.get(url).context['page'].next_cursor
+
+        response = self.client.post(url, {**data, f'quantity_{first.pk}': 2, 'cursor': next_cursor})
+        self.assertEqual(len(response.context['products']), 10)
+        self.assertEqual(response.context['carried_quantities'], [(first.pk, '2')])
+        self.assertContains(response, f'<input type="hidden" name="quantity_{first.pk}" value="2">', html=True)
+        self.assertFalse(Order.objects.exists())
+
+        response = self.client.post(url, {**data, f'quantity_{first.pk}': 2, f'quantity_{last.pk}': 1})
+        self.assertRedirects(response, reverse('track_orders'))
+        self.assertEqual(
+            sorted(Order.objects.get().items.values_list('product_id', 'quantity')),
+            [(first.pk, 2), (last.pk, 1)],
+        )
+
+    def test_invalid_submission_keeps_entered_quantities(self):
+        url = f'{self.url}?restaurant={self.restaurant.pk}'
+        product = self.products[1]
+
+        response = self.client.post(url, {'address': '', 'phone_number': '0888', f'quantity_{product.pk}': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn((product, '3'), response.context['product_rows'])
+        self.assertContains(response, f'name="quantity_{product.pk}" value="3"')
+
+
+@override_settings(JOBS_EAGER=False)
+class JobQueueTests(TestCase):
+    """
+    Тестове за фоновите задачи в базата (accounts.jobs).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        client_user = User.objects.create_user(
+            username='client', password='secret', email='client@example.com', is_client=True,
+        )
+        cls.client_profile = Client.objects.create(user=client_user, address='адрес')
+        courier_user = User.objects.create_user(username='courier', password='secret', is_delivery_person=True)
+        cls.courier = DeliveryPerson.objects.create(user=courier_user, vehicle_type='bike')
+        BonusSettings.objects.create(min_turnover=Decimal('10.00'), bonus_amount=Decimal('5.00'))
+
+    def setUp(self):
+        invalidate_bonus_settings()
+
+    def deliver(self):
+        order = Order.objects.create(
+            client=self.client_profile, delivery_person=self.courier, total_price=Decimal('20.00'), status='shipped',
+        )
+        order.status = 'delivered'
+        order.save()
+        return order
+
+    def test_delivery_side_effects_run_in_worker(self):
+        self.deliver()
+        self.assertEqual(
+            sorted(Job.objects.values_list('name', flat=True)),
+            ['ledger.credit_delivery', 'orders.notify_status', 'rollup.apply'],
+        )
+        self.assertFalse(CourierLedgerEntry.objects.exists())
+
+        call_command('run_workers', '--once', stdout=StringIO())
+
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(courier_totals(self.courier.pk), {'turnover': Decimal('20.00'), 'bonuses': Decimal('5.00')})
+        today = timezone.localdate()
+        self.assertEqual(turnover_totals(today, today), {'total': Decimal('20.00'), 'order_count': 1})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['client@example.com'])
+
+    def test_rollback_discards_jobs(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.deliver()
+                raise RuntimeError
+        self.assertFalse(Job.objects.exists())
+
+    def test_failed_job_is_retried_with_backoff(self):
+        def flaky(order_id):
+            # Ефектите на неуспешния опит се отменят
+            CourierLedgerEntry.objects.create(delivery_person=self.courier, kind='bonus', amount=1)
+            raise ValueError("временна грешка")
+
+        with mock.patch.dict(JOBS, {'tests.flaky': JobSpec(flaky, 2)}):
+            job = enqueue('tests.flaky', order_id=1)
+            with self.assertLogs('accounts.jobs', 'WARNING'):
+                self.assertTrue(run_next_job())
+
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('queued', 1))
+            self.assertIn('временна грешка', job.last_error)
+            self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=5))
+            self.assertEqual(run_pending_jobs(), 0)  # Още не е време за повторен опит
+
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+            with self.assertLogs('accounts.jobs', 'ERROR'):
+                self.assertEqual(run_pending_jobs(), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('failed', 2))
+            self.assertEqual(run_pending_jobs(), 0)
+
+        self.assertFalse(CourierLedgerEntry.objects.exists())
+
+    def test_non_transactional_job_runs_after_lease(self):
+        leases = []
+
+        def send(order_id):
+            # Задачата вече е наета - друг worker не би я взел
+            leases.append(Job.objects.get(name='tests.send').run_at)
+            raise ValueError("SMTP грешка")
+
+        with mock.patch.dict(JOBS, {'tests.send': JobSpec(send, 1, transactional=False)}):
+            job = enqueue('tests.send', order_id=1)
+            with self.assertLogs('accounts.jobs', 'ERROR'):
+                self.assertTrue(run_next_job())
+
+        self.assertGreater(leases[0], timezone.now() + timedelta(seconds=60))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+        self.assertIn('SMTP грешка', job.last_error)
+
+    @override_settings(JOBS_FAILED_RETENTION=7)
+    def test_purge_removes_old_failed_jobs(self):
+        old = Job.objects.create(name='tests.old', status='failed', run_at=timezone.now() - timedelta(days=8))
+        recent = Job.objects.create(name='tests.recent', status='failed', run_at=timezone.now() - timedelta(days=1))
+        queued = Job.objects.create(name='tests.queued', run_at=timezone.now() - timedelta(days=8))
+
+        self.assertEqual(purge_failed_jobs(), 1)
+        self.assertEqual(set(Job.objects.values_list('pk', flat=True)), {recent.pk, queued.pk})
+        self.assertFalse(Job.objects.filter(pk=old.pk).exists())
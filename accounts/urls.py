@@ -29,6 +29,7 @@ URL Маршрути:
         * /edit-product/<int:pk>/ - Редактиране на продукт
         * /delete-product/<int:pk>/ - Изтриване на продукт
         * /view-products/ - Преглед на всички продукти
+        * /search-products/ - Търсене на продукти (JSON)
     
     - Управление на поръчки:
         * /create-order/ - Създаване на нова поръчка
@@ -37,16 +38,26 @@ URL Маршрути:
         * /view-cart/ - Преглед на кошницата
         * /checkout/ - Плащане на поръчката
         * /track-orders/ - Преглед на състоянието на поръчките
+        * /order-events/ - Смени на статуса в реално време (Server-Sent Events, през ASGI)
 
     - Доставки:
         * /delivery-dashboard/ - Дашборд за доставчици
         * /accept-delivery/<int:pk>/ - Приемане на доставка
+        * /claim-next-delivery/ - Получаване на най-старата свободна поръчка
         * /mark-as-delivered/<int:pk>/ - Маркиране на поръчка като доставена
 
     - Отчети:
         * /turnover-report/ - Отчет за оборота
         * /generate-turnover-report/ - Генериране на отчет за оборота
-        * /earnings-report/ - Отчет за печалбите
+        * /earnings-report/<int:delivery_person_id>/ - Отчет за печалбите на доставчик
+        * /metrics/ - Метрики на заявките във формат на Prometheus
+
+    - JSON API (accounts.api):
+        * /api/products/ - Каталог и търсене
+        * /api/cart/, /api/cart/<int:pk>/ - Количка
+        * /api/checkout/ - Финализиране на поръчка
+        * /api/orders/, /api/orders/<int:pk>/ - Поръчки на клиента
+        * /api/deliveries/... - Свободни и активни поръчки, приемане и доставка
 
 Всички URL адреси са именувани (чрез параметъра 'name') за възможност за обратно разрешаване на URL адреси в шаблони и view функции, използвайки:
     - {% url %} template tag
@@ -57,7 +68,7 @@ URL Маршрути:
 """
 
 from django.urls import path
-from . import views
+from . import api, metrics, views
 
 urlpatterns = [
     # Основни маршрути
@@ -84,6 +95,7 @@ urlpatterns = [
     path('edit-product/<int:pk>/', views.edit_product, name='edit_product'),
     path('delete-product/<int:pk>/', views.delete_product, name='delete_product'),
     path('view-products/', views.view_products, name='view_products'),
+    path('search-products/', views.product_search, name='product_search'),
 
     # Управление на поръчки
     path('create-order/', views.create_order, name='create_order'),
@@ -92,14 +104,30 @@ urlpatterns = [
     path('remove-from-cart/<int:pk>/', views.remove_from_cart, name='remove_from_cart'),
     path('checkout/', views.checkout, name='checkout'),
     path('track-orders/', views.track_orders, name='track_orders'),
+    path('order-events/', views.order_events, name='order_events'),
 
     # Доставки
     path('delivery-dashboard/', views.delivery_dashboard, name='delivery_dashboard'),
     path('accept-delivery/<int:pk>/', views.accept_delivery, name='accept_delivery'),
+    path('claim-next-delivery/', views.claim_next_delivery, name='claim_next_delivery'),
     path('mark-as-delivered/<int:pk>/', views.mark_as_delivered, name='mark_as_delivered'),
 
     # Отчети
     path('turnover-report/', views.turnover_report, name='turnover_report'),
     path('generate-turnover-report/', views.generate_turnover_report, name='generate_turnover_report'),
-    path('earnings-report/', views.earnings_report, name='earnings_report'),
+    path('earnings-report/<int:delivery_person_id>/', views.earnings_report, name='earnings_report'),
+    path('metrics/', metrics.metrics_view, name='metrics'),
+
+    # JSON API
+    path('api/products/', api.products, name='api_products'),
+    path('api/cart/', api.cart, name='api_cart'),
+    path('api/cart/<int:pk>/', api.cart_item, name='api_cart_item'),
+    path('api/checkout/', api.checkout, name='api_checkout'),
+    path('api/orders/', api.orders, name='api_orders'),
+    path('api/orders/<int:pk>/', api.order_detail, name='api_order_detail'),
+    path('api/deliveries/available/', api.available_deliveries, name='api_available_deliveries'),
+    path('api/deliveries/mine/', api.my_deliveries, name='api_my_deliveries'),
+    path('api/deliveries/claim-next/', api.claim_next_delivery, name='api_claim_next_delivery'),
+    path('api/deliveries/<int:pk>/accept/', api.accept_delivery, name='api_accept_delivery'),
+    path('api/deliveries/<int:pk>/delivered/', api.mark_delivered, name='api_mark_delivered'),
 ]
@@ -7,9 +7,31 @@ from .forms import CustomUserCreationForm, CheckoutForm
 from django.shortcuts import render, get_object_or_404, redirect
 from .forms import RestaurantForm, ProductForm
 from .models import Restaurant, Product
-from .forms import OrderForm
-from django.db.models import Sum
+from .forms import OrderBuilderForm
+from .cache import get_catalog
+from .cart import CartBusyError, get_cart
+from .dispatch import claim_next_order, claim_order
+from .events import get_broker, user_channel
+from .ledger import courier_totals
+from .pagination import InvalidCursor, keyset_paginate
+from .rollups import turnover_by_day
+from .routers import replica_reads
+from .search import SEARCH_LIMIT, search_products
+from .services import EmptyCartError, place_order
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from datetime import datetime
+import asyncio
+import json
+
+# Брой поръчки на страница в историята на клиента
+ORDER_HISTORY_PAGE_SIZE = 20
+
+# Брой ресторанти и продукти на страница при създаване на поръчка
+ORDER_BUILDER_PAGE_SIZE = OrderBuilderForm.MAX_LINES
+
+# През колко секунди потокът със събития изпраща празен коментар (keep-alive)
+EVENTS_KEEPALIVE = 15
 
 # Create your views here.
 
@@ -222,6 +244,7 @@ def client_dashboard(request):
     return render(request, 'accounts/client_dashboard.html')
 
 @login_required
+@replica_reads
 def employee_dashboard(request):
 
     if not request.user.is_employee:
@@ -263,6 +286,7 @@ def delivery_person_dashboard(request):
     """
     return render(request, 'accounts/delivery_person_dashboard.html')
 
+@replica_reads
 def delivery_dashboard(request):
     """
     Показва табло за доставчици с активни поръчки.
@@ -273,7 +297,10 @@ def delivery_dashboard(request):
     Returns:
         HttpResponse: Рендерира шаблона 'accounts/delivery_dashboard.html' с активните поръчки.
     """
-    active_orders = Order.objects.filter(delivery_person=request.user.deliveryperson, status='shipped')
+    active_orders = (
+        Order.objects.filter(delivery_person=request.user.deliveryperson, status='shipped')
+        .prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+    )
     return render(request, 'accounts/delivery_dashboard.html', {'orders': active_orders})
 
 @login_required
@@ -383,31 +410,108 @@ def view_products(request):
     if not request.user.is_client:
         return redirect('home')  # Само клиенти могат да правят поръчки
 
-    category = request.GET.get('category')
-    if category:
-        products = Product.objects.filter(category=category)
+    # Менюто идва от кеша (accounts.cache) - без заявки към базата
+    query = request.GET.get('q', '').strip()
+    if query:
+        products = search_products(query, category=request.GET.get('category'))
     else:
-        products = Product.objects.all()
+        products = get_catalog(request.GET.get('category'))
 
     categories = Product.CATEGORY_CHOICES  # Всички налични категории
 
     if request.method == 'POST':
-        product_id = request.POST.get('product_id')
-        quantity = int(request.POST.get('quantity', 1))
-        product = get_object_or_404(Product, pk=product_id)
-
-        # Добавяне или актуализиране на продукта в количката
-        cart_item, created = CartItem.objects.get_or_create(user=request.user, product=product)
-        if created:
-            cart_item.quantity = quantity  # Ако е нов запис, задаваме количеството
-        else:
-            cart_item.quantity += quantity  # Ако вече съществува, увеличаваме количеството
-        cart_item.save()
+        try:
+            product_id = int(request.POST.get('product_id'))
+            quantity = max(int(request.POST.get('quantity', 1)), 1)
+        except (TypeError, ValueError):
+            raise Http404("Невалиден продукт или количество.")
+
+        # Добавяне или увеличаване на количеството (accounts.cart)
+        try:
+            get_cart(request.user).add(product_id, quantity)
+        except Product.DoesNotExist:
+            raise Http404("Продуктът не е намерен.")
+        except CartBusyError as exc:
+            messages.error(request, str(exc))
 
         return redirect('view_products')
 
     return render(request, 'accounts/view_products.html', {'products': products, 'categories': categories})
 
+@login_required
+def product_search(request):
+    """
+    Търсене на продукти по име, описание и ресторант (JSON).
+
+    Параметри на заявката:
+        q: Текст за търсене (всяка дума се търси и като префикс).
+        category: Ограничаване до категория (по избор).
+        limit: Максимален брой резултати (до SEARCH_LIMIT).
+
+    Args:
+        request: HttpRequest обект.
+
+    Returns:
+        JsonResponse: {'results': [...]} с продуктите, подредени по релевантност.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', SEARCH_LIMIT)), SEARCH_LIMIT)
+    except ValueError:
+        limit = SEARCH_LIMIT
+
+    results = search_products(query, category=request.GET.get('category'), limit=max(limit, 1)) if query else []
+    return JsonResponse({
+        'results': [
+            {
+                'id': row['id'],
+                'name': row['name'],
+                'price': str(row['price']),
+                'category': row['category'],
+                'restaurant': row['restaurant_name'],
+                'rank': round(float(row['rank']), 4),
+            }
+            for row in results
+        ],
+    })
+
+async def order_events(request):
+    """
+    Поток от Server-Sent Events със смените на статуса на поръчките на потребителя.
+
+    Обслужва се от ASGI приложението (FOOD_DELIVERY_WEB.asgi); всяко събитие
+    "order.status" съдържа order_id, status и previous_status като JSON.
+
+    Args:
+        request: HttpRequest обект.
+
+    Returns:
+        StreamingHttpResponse: Безкраен text/event-stream отговор (401 без вход).
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+
+    subscription = get_broker().subscribe(user_channel(user.pk))
+
+    async def stream():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.get(), timeout=EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # без буфериране в nginx
+    return response
+
 @login_required
 def accept_delivery(request, pk):
     """
@@ -420,81 +524,125 @@ def accept_delivery(request, pk):
     Returns:
         HttpResponse: Пренасочва към дашборда за доставчици със съобщение за статуса.
     """
-    order = get_object_or_404(Order, pk=pk)
+    get_object_or_404(Order, pk=pk)
 
-    # Проверка дали поръчката е вече взета от доставчик
-    if order.delivery_person is not None:
+    # Поръчката се заявява атомарно - само един доставчик може да я вземе
+    if not claim_order(pk, request.user.deliveryperson):
         messages.error(request, "Тази поръчка вече е взета.")
         return redirect('delivery_dashboard')
 
-    # Задаване на текущия доставчик като доставчик на поръчката
-    delivery_person = request.user.deliveryperson  # Предполагаме, че доставчикът е логнат
-    order.delivery_person = delivery_person
-    order.status = 'shipped'
-    order.save()
+    messages.success(request, "Успешно сте взели поръчка.")
+    return redirect('delivery_dashboard')
 
-    # Актуализиране на оборота на доставчика
-    delivery_person.total_turnover += order.total_price
-    delivery_person.save()
+@login_required
+def claim_next_delivery(request):
+    """
+    Дава на доставчика най-старата свободна чакаща поръчка.
 
-    messages.success(request, "Успешно сте взели поръчка.")
+    Args:
+        request: HttpRequest обект.
+
+    Returns:
+        HttpResponse: Пренасочва към дашборда за доставчици със съобщение за резултата.
+    """
+    if not request.user.is_delivery_person or request.method != 'POST':
+        return redirect('home')
+
+    order = claim_next_order(request.user.deliveryperson)
+    if order is None:
+        messages.info(request, "В момента няма свободни поръчки.")
+    else:
+        messages.success(request, f"Получихте поръчка #{order.pk}.")
     return redirect('delivery_dashboard')
 
+def _keyset_page(queryset, cursor, ordering):
+    # Невалиден курсор връща първата страница
+    try:
+        return keyset_paginate(queryset, cursor, page_size=ORDER_BUILDER_PAGE_SIZE, ordering=ordering)
+    except InvalidCursor:
+        return keyset_paginate(queryset, page_size=ORDER_BUILDER_PAGE_SIZE, ordering=ordering)
+
 @login_required
 def create_order(request):
     """
-    Създава нова поръчка от клиент.
+    Създава нова поръчка от клиент директно от менюто на един ресторант.
+
+    Без параметър `restaurant` показва страница с ресторанти; с него -
+    страница с продуктите на ресторанта (по избор от една категория) и
+    форма за количествата и данните за доставка. Страниците се взимат с
+    keyset пагинация, така че размерът им не зависи от броя на продуктите.
+    Смяната на страницата или категорията изпраща формата (бутон с име
+    `cursor`), а количествата от другите страници се пренасят в скрити полета.
 
     Args:
         request: HttpRequest обект.
 
     Returns:
         HttpResponse: Пренасочва към 'home' при неоторизиран достъп.
-        HttpResponse: Рендерира форма за създаване на поръчка или пренасочва към плащане.
+        HttpResponse: Рендерира избора на ресторант или продукти, или пренасочва
+            към историята на поръчките след успешна поръчка.
     """
     if not request.user.is_client:
         return redirect('home')  # Само клиенти могат да правят поръчки
 
-    # Филтриране на продукти според категорията
-    category = request.GET.get('category')
-    if category:
-        products = Product.objects.filter(category=category)
-    else:
-        products = Product.objects.all()
+    cursor = request.GET.get('cursor')
+    restaurant_id = request.GET.get('restaurant')
+    if not restaurant_id:
+        page = _keyset_page(Restaurant.objects.only('id', 'name', 'address'), cursor, ('name', 'id'))
+        return render(request, 'accounts/create_order.html', {'restaurants': page.object_list, 'page': page})
 
-    categories = Product.CATEGORY_CHOICES  # Всички налични категории
+    if not restaurant_id.isdigit():
+        raise Http404("Ресторантът не е намерен.")
+    restaurant = get_object_or_404(Restaurant, pk=restaurant_id)
+    client = Client.objects.get(user=request.user)
 
+    submitted = {}
+    category = request.GET.get('category')
     if request.method == 'POST':
-        form = OrderForm(request.POST)
-        if form.is_valid():
-            order = form.save(commit=False)
-            order.client = Client.objects.get(user=request.user)
-
-            # Изчисляване на общата цена на поръчката
-            total_price = 0
-            for item in form.cleaned_data['items']:
-                quantity = int(request.POST.get(f'quantity_{item.id}', 1))  # Вземаме количеството от заявката
-                price = item.price * quantity
-                total_price += price
-
-            order.total_price = total_price
-            order.save()
-
-            # Създаване на OrderItem записи
-            for item in form.cleaned_data['items']:
-                quantity = int(request.POST.get(f'quantity_{item.id}', 1))
-                OrderItem.objects.create(
-                    order=order,
-                    product=item,
-                    quantity=quantity,
-                    price=item.price * quantity
-                )
-
-            # Пренасочване към страницата за финализиране на поръчка
-            return redirect('checkout', order_id=order.pk)
+        form = OrderBuilderForm(restaurant, request.POST)
+        # Въведените количества се пренасят между страниците и при грешка
+        submitted = form.submitted_quantities()
+        category = request.POST.get('category')
+        if 'cursor' in request.POST:
+            # Смяна на страницата или категорията, без поръчка
+            cursor = request.POST['cursor']
+            form = OrderBuilderForm(restaurant, initial={
+                'address': request.POST.get('address', ''),
+                'phone_number': request.POST.get('phone_number', ''),
+            })
+        elif form.is_valid():
+            # Цените са прочетени при проверката; редовете се създават с един INSERT
+            place_order(
+                client,
+                form.cleaned_data['lines'],
+                form.cleaned_data['address'],
+                form.cleaned_data['phone_number'],
+            )
+            messages.success(request, "Поръчката е създадена.")
+            return redirect('track_orders')
+        else:
+            cursor = request.POST.get('page_cursor')
     else:
-        form = OrderForm()
-    return render(request, 'accounts/create_order.html', {'form': form, 'products': products, 'categories': categories})
+        form = OrderBuilderForm(restaurant, initial={'address': client.address})
+
+    # Продукти от менюто на ресторанта (по избор от една категория)
+    products = Product.objects.filter(restaurant=restaurant).only('id', 'name', 'price', 'category')
+    if category:
+        products = products.filter(category=category)
+    page = _keyset_page(products, cursor, ('id',))
+    shown = {product.id for product in page}
+
+    return render(request, 'accounts/create_order.html', {
+        'restaurant': restaurant,
+        'products': page.object_list,
+        'product_rows': [(product, submitted.get(product.id, 0)) for product in page],
+        'carried_quantities': [(pk, value) for pk, value in submitted.items() if pk not in shown],
+        'page': page,
+        'page_cursor': cursor or '',
+        'category': category or '',
+        'form': form,
+        'categories': Product.CATEGORY_CHOICES,
+    })
 
 @login_required
 def mark_as_delivered(request, pk):
@@ -536,11 +684,12 @@ def add_to_cart(request, pk):
     """
     if not request.user.is_client:
         return redirect('home')  # Само клиенти могат да добавят продукти в количката
-    product = get_object_or_404(Product, pk=pk)
-    cart_item, created = CartItem.objects.get_or_create(user=request.user, product=product)
-    if not created:
-        cart_item.quantity += 1
-        cart_item.save()
+    try:
+        get_cart(request.user).add(pk)
+    except Product.DoesNotExist:
+        raise Http404("Продуктът не е намерен.")
+    except CartBusyError as exc:
+        messages.error(request, str(exc))
     return redirect('view_products')
 
 @login_required
@@ -557,9 +706,12 @@ def view_cart(request):
     """
     if not request.user.is_client:
         return redirect('home')  # Само клиенти могат да правят поръчки
-    cart_items = CartItem.objects.filter(user=request.user)
-    total_price = sum(item.product.price * item.quantity for item in cart_items)
-    return render(request, 'accounts/view_cart.html', {'cart_items': cart_items, 'total_price': total_price})
+    summary = get_cart(request.user).summary()
+    return render(request, 'accounts/view_cart.html', {
+        'cart_items': summary.lines,
+        'total_price': summary.total,
+        'item_count': summary.item_count,
+    })
 
 @login_required
 def remove_from_cart(request, pk):
@@ -575,8 +727,13 @@ def remove_from_cart(request, pk):
     """
     if not request.user.is_client:
         return redirect('home')  # Само клиенти могат да премахват продукти от количката
-    cart_item = get_object_or_404(CartItem, pk=pk, user=request.user)
-    cart_item.delete()
+    try:
+        removed = get_cart(request.user).remove(pk)
+    except CartBusyError as exc:
+        messages.error(request, str(exc))
+        return redirect('view_cart')
+    if not removed:
+        raise Http404("Продуктът не е в количката.")
     return redirect('view_cart')
 
 @login_required
@@ -595,30 +752,23 @@ def checkout(request):
         return redirect('home')  # Само клиенти могат да правят поръчки
 
     client = Client.objects.get(user=request.user)
-    cart_items = CartItem.objects.filter(user=request.user)
 
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
         if form.is_valid():
-            address = form.cleaned_data['address']
-            phone_number = form.cleaned_data['phone_number']
-
-            # Създаване на поръчка
-            order = Order.objects.create(
-                client=client,
-                total_price=sum(item.product.price * item.quantity for item in cart_items),
-                status='pending',
-                address=address,
-                phone_number=phone_number
-            )
-            for item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item.product,
-                    quantity=item.quantity,
-                    price=item.product.price * item.quantity
+            try:
+                # Създаване на поръчка с фиксиран брой заявки
+                get_cart(request.user).checkout(
+                    client=client,
+                    address=form.cleaned_data['address'],
+                    phone_number=form.cleaned_data['phone_number'],
                 )
-            cart_items.delete()  # Изчистваме количката
+            except EmptyCartError:
+                messages.error(request, "Количката ви е празна.")
+                return redirect('view_cart')
+            except CartBusyError as exc:
+                messages.error(request, str(exc))
+                return render(request, 'accounts/checkout.html', {'form': form})
             return redirect('client_dashboard')
     else:
         form = CheckoutForm()
@@ -635,13 +785,25 @@ def track_orders(request):
     Returns:
         HttpResponse: Пренасочва към 'home' при неоторизиран достъп.
         HttpResponse: Рендерира списък с поръчките на клиента.
+
+    Поръчките се показват на страници с keyset пагинация по (created_at, id):
+    параметърът `cursor` от GET сочи след последната показана поръчка, така че
+    цената на всяка страница е постоянна, колкото и назад да се превърта.
     """
     if not request.user.is_client:
         return redirect('home')  # Само клиенти могат да проследяват поръчки
-    client = Client.objects.get(user=request.user)
-    orders = Order.objects.filter(client=client).order_by('-created_at')
-    return render(request, 'accounts/track_orders.html', {'orders': orders})
-
+    orders = (
+        Order.objects.filter(client_id=request.user.pk)
+        .select_related('client__user')
+        .prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+    )
+    try:
+        page = keyset_paginate(orders, request.GET.get('cursor'), page_size=ORDER_HISTORY_PAGE_SIZE)
+    except InvalidCursor:
+        page = keyset_paginate(orders, page_size=ORDER_HISTORY_PAGE_SIZE)
+    return render(request, 'accounts/track_orders.html', {'orders': page.object_list, 'page': page})
+
+@replica_reads
 def turnover_report(request):
     """
     Генерира отчет за оборота за определен период (за администратори).
@@ -657,7 +819,7 @@ def turnover_report(request):
     end_date = request.GET.get('end_date')
 
     # Инициализиране на променливи
-    delivered_orders = None
+    daily_turnover = None
     total_turnover = 0
 
     if start_date and end_date:
@@ -666,23 +828,20 @@ def turnover_report(request):
             start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
             end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
 
-            # Филтриране на поръчки според периода и статус "Доставена"
-            delivered_orders = Order.objects.filter(
-                status='delivered',
-                created_at__range=(start_date, end_date)
-            )
+            # Оборот по дни от предварително агрегираните обобщения
+            daily_turnover = list(turnover_by_day(start_date, end_date))
 
             # Изчисляване на общия оборот
-            total_turnover = delivered_orders.aggregate(total=Sum('total_price'))['total'] or 0
+            total_turnover = sum(row['total'] for row in daily_turnover)
 
         except ValueError:
             # Ако датите са невалидни, задаваме празни стойности
-            delivered_orders = None
+            daily_turnover = None
             total_turnover = 0
 
     # Подаване на контекста към шаблона
     context = {
-        'delivered_orders': delivered_orders,
+        'daily_turnover': daily_turnover,
         'total_turnover': total_turnover,
         'start_date': start_date,
         'end_date': end_date,
@@ -706,6 +865,7 @@ def admin_dashboard(request):
 
     return render(request, 'accounts/admin_dashboard.html')
 
+@replica_reads
 def generate_turnover_report(request):
     """
     Генерира отчет за оборота за избран период (за администратори).
@@ -726,20 +886,17 @@ def generate_turnover_report(request):
             start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
             end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
 
-            # Филтриране на доставените поръчки за периода
-            delivered_orders = Order.objects.filter(
-                status='delivered',
-                created_at__range=(start_date, end_date)
-            )
+            # Оборот по дни от предварително агрегираните обобщения
+            daily_turnover = list(turnover_by_day(start_date, end_date))
 
             # Изчисляване на общия оборот
-            total_turnover = delivered_orders.aggregate(total=Sum('total_price'))['total'] or 0
+            total_turnover = sum(row['total'] for row in daily_turnover)
 
             # Подготвяме контекст за шаблона
             context = {
                 'title': 'Справка за оборот',
                 'opts': Order._meta,
-                'delivered_orders': delivered_orders,
+                'daily_turnover': daily_turnover,
                 'total_turnover': total_turnover,
                 'start_date': start_date,
                 'end_date': end_date,
@@ -752,6 +909,7 @@ def generate_turnover_report(request):
     # Ако няма дати, показваме формата за избор на период
     return render(request, 'admin/turnover_report_form.html')
 
+@replica_reads
 def earnings_report(request, delivery_person_id):
     """
     Генерира отчет за приходите на доставчик.
@@ -762,16 +920,27 @@ def earnings_report(request, delivery_person_id):
 
     Returns:
         HttpResponse: Рендерира отчет с приходите на доставчика.
+
+    Доставените поръчки се показват на страници (keyset по created_at, id),
+    както в track_orders, с артикулите им в две допълнителни заявки.
     """
     delivery_person = get_object_or_404(DeliveryPerson, pk=delivery_person_id)
-    orders = Order.objects.filter(delivery_person=delivery_person, status='delivered')
-
-    # Изчисляване на общия оборот
-    total_turnover = sum(order.total_price for order in orders) / 2
+    orders = (
+        Order.objects.filter(delivery_person=delivery_person, status='delivered')
+        .prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+    )
+    try:
+        page = keyset_paginate(orders, request.GET.get('cursor'), page_size=ORDER_HISTORY_PAGE_SIZE)
+    except InvalidCursor:
+        page = keyset_paginate(orders, page_size=ORDER_HISTORY_PAGE_SIZE)
+
+    # Общият оборот идва от журнала - всяка доставка е отчетена точно веднъж
+    total_turnover = courier_totals(delivery_person.pk)['turnover']
 
     context = {
         'delivery_person': delivery_person,
-        'orders': orders,
+        'orders': page.object_list,
+        'page': page,
         'total_turnover': total_turnover,
     }
     return render(request, 'admin/earnings_report.html', context)
\ No newline at end of file